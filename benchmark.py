@@ -0,0 +1,312 @@
+import argparse
+import concurrent.futures
+import csv
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import zlib
+
+import stancedetection_code as sd
+
+
+# Wortschatz der synthetischen Beiträge und Kommentare
+WORDS = [
+    "Platz", "Straße", "Radweg", "Bäume", "Spielplatz", "Bänke", "Parkraum", "Verkehr", "Nachbarschaft", "Grünfläche",
+    "Beleuchtung", "Sicherheit", "Lärm", "Fußweg", "Haltestelle", "Markt", "Wiese", "Kinder", "Anwohner", "Aufenthaltsqualität",
+    "sollte", "könnte", "muss", "wäre", "ist", "wird", "leider", "dringend", "endlich", "besser", "sauberer", "ruhiger",
+    "mehr", "weniger", "neue", "breitere", "sichere", "schöne", "nicht", "auch", "und", "aber", "oder", "für", "mit", "ohne"
+]
+
+def generateText(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words))).capitalize() + "."
+
+def generateJoinInput(num_contributions: int, num_comments: int, seed: int = 0) -> tuple:
+    """
+    Erzeugt synthetische Beiträge und Kommentare in der Form, wie sie von importCons und importComs geliefert werden.
+
+    Parameters:
+        num_contributions: Anzahl der Beiträge
+        num_comments: Anzahl der Kommentare, die zufällig auf die Beiträge verteilt werden.
+        seed: Startwert des Zufallsgenerators für reproduzierbare Daten.
+
+    Returns:
+        contributions, comments: Dictionaries der Form {BID: Beitragsinhalt} und {KID: {BID: Kommentarinhalt}}.
+    """
+
+    rng = random.Random(seed)
+    contributions = {contribution_id: f"Beitrag {contribution_id}" for contribution_id in range(1, num_contributions + 1)}
+    comments = {
+        str(100000 + comment_id): {
+            "Beitragsnummer": str(rng.randint(1, num_contributions)),
+            "Kommentartext": f"Kommentar {comment_id}"
+        }
+        for comment_id in range(num_comments)
+    }
+
+    return contributions, comments
+
+def writeCorpus(directory: str, num_comments: int, seed: int = 0, formats: list = ('xlsx', 'csv')) -> dict:
+    """
+    Schreibt einen synthetischen Korpus im Format der Exporte der Beteiligungsportale: Beiträge als Excel- bzw. CSV-Datei
+    und Kommentare als JSON-Datei. Das Verhältnis von Beiträgen zu Kommentaren beträgt etwa 1:10.
+    Excel-Dateien erfordern pandas und openpyxl; fehlen diese, wird das Format übersprungen.
+
+    Parameters:
+        directory: Verzeichnis, in dem die Dateien abgelegt werden.
+        num_comments: Anzahl der Kommentare
+        seed: Startwert des Zufallsgenerators für reproduzierbare Daten.
+        formats: Formate der Beitragsdatei ('xlsx' und/oder 'csv').
+
+    Returns:
+        paths: Dictionary der Form {Format: Dateipfad} der geschriebenen Beitragsdateien und der Kommentardatei ('json').
+    """
+
+    rng = random.Random(seed)
+    num_contributions = max(num_comments // 10, 1)
+    contributions = [(contribution_id, generateText(rng, 30, 120)) for contribution_id in range(1, num_contributions + 1)]
+    paths = {}
+
+    # Beiträge mit den Spalten, die importCons erwartet
+    if 'csv' in formats:
+        paths['csv'] = os.path.join(directory, f'beitraege_{num_comments}.csv')
+        with open(paths['csv'], 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(["contribution_id", "contribution_content"])
+            writer.writerows(contributions)
+    if 'xlsx' in formats:
+        try:
+            import pandas as pd
+            path = os.path.join(directory, f'beitraege_{num_comments}.xlsx')
+            pd.DataFrame(contributions, columns=["contribution_id", "contribution_content"]).to_excel(path, index=False)
+            paths['xlsx'] = path
+        except ImportError as error:
+            print(f"Die Excel-Datei wird nicht erzeugt: {error}")
+
+    # Kommentare als Array von Objekten der Form {KID: {"text": ..., "related_node_id": ...}}
+    paths['json'] = os.path.join(directory, f'kommentare_{num_comments}.json')
+    with open(paths['json'], 'w', encoding='utf-8') as file:
+        file.write('[')
+        for comment_id in range(num_comments):
+            comment = {str(100000 + comment_id): {"text": generateText(rng, 5, 80), "related_node_id": str(rng.randint(1, num_contributions))}}
+            file.write((',' if comment_id else '') + json.dumps(comment, ensure_ascii=False))
+        file.write(']')
+
+    return paths
+
+class FakePipe:
+    """
+    Deterministischer Ersatz der Pipeline für Benchmarks ohne GPU und Netzwerk. Die Antworten folgen dem Format der Prompts
+    (Hauptaussagen, Polarität bzw. nummerierte Polaritäten) und hängen nur vom Prompt ab. Die Laufzeit eines Aufrufs wird über
+    eine Wartezeit je Prompt-Token (Prefill) und je generiertem Token (Decoding) simuliert; bei gebündelter Verarbeitung
+    bestimmt die längste Antwort eines Batches die Anzahl der Decoding-Schritte. Tokens werden als vier Zeichen gezählt.
+    """
+
+    def __init__(self, token_latency: float = 0.0001, prefill_latency: float = 0.0, targets_per_contribution: int = 3):
+        self.token_latency = token_latency
+        self.prefill_latency = prefill_latency
+        self.targets_per_contribution = targets_per_contribution
+
+    def answer(self, prompt: str) -> str:
+        digest = zlib.crc32(prompt.encode('utf-8'))
+        ending = prompt.rstrip()
+
+        if ending.endswith('Hauptaussagen:'):
+            return "\n".join(f"{number}. Aussage {digest % 9973}-{number}" for number in range(1, self.targets_per_contribution + 1))
+        if ending.endswith('Polaritäten:'):
+            count = len(re.findall(r'\n\s*\d+\. ', ending[ending.rfind('Kommentare:'):]))
+            return "\n".join(f"{number}. {sd.STANCE_LABELS[(digest + number) % len(sd.STANCE_LABELS)]}" for number in range(1, count + 1))
+        return f"{sd.STANCE_LABELS[digest % len(sd.STANCE_LABELS)]}\nBegründung {digest % 997}"
+
+    def simulate(self, prompts: list, answers: list) -> None:
+        prompt_tokens = sum(len(prompt) for prompt in prompts) / 4
+        decode_steps = max(len(answer) for answer in answers) / 4
+        time.sleep(prompt_tokens * self.prefill_latency + decode_steps * self.token_latency)
+
+    def __call__(self, prompts, batch_size: int = None, **kwargs):
+        if isinstance(prompts, str):
+            answer = self.answer(prompts)
+            self.simulate([prompts], [answer])
+            return [{"generated_text": prompts + answer}]
+        return self.iterate(prompts, batch_size)
+
+    def iterate(self, prompts, batch_size: int = None):
+        prompt_iter = iter(prompts)
+        while True:
+            batch = [prompt for _, prompt in zip(range(max(batch_size or 1, 1)), prompt_iter)]
+            if not batch:
+                break
+            answers = [self.answer(prompt) for prompt in batch]
+            self.simulate(batch, answers)
+            for prompt, answer in zip(batch, answers):
+                yield [{"generated_text": prompt + answer}]
+
+def loadTinyPipe(model_id: str, max_new_tokens: int = 16):
+    """
+    Lädt ein kleines lokales Modell ohne Quantisierung als Pipeline, z. B. für Messungen auf der CPU.
+    Die Antworten folgen nicht zwingend dem Format der Prompts (siehe runScale).
+    """
+
+    import transformers
+
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_id)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = 'left'
+
+    return transformers.pipeline("text-generation", model=model_id, tokenizer=tokenizer, max_new_tokens=max_new_tokens, do_sample=False)
+
+def runScale(num_comments: int, directory: str, options: dict) -> dict:
+    """
+    Führt alle Stufen der Stance Detection für einen synthetischen Korpus durch und erfasst die Kennzahlen je Stufe.
+
+    Parameters:
+        num_comments: Anzahl der Kommentare des Korpus
+        directory: Arbeitsverzeichnis für Korpus und Ergebnisdateien.
+        options: Dictionary der Optionen (siehe Kommandozeilenparameter).
+
+    Returns:
+        result: Dictionary mit der Anzahl verarbeiteter Einheiten je Stufe, dem Zuwachs des Peak RSS je Stufe und dem Bericht von RunMetrics.
+    """
+
+    paths = writeCorpus(directory, num_comments, options['seed'], options['formats'])
+    metrics = sd.RunMetrics()
+    units, rss_growth = {}, {}
+
+    def stage(name, count_units):
+        before = sd.RunMetrics.peakRss()
+        with metrics.stage(name):
+            value = count_units()
+        rss_growth[name] = round(metrics.stages[name]['peak_rss_mb'] - before, 1) if before is not None else None
+        return value
+
+    # Einlesen der Beiträge je Format; Excel zunächst ohne und anschließend mit vorhandener spaltenorientierter Kopie
+    if 'xlsx' in paths:
+        for cache_file in (paths['xlsx'] + '.arrow', paths['xlsx'] + '.arrow.json'):
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+    contributions = None
+    for extension in [extension for extension in ('xlsx', 'csv') if extension in paths]:
+        for name in [f'import_contributions_{extension}'] + ([f'import_contributions_{extension}_cached'] if extension == 'xlsx' else []):
+            contributions = stage(name, lambda: sd.importCons(paths[extension]))
+            units[name] = len(contributions)
+    if contributions is None:
+        print("Die Beiträge konnten in keinem Format eingelesen werden.")
+        return None
+
+    entries = stage('import_comments', lambda: sd.importJoinedComs(contributions, paths['json']))
+    units['import_comments'] = num_comments
+
+    # Target Identification für Beiträge mit Kommentaren
+    if options['model_id']:
+        pipe = stage('load_model', lambda: loadTinyPipe(options['model_id'], options['max_new_tokens']))
+        metrics.token_counter = sd.TokenCounter(pipe.tokenizer)
+    else:
+        pipe = FakePipe(options['token_latency'], options['prefill_latency'], options['targets_per_contribution'])
+    target_contributions = {con_id: entry['Beitrag'] for con_id, entry in entries.items()}
+    prompts = sd.generatePromptsForTargetIdentification(target_contributions)
+    targets = stage('targets', lambda: sd.extractTargetsInContributions(prompts, pipe, metrics=metrics))
+    units['targets'] = len(prompts)
+
+    # Begrenzung auf eine feste Anzahl an Hauptaussagen, damit die Anzahl der Paare bei einem echten Modell vergleichbar bleibt
+    limit = options['targets_per_contribution']
+    targets = {con_id: (statements + [f"Aussage {number}" for number in range(len(statements), limit)])[:limit] for con_id, statements in targets.items()}
+
+    # Die Prompts der Stance Detection werden wie in main erst bei ihrer Verarbeitung erzeugt
+    stance_prompts = sd.generatePromptsForStanceDetection(targets, entries)
+    stage('stance', lambda: sd.saveStance(stance_prompts, pipe, contributions, os.path.join(directory, f'Stance_{num_comments}.csv'),
+                                          batch_size=options['batch_size'], pack_size=options['pack_size'], metrics=metrics,
+                                          token_counter=metrics.token_counter))
+    units['stance'] = sd.countStancePrompts(targets, entries)
+
+    return {'comments': num_comments, 'units': units, 'rss_growth_mb': rss_growth, 'metrics': metrics.report()}
+
+def benchmarkPipeline(scales: list, options: dict, output_file: str = None) -> None:
+    """
+    Misst alle Stufen der Stance Detection für synthetische Korpora verschiedener Größe und gibt Durchsatz und
+    Arbeitsspeicher je Stufe tabellarisch aus. Jede Datenmenge wird in einem eigenen Prozess gemessen, damit sich die
+    Spitzenwerte des Arbeitsspeichers nicht gegenseitig beeinflussen.
+
+    Parameters:
+        scales: Liste der Anzahl an Kommentaren, für die gemessen wird.
+        options: Dictionary der Optionen (siehe Kommandozeilenparameter).
+        output_file: Optionaler Pfad zur JSON-Datei, in der die Ergebnisse gespeichert werden.
+    """
+
+    directory = options['directory'] or tempfile.mkdtemp(prefix='stance_benchmark_')
+    os.makedirs(directory, exist_ok=True)
+    results = []
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        for num_comments in scales:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(runScale, num_comments, directory, options).result()
+            if result is None:
+                continue
+            results.append(result)
+
+            print(f"\n{num_comments} Kommentare")
+            print(f"{'Stufe':<34} {'Laufzeit [s]':>12} {'Einheiten':>10} {'Einheiten/s':>12} {'Tokens/s':>10} {'Peak RSS [MB]':>14} {'Zuwachs [MB]':>13}")
+            for name, stage in result['metrics']['stages'].items():
+                count = result['units'].get(name, 0)
+                rate = count / stage['wall_time_s'] if stage['wall_time_s'] else 0.0
+                tokens = stage['generated_tokens_per_s'] or 0.0
+                print(f"{name:<34} {stage['wall_time_s']:>12.3f} {count:>10} {rate:>12.1f} {tokens:>10.1f} {stage['peak_rss_mb'] or 0:>14.1f} {result['rss_growth_mb'][name] or 0:>13.1f}")
+    finally:
+        if not options['directory']:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as file:
+            json.dump({'options': options, 'results': results}, file, ensure_ascii=False, indent=2)
+
+def benchmarkJoin(scales: list, repeat: int = 3) -> None:
+    """
+    Misst die Laufzeit von joinConsComs für verschiedene Datenmengen und gibt sie tabellarisch aus.
+    Das Verhältnis von Beiträgen zu Kommentaren beträgt wie in den Exporten der Beteiligungsportale etwa 1:10.
+
+    Parameters:
+        scales: Liste der Anzahl an Kommentaren, für die gemessen wird.
+        repeat: Anzahl der Wiederholungen je Datenmenge; ausgegeben wird die kürzeste Laufzeit.
+    """
+
+    print(f"{'Beiträge':>10} {'Kommentare':>12} {'Laufzeit [s]':>14} {'µs/Kommentar':>14}")
+    for num_comments in scales:
+        contributions, comments = generateJoinInput(max(num_comments // 10, 1), num_comments)
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            sd.joinConsComs(contributions, comments)
+            durations.append(time.perf_counter() - start)
+        duration = min(durations)
+        print(f"{len(contributions):>10} {num_comments:>12} {duration:>14.4f} {duration / num_comments * 1e6:>14.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark der Verarbeitungsschritte der Stance Detection mit synthetischen Daten.')
+    parser.add_argument("--suite", choices=['pipeline', 'join'], default='pipeline', help="Messung aller Stufen mit synthetischem Korpus oder nur des Joins")
+    parser.add_argument("--scales", type=int, nargs='+', default=[1000, 10000, 100000], help="Anzahl der Kommentare je Messung")
+    parser.add_argument("--repeat", type=int, default=3, help="Anzahl der Wiederholungen je Messung (nur Join)")
+    parser.add_argument("--formats", choices=['xlsx', 'csv'], nargs='+', default=['xlsx', 'csv'], help="Formate der Beitragsdatei")
+    parser.add_argument("--token_latency", type=float, default=0.0001, help="Simulierte Latenz je generiertem Token in Sekunden")
+    parser.add_argument("--prefill_latency", type=float, default=0.0, help="Simulierte Latenz je Prompt-Token in Sekunden")
+    parser.add_argument("--targets_per_contribution", type=int, default=3, help="Anzahl der Hauptaussagen je Beitrag")
+    parser.add_argument("--batch_size", type=int, default=1, help="Anzahl der gebündelt verarbeiteten Prompts in der Stance Detection")
+    parser.add_argument("--pack_size", type=int, default=1, help="Maximale Anzahl der Kommentare je Prompt der Stance Detection")
+    parser.add_argument("--model_id", type=str, default=None, help="Kleines lokales Modell statt der simulierten Pipeline")
+    parser.add_argument("--max_new_tokens", type=int, default=16, help="Maximale Anzahl generierter Tokens des lokalen Modells")
+    parser.add_argument("--seed", type=int, default=0, help="Startwert des Zufallsgenerators für den Korpus")
+    parser.add_argument("--directory", type=str, default=None, help="Verzeichnis für Korpus und Ergebnisse (Standard: temporäres Verzeichnis)")
+    parser.add_argument("--output", type=str, default=None, help="Pfad zur JSON-Datei mit den Ergebnissen")
+    args = parser.parse_args()
+
+    if args.suite == 'join':
+        benchmarkJoin(args.scales, args.repeat)
+    else:
+        options = {key: getattr(args, key) for key in ('formats', 'token_latency', 'prefill_latency', 'targets_per_contribution', 'batch_size',
+                                                       'pack_size', 'model_id', 'max_new_tokens', 'seed', 'directory')}
+        benchmarkPipeline(args.scales, options, args.output)
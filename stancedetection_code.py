@@ -1,31 +1,237 @@
 import argparse
+import asyncio
+import contextlib
+import copy
+import gc
 import csv
+import hashlib
 import html
+import http.client
+import itertools
+import heapq
 import json
-import pandas as pd
-import transformers
-from huggingface_hub import login
-from torch import bfloat16
+import multiprocessing
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+# Parameter der Textgenerierung, die von der Pipeline und der Generierung mit Präfix-Cache gemeinsam genutzt werden
+GENERATION_KWARGS = {'temperature': 0.7, 'max_new_tokens': 500, 'repetition_penalty': 1.1}
+
+# Datentyp der Gewichte beim Laden des LLM auf die CPU (ohne Quantisierung, siehe loadLLM); halbiert den Speicherbedarf gegenüber float32
+CPU_TORCH_DTYPE = 'bfloat16'
+
+# Zulässige Polaritäten der Stance Detection
+STANCE_LABELS = ['Zustimmung', 'Widerspruch', 'Neutralität']
+
+# Statischer System-Prompt für die Target Identification mit allgemeinen Informationen für das LLM
+TI_SYSTEM = """
+    <s>[INST] <<SYS>>
+    Du bist ein hilfreicher, respektvoller und ehrlicher Assistent eines Stadtplaners.
+    Deine Aufgabe ist es, aus Beiträgen die enthaltenen Hauptaussagen herauszuarbeiten.
+    Fasse die Hauptaussagen auf Deutsch und stichpunktartig zusammen.
+    Stelle sicher, dass jede Hauptaussage entweder ein Problem, ein Lob oder ein Vorschlag ist.
+    Es sind ausschließlich diese Kategorien zulässig. Andere Kategorien sollen nicht ausgegeben werden.
+    Die Hauptaussagen sollen als nummerierte Liste ausgegeben werden.
+
+    Definitionen:
+    - Problem: Eine negative Beobachtung, ein Hindernis oder eine Gefahr, das bzw. die angesprochen wird.
+    - Lob: Positive Rückmeldung oder Anerkennung für etwas, das gut funktioniert.
+    - Vorschlag: Vorschläge oder Ideen zur Verbesserung einer Situation.
+    <</SYS>>
+    """
+
+# Statischer Beispiel-Prompt für die Target Identification mit einer Beispielaufgabe für das LLM
+TI_EXAMPLE = """
+    Ermittle die Hauptaussagen des folgenden Beitrages.
+    Beitrag:
+    Der Erdkampsweg ist zwischen Ratsmühlendamm und Wacholderstraße das gewerbliche Zentrum von Fuhlsbüttel. In den letzten Jahren wurde viel erreicht durch neue Aufpflasterungen, Bänke und zaghafte Schritte zur Verkehrsberuhigung.
+    Bei Neubauten wie zuletzt dem ReweCity wird leider immer noch Parkraum geschaffen, der die Fußwege kreuzt. Ein verkehrsberuhigtes, fußgänger- und radfahrerfreundliches Fuhlsbüttel könnte die Lebensqualität noch einmal erhöhen.
+    [/INST]
+    Hauptaussagen:
+    1. Aufwertung des Erdkampsweg (Lob)
+    2. Parkraum bei Neubauten kreuzt Fußwege (Problem)
+    3. Verkehrsberuhigung (Vorschlag)
+    """
+
+# Statischer System-Prompt für die Stance Detection mit allgemeinen Informationen für das LLM
+SD_SYSTEM = """
+        <s>[INST] <<SYS>>
+        Du bist ein hilfreicher, respektvoller und ehrlicher Assistent eines Stadtplaners.
+        Deine Aufgabe ist es zu bewerten, wie ein Kommentar sich zu einer Hauptaussage positioniert.
+        Gib diese Polarität auf Deutsch wieder.
+        Stelle sicher, dass jede Polarität entweder Zustimmung, Widerspruch oder Neutralität ist.
+        Es sind ausschließlich diese Polaritäten zulässig. Andere Polaritäten sollen nicht ausgegeben werden.
+        Gib ausschließlich die Polarität aus. Andere Ergebnisse sollen nicht ausgegeben werden.
+
+        Definitionen:
+        - Zustimmung: Der Kommentar stimmt der Hauptaussage zu oder zeigt eine positive Reaktion auf den Inhalt der Hauptaussage. Das Problem, das Lob oder der Vorschlag wird befürwortet.
+        - Widerspruch: Der Kommentar widerspricht der Hauptaussage oder zeigt eine negative Reaktion auf den Inhalt der Hauptaussage. Das Problem, das Lob oder der Vorschlag wird abgelehnt.
+        - Neutralität: Der Kommentar thematisiert die Hauptaussage nicht und stellt keinen Bezug zu ihr her.
+        <</SYS>>
+        """
+
+# Statischer Beispiel-Prompt für die Stance Detection
+SD_EXAMPLE = """
+        Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
+        Hauptaussage:
+        - Gehwege in schlechtem Zustand (Problem)
+        Kommentar:
+        - Einige Gehwege sind in schlechtem Zustand mit Stolperfallen durch Unebenheiten und teilweise abschüssig und sollten dringend saniert werden.
+        [/INST]
+        Polarität:
+        Zustimmung
+        [INST]
+        Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
+        Hauptaussage:
+        - Lärmbelästigung durch Feuerwehreinsätze (Problem)
+        Kommentar:
+        - Die Feuerwehr fährt mit Sicherheit nicht mega schnell - man sollte froh sein, dass diese schnell zum Einsatzort fahren kann und die „Lärmbelästigung „ ist auch nicht wirklich gegeben da oft - gerade in der Nacht - auf das Martinshorn verzichtet wird !
+        [/INST]
+        Polarität:
+        Widerspruch
+        [INST]
+        Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
+        Hauptaussage:
+        - Fehlende Parkmöglichkeit für Lastenräder und mit Verankerung (Problem)
+        Kommentar:
+        - Mich stören schon E-Roller. Bitte keine klobigen Drahtesel überall im Stadtbild.
+        [/INST]
+        Polarität:
+        Neutralität
+        """
+
+
+def fileHash(file_path: str) -> str:
+    '''
+    Berechnet den SHA-256-Hash einer Datei.
+    '''
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def writeJsonAtomic(file_path: str, data) -> None:
+    '''
+    Schreibt eine JSON-Datei zunächst unter einem temporären Namen und ersetzt anschließend die Zieldatei, sodass bei einem
+    Abbruch keine unvollständige Datei zurückbleibt.
+    '''
+
+    with open(file_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(file_path + '.tmp', file_path)
+
+def readExcelCached(con_file: str, columns: list):
+    '''
+    Liest die benötigten Spalten einer Excel-Datei ein. Beim ersten Einlesen wird eine spaltenorientierte Kopie (Arrow IPC)
+    neben der Excel-Datei abgelegt, die bei späteren Aufrufen per Memory-Mapping gelesen wird. Die Kopie wird verworfen,
+    sobald sich Änderungszeitpunkt bzw. Größe und Hash der Excel-Datei ändern. Ohne pyarrow wird die Excel-Datei direkt gelesen.
 
+    Parameters:
+        con_file: Dateipfad zur Excel-Datei
+        columns: Liste der benötigten Spalten
+
+    Returns:
+        df: DataFrame mit den benötigten Spalten
+    '''
+    import pandas as pd
 
+    try:
+        import pyarrow
+        from pyarrow import feather
+    except ImportError:
+        return pd.read_excel(con_file, usecols=columns)
+
+    cache_file = con_file + '.arrow'
+    meta_file = cache_file + '.json'
+    stat = os.stat(con_file)
+    source = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+    # Prüfung der zwischengespeicherten Kopie: zunächst über Änderungszeitpunkt und Größe, bei Abweichung über den Hash.
+    # Eine unlesbare Metadaten-Datei wird wie eine veraltete Kopie behandelt.
+    if os.path.exists(cache_file) and os.path.exists(meta_file):
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            meta = None
+        valid = isinstance(meta, dict) and meta.get('columns') == columns and {key: meta.get(key) for key in source} == source
+        if not valid and isinstance(meta, dict) and meta.get('columns') == columns and meta.get('size') == source['size']:
+            valid = meta.get('sha256') == fileHash(con_file)
+            if valid:
+                try:
+                    writeJsonAtomic(meta_file, dict(meta, **source))
+                except OSError:
+                    pass
+        if valid:
+            return feather.read_table(cache_file, columns=columns, memory_map=True).to_pandas()
+
+    # Einlesen der Excel-Datei und Ablegen der spaltenorientierten Kopie (unkomprimiert, damit sie per Memory-Mapping lesbar ist)
+    df = pd.read_excel(con_file, usecols=columns)
+    try:
+        feather.write_feather(df, cache_file + '.tmp', compression='uncompressed')
+        os.replace(cache_file + '.tmp', cache_file)
+        writeJsonAtomic(meta_file, dict(source, columns=columns, sha256=fileHash(con_file)))
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OSError) as error:
+        print(f"Die Beitrags-Datei '{con_file}' konnte nicht zwischengespeichert werden: {error}")
 
-def importCons(con_file: str) -> dict:
+    return df
+
+def importCons(con_file: str, use_cache: bool = True) -> dict:
     '''
-    Importiert der Kommentare für die Stance Detection aus einer Excel-Datei.
+    Importiert der Kommentare für die Stance Detection aus einer Excel-, CSV- oder Parquet-Datei.
 
     Parameters:
         file_path: Dateipfad zum Import der Beiträge
+        use_cache: Gibt an, ob Excel-Dateien über eine zwischengespeicherte spaltenorientierte Kopie gelesen werden (siehe readExcelCached).
 
     Returns:
         contDict: Dictionary der Form {BID: Beitragsinhalt} bestehend aus Beitrags-ID und zugehörigem Beitragstext
     '''
+    # Prüfung vor dem Import von pandas, damit eine fehlende Datei auch ohne pandas gemeldet wird
+    if not os.path.isfile(con_file):
+        print(f"Die Beitrags-Datei '{con_file}' konnte nicht gefunden werden.")
+        return None
+
+    import pandas as pd
+
     try:
 
-        # Einlesen der Excel-Datei
-        df = pd.read_excel(con_file)
+        columns = ["contribution_id", "contribution_content"]
+        extension = os.path.splitext(con_file)[1].lower()
+
+        # Einlesen der benötigten Spalten der Beitrags-Datei
+        if extension == '.csv':
+            with open(con_file, 'r', newline='', encoding='utf-8') as file:
+                header = file.readline()
+            # Ermittlung des Trennzeichens aus der Kopfzeile; ist dies nicht möglich (z. B. nur eine Spalte), wird ',' angenommen
+            try:
+                delimiter = csv.Sniffer().sniff(header, delimiters=',;\t').delimiter
+            except csv.Error:
+                delimiter = ','
+            df = pd.read_csv(con_file, sep=delimiter, usecols=columns)
+        elif extension == '.parquet':
+            df = pd.read_parquet(con_file, columns=columns)
+        elif use_cache:
+            df = readExcelCached(con_file, columns)
+        else:
+            df = pd.read_excel(con_file, usecols=columns)
+
         # Import der Beiträe (Beitrags-ID und Beitragstext) und Hinzufügen zum Beitrags-Dictionary
         df = df.sort_values(by=["contribution_id"])
-        contDict = {df.at[id, "contribution_id"]: df.at[id, "contribution_content"] for id in df.index}
+        contDict = dict(zip(df["contribution_id"].tolist(), df["contribution_content"].tolist()))
 
         return contDict
     
@@ -36,6 +242,70 @@ def importCons(con_file: str) -> dict:
 
         return None
 
+    except ValueError as error:
+
+        # Fehlermeldung, sofern die benötigten Spalten in der Datei mit Beiträgen fehlen
+        print(f"Die Beitrags-Datei '{con_file}' enthält nicht die Spalten {', '.join(columns)}: {error}")
+
+        return None
+
+def streamComs(com_file: str, chunk_size: int = 1 << 20, max_element_size: int = 16 << 20):
+    '''
+    Liest die Kommentare einer JSON-Datei schrittweise ein, ohne die gesamte Datei in den Speicher zu laden.
+    Das Array auf oberster Ebene wird dazu Element für Element dekodiert; die Kommentartexte werden direkt entschlüsselt.
+    Ein fehlerhaftes Element (z. B. eine nicht geschlossene Zeichenfolge) führt spätestens nach max_element_size Zeichen zu einem
+    json.JSONDecodeError, sodass der Puffer nicht bis zum Ende der Datei anwächst.
+
+    Parameters:
+        com_file: Dateipfad zur JSON-Datei, Kommentardatei.
+        chunk_size: Anzahl der Zeichen, die je Lesevorgang eingelesen werden.
+        max_element_size: Maximale Anzahl der Zeichen eines Elements des Arrays.
+
+    Returns:
+        Generator, der Tupel aus Kommentar-ID, zugehöriger Beitrags-ID (RelatedNode-ID) und Kommentartext liefert.
+    '''
+
+    decoder = json.JSONDecoder()
+
+    with open(com_file, "r") as commentFile:
+        buffer = commentFile.read(chunk_size)
+        position = 0
+        eof = not buffer
+
+        while True:
+            # Überspringen der öffnenden Klammer des Arrays sowie von Leerzeichen und Trennzeichen zwischen den Elementen
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            try:
+                com, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Unvollständiges Element am Ende des Puffers: Nachladen des nächsten Abschnitts
+                if eof:
+                    if buffer[position:].strip():
+                        raise
+                    return
+                # Begrenzung des Puffers auf ein Element der maximalen Größe zuzüglich eines Abschnitts
+                if len(buffer) - position > max_element_size:
+                    raise json.JSONDecodeError(f"Element überschreitet die maximale Größe von {max_element_size} Zeichen", buffer, position)
+                chunk = commentFile.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            position = end
+            if com is not None:
+                # Import der Kommentare (Kommentar-ID, zugehöriger Beitrags-ID (RelatedNode-ID) und Kommentartext)
+                comment_id = next(iter(com))
+                comment_data = com[comment_id]
+                content = comment_data.get("text", "")
+                if content is not None:
+                    content = html.unescape(content)
+                yield comment_id, comment_data.get("related_node_id", ""), content
+
 def importComs(com_file: str) -> dict:
     '''
     Importiert der Kommentare für die Stance Detection aus einer JSON-Datei.
@@ -49,24 +319,10 @@ def importComs(com_file: str) -> dict:
     ''' 
     try:
 
-        # Einlesen der JSON-Datei
-        with open(com_file, "r") as commentFile:
-            comments = json.load(commentFile)
-
+        # Einlesen der JSON-Datei und Hinzufügen der Kommentare samt ihrer Daten zum Kommentar-Dictionary
         comDict = {}
-
-        # Iteration über die Kommentare
-        for com in comments:
-            if com is not None:
-                # Import der Kommentare (Kommentar-ID, zugehöriger Beitrags-ID (RelatedNode-ID) und Kommentartext)
-                comment_id = next(iter(com))
-                comment_data = com[comment_id]
-                contribution_id = comment_data.get("related_node_id", "")
-                content = comment_data.get("text", "")
-                if content is not None:
-                    content = html.unescape(content)
-                # Hinzufügen der Kommentare samt ihrer Daten zum Kommentar-Dictionary
-                comDict[comment_id] = {"Beitragsnummer": contribution_id, "Kommentartext": content}
+        for comment_id, contribution_id, content in streamComs(com_file):
+            comDict[comment_id] = {"Beitragsnummer": contribution_id, "Kommentartext": content}
 
         return comDict
     
@@ -90,24 +346,67 @@ def joinConsComs(contributions: dict, comments: dict) -> dict:
         joinedData: Dictionary, das Beitrag-IDs Beitragsinhalte sowie alle zugehörigen Kommentare zuodrnet. Es hat die Form
             {Beitrags-ID: {Beitragstext: {Kommentar-ID: Kommentartext}}}.
 
+    """
+
+    comment_stream = ((comment_id, comment_data['Beitragsnummer'], comment_data['Kommentartext']) for comment_id, comment_data in comments.items())
+
+    return joinConsComStream(contributions, comment_stream)
+
+def joinConsComStream(contributions: dict, comment_stream) -> dict:
+    """
+    Fügt Beiträge und die Kommentare eines Kommentar-Streams (siehe streamComs) über die Beitrags-ID zusammen.
+    Es werden nur Kommentare zu vorhandenen Beiträgen vorgehalten; Beiträge ohne zugehörigen Kommentar werden aussortiert.
+
+    Parameters:
+        contributions: Dictionary mit Beiträgen der Form {BID: Beitragsinhalt}
+        comment_stream: Iterator über Tupel aus Kommentar-ID, Beitrags-ID und Kommentartext.
+
+    Returns:
+        joinedData: Dictionary der Form {Beitrags-ID: {Beitragstext: {Kommentar-ID: Kommentartext}}} (siehe joinConsComs).
+
     """
     joinedData = {}
 
-    # Iteration über die Beiträge
+    # Aufbau eines Index von Beitrags-ID zu den zugehörigen Kommentaren in einem einzigen Durchlauf über die Kommentare.
+    # Die Beitrags-IDs werden dabei einheitlich als Zeichenfolge geführt, sodass auch im JSON als Zahl angegebene Beitrags-IDs
+    # (related_node_id) zugeordnet werden.
+    comments_by_contribution = {str(contribution_id): {} for contribution_id in contributions}
+    for comment_id, contribution_id, content in comment_stream:
+        comments_to_contrib = comments_by_contribution.get(str(contribution_id))
+        if comments_to_contrib is not None:
+            comments_to_contrib[comment_id] = content
+
+    # Iteration über die Beiträge und Aufnahme der Einträge, sofern Kommentare zum Beitrag existieren
     for contribution_id, contribution_content in contributions.items():
-        #Erstellen eines Eintrags für jeden Beitrag
-        joinedEntry = {'Beitrag': contribution_content, 'Kommentare': {}}
-        # Iteration über die Kommentare
-        for comment_id, comment_data in comments.items():
-            # Zuordnung der Kommentare zu ihrem jeweiligen Beitrag
-            if comment_data['Beitragsnummer'] == str(contribution_id):
-                joinedEntry['Kommentare'][comment_id] = comment_data['Kommentartext']
-        # Aufnahme der Einträge, sofern Kommentare zum Beitrag existieren
-        if joinedEntry['Kommentare']:
-            joinedData[contribution_id] = joinedEntry
+        comments_to_contrib = comments_by_contribution[str(contribution_id)]
+        if comments_to_contrib:
+            joinedData[contribution_id] = {'Beitrag': contribution_content, 'Kommentare': comments_to_contrib}
 
     return joinedData
 
+def importJoinedComs(contributions: dict, com_file: str) -> dict:
+    '''
+    Liest die Kommentare schrittweise aus einer JSON-Datei ein und ordnet sie direkt den Beiträgen zu (siehe joinConsComStream).
+    Im Gegensatz zu importComs und joinConsComs wird kein vollständiges Kommentar-Dictionary aufgebaut.
+
+    Parameters:
+        contributions: Dictionary mit Beiträgen der Form {BID: Beitragsinhalt}
+        com_file: Dateipfad zur JSON-Datei, Kommentardatei.
+
+    Returns:
+        joinedData: Dictionary der Form {Beitrags-ID: {Beitragstext: {Kommentar-ID: Kommentartext}}}.
+    '''
+    try:
+
+        return joinConsComStream(contributions, streamComs(com_file))
+
+    except FileNotFoundError:
+
+        # Fehlermeldung, sofern die Datei mit Kommentaren nicht gefunden werden konnte
+        print(f"Die Kommentar-Datei '{com_file}' konnte nicht gefunden werden.")
+
+        return None
+
 def loadApiKey(file_path: str) -> str:
     """
     Lädt den API-Schlüssel für den Zugriff auf das LLM über HuggingFace aus einer Textdatei.
@@ -134,32 +433,45 @@ def loadApiKey(file_path: str) -> str:
 
         return None
 
-def loadLLM(model_id: str):
+def loadLLM(model_id: str, device: str = None):
     """
     Lädt ein LLM und den zugehörigen Tokenizer von HuggingFace und initialisiert es.
 
     Parameters:
         model_id: Die Modell-ID aus dem HuggingFace-Hub.
+        device: Optionales Gerät, auf das das Modell vollständig geladen wird, z. B. 'cuda:1' für einen Worker-Prozess.
+            Mit 'cpu' wird das Modell ohne Quantisierung (bitsandbytes setzt eine GPU voraus) in CPU_TORCH_DTYPE geladen.
+            Ohne Angabe wird das quantisierte Modell automatisch auf die verfügbaren Geräte verteilt.
 
     Returns:
         pipe: Pipeline für die spätere Verarbeitungung der Prompts hinsichtlich Tokenisierung und Textgenerierung.
         
     """
-    # Quantisierung des Modells zur Reduktion der benötigten Ressourcen
-    bnb_config = transformers.BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type='nf4',
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_compute_dtype=bfloat16
-    )
+    import torch
+    import transformers
+
+    # Quantisierung des Modells zur Reduktion der benötigten Ressourcen; auf der CPU wird ohne Quantisierung geladen
+    if device == 'cpu':
+        model_kwargs = {'device_map': 'cpu', 'torch_dtype': getattr(torch, CPU_TORCH_DTYPE)}
+    else:
+        bnb_config = transformers.BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type='nf4',
+            bnb_4bit_use_double_quant=True,
+            bnb_4bit_compute_dtype=torch.bfloat16
+        )
+        model_kwargs = {'quantization_config': bnb_config, 'device_map': {'': device} if device else 'auto'}
 
     # Laden von Tokenizer und Modell unter der Quantisierung
     tokenizer = transformers.AutoTokenizer.from_pretrained(model_id)
+    # Padding-Token und linksseitiges Padding für die gebündelte Verarbeitung (Batches) von Prompts
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = 'left'
     llm = transformers.AutoModelForCausalLM.from_pretrained(
         model_id,
         trust_remote_code=True,
-        quantization_config=bnb_config,
-        device_map='auto',
+        **model_kwargs
     )
     llm.eval()
 
@@ -167,194 +479,1609 @@ def loadLLM(model_id: str):
     pipe = transformers.pipeline(
         model=llm, tokenizer=tokenizer,
         task='text-generation',
-        temperature=0.7,
-        max_new_tokens=500,
-        repetition_penalty=1.1
+        **GENERATION_KWARGS
     )
 
     return pipe
 
-def generatePromptsForTargetIdentification(cons: dict) -> dict:
+class BackendError(Exception):
+    """
+    Fehler bei einer Anfrage an ein Inferenz-Backend. transient gibt an, ob eine Wiederholung der Anfrage sinnvoll ist
+    (z. B. bei Überlastung des Servers oder Verbindungsabbrüchen).
     """
-    Generiert Prompts für die Ermittlung von Kernaussagen innerhalb von Beiträgen, welche die späteren Ziele (Targets) der Stance Detection bilden.
 
-    Parameters:
-        contribs: Dictionary mit Beiträgen {BID: Inhalt}
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message)
+        self.transient = transient
 
-    Returns:
-        prompt_dict: Dictionary der Form {BID: Prompt} bestehend aus Beitrags-IDs mit zugehörigen Prompts
-        zur Ermittlung der Kernaussagen.
+class OpenAICompatibleBackend:
     """
+    Inferenz-Backend für einen lokalen OpenAI-kompatiblen Server (z. B. llama.cpp-Server oder vLLM), das anstelle der
+    Pipeline von transformers verwendet werden kann. Wie die Pipeline nimmt es einen Prompt oder einen Iterator von Prompts
+    entgegen und liefert Ergebnisse der Form [{"generated_text": Prompt + Antwort}].
 
-    prompt_dict = {}
+    Die Anfragen werden über wiederverwendete Keep-Alive-Verbindungen gestellt; mehrere Prompts werden mittels asyncio
+    mit höchstens max_concurrency gleichzeitigen Anfragen verarbeitet.
+    """
 
-    # Statischer System-Prompt für die Target Identification mit allgemeinen Informationen für das LLM
-    ti_system = """
-    <s>[INST] <<SYS>>
-    Du bist ein hilfreicher, respektvoller und ehrlicher Assistent eines Stadtplaners.
-    Deine Aufgabe ist es, aus Beiträgen die enthaltenen Hauptaussagen herauszuarbeiten.
-    Fasse die Hauptaussagen auf Deutsch und stichpunktartig zusammen.
-    Stelle sicher, dass jede Hauptaussage entweder ein Problem, ein Lob oder ein Vorschlag ist.
-    Es sind ausschließlich diese Kategorien zulässig. Andere Kategorien sollen nicht ausgegeben werden.
-    Die Hauptaussagen sollen als nummerierte Liste ausgegeben werden.
+    def __init__(self, base_url: str, model: str, max_concurrency: int = 8, timeout: float = 600.0, api_key: str = None):
+        url = urllib.parse.urlsplit(base_url)
+        self.scheme = url.scheme or 'http'
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip('/') + '/v1/completions'
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json'}
+        if api_key:
+            self.headers['Authorization'] = f'Bearer {api_key}'
+        self.pool = []
+        self.pool_lock = threading.Lock()
+
+    def acquireConnection(self) -> tuple:
+        """
+        Liefert eine freie Verbindung aus dem Pool oder eine neue Verbindung sowie die Angabe, ob sie wiederverwendet wird.
+        """
 
-    Definitionen:
-    - Problem: Eine negative Beobachtung, ein Hindernis oder eine Gefahr, das bzw. die angesprochen wird.
-    - Lob: Positive Rückmeldung oder Anerkennung für etwas, das gut funktioniert.
-    - Vorschlag: Vorschläge oder Ideen zur Verbesserung einer Situation.
-    <</SYS>>
-    """
+        with self.pool_lock:
+            if self.pool:
+                return self.pool.pop(), True
 
-    # Statischer Beispiel-Prompt für die Target Identification mit einer Beispielaufgabe für das LLM
-    ti_example = """
-    Ermittle die Hauptaussagen des folgenden Beitrages.
-    Beitrag:
-    Der Erdkampsweg ist zwischen Ratsmühlendamm und Wacholderstraße das gewerbliche Zentrum von Fuhlsbüttel. In den letzten Jahren wurde viel erreicht durch neue Aufpflasterungen, Bänke und zaghafte Schritte zur Verkehrsberuhigung.
-    Bei Neubauten wie zuletzt dem ReweCity wird leider immer noch Parkraum geschaffen, der die Fußwege kreuzt. Ein verkehrsberuhigtes, fußgänger- und radfahrerfreundliches Fuhlsbüttel könnte die Lebensqualität noch einmal erhöhen.
-    [/INST]
-    Hauptaussagen:
-    1. Aufwertung des Erdkampsweg (Lob)
-    2. Parkraum bei Neubauten kreuzt Fußwege (Problem)
-    3. Verkehrsberuhigung (Vorschlag)
-    """
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout), False
 
-    # Iteration über die Beiträge des übergebenen Dictionarys und Erstellung eines Prompts zur Target Identification für jeden Beitrag daraus
-    for con_id, con_txt in cons.items():
-        ti_main = f"""
-        [INST]
-        Ermittle die Hauptaussagen des folgenden Beitrages.
-        Beitrag:
-        {con_txt}
-        [/INST]
-        Hauptaussagen:
+    def releaseConnection(self, connection) -> None:
+        with self.pool_lock:
+            self.pool.append(connection)
+
+    def complete(self, prompt: str) -> str:
         """
-        # Kombination von System-, Beispiel- und beitragsspezifischem Prompt und Hinzufügen zum Prompt-Dictionary für Targetbestimmung
-        prompt = ti_system + ti_example + ti_main
-        prompt_dict[str(con_id)] = [prompt]
+        Fragt die Antwort des Modells auf einen Prompt beim Server an.
 
-    return prompt_dict
+        Parameters:
+            prompt: Prompt
 
+        Returns:
+            completion: Vom Modell generierte Antwort (ohne Prompt).
+        """
 
-def extractTargetsInContributions(prompt_dict: dict, pipe) -> dict:
-    """
-    Extrahiert die Hauptaussagen (Targets) aus den Beiträgen durch die Übergabe der Prompts an die Pipeline des LLM.
+        body = json.dumps({
+            'model': self.model,
+            'prompt': prompt,
+            'max_tokens': GENERATION_KWARGS['max_new_tokens'],
+            'temperature': GENERATION_KWARGS['temperature'],
+            'repetition_penalty': GENERATION_KWARGS['repetition_penalty']
+        }).encode('utf-8')
+
+        while True:
+            connection, reused = self.acquireConnection()
+            try:
+                connection.request('POST', self.path, body=body, headers=self.headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as error:
+                connection.close()
+                # Eine wiederverwendete Verbindung kann vom Server bereits geschlossen worden sein
+                if reused:
+                    continue
+                raise BackendError(f"Verbindung zum Server fehlgeschlagen: {error}", transient=True) from error
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.releaseConnection(connection)
+            break
 
-    Parameters:
-        prompt_dict: Dictionary bestehend aus Beitrags-IDs mit zugehörigen Prompts zur Ermittlung der Kernaussagen.
-        pipe: Pipeline zur Verarbeitung der Prompts durch das LLM
+        if response.status != 200:
+            raise BackendError(f"Server antwortete mit Status {response.status}: {data[:200]!r}",
+                               transient=response.status == 429 or response.status >= 500)
 
-    Returns:
-        aspect_results: Dictionary der Form {BID: [Hauptaussagen]} bestehend aus Beitrags-IDs und den in den Beiträgen 
-            identifizierten Hauptaussagen als Liste.
-    """
+        try:
+            return json.loads(data)['choices'][0]['text']
+        except (ValueError, KeyError, IndexError) as error:
+            raise BackendError(f"Ungültige Antwort des Servers: {data[:200]!r}") from error
 
-    aspect_results = {}
+    async def acomplete(self, prompt: str) -> str:
+        """
+        Asynchrone Variante von complete. Die blockierende Anfrage wird in einem Thread ausgeführt.
+        """
 
-    # Iteration über die Prompts zur Extraktion der Hauptaussagen im Prompt-Dictionary
-    for con_id, prompts in prompt_dict.items():
-        aspect_results[con_id] = []
-        # Generieren aller Hauptaussagen (Targets) eines jeweiligen Beitrags
-        for prompt in prompts:
-            answer = pipe(prompt)
-            generated_text = answer[0]["generated_text"]
-            # Extraktion der Hauptaussagen (Targets) aus der modellgenerierten Antwort
-            generated_answer = generated_text.strip().split('Hauptaussagen:')[-1].strip()
-            statements = [statement.strip() for statement in generated_answer.split('\n') if statement.strip()]
-            aspect_results[con_id].extend(statements)
+        return await asyncio.to_thread(self.complete, prompt)
 
-    return aspect_results
+    async def completeMany(self, prompts: list) -> list:
+        """
+        Fragt die Antworten auf mehrere Prompts mit höchstens max_concurrency gleichzeitigen Anfragen an.
+
+        Returns:
+            completions: Liste der Antworten in der Reihenfolge der Prompts.
+        """
 
-def generatePromptsForStanceDetection(aspects: dict, com_dict: dict) -> list:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(prompt):
+            async with semaphore:
+                return await self.acomplete(prompt)
+
+        return await asyncio.gather(*(bounded(prompt) for prompt in prompts))
+
+    def __call__(self, prompts, batch_size: int = None, **kwargs):
+        if isinstance(prompts, str):
+            return [{"generated_text": prompts + self.complete(prompts)}]
+        return self.iterate(prompts, batch_size)
+
+    def iterate(self, prompts, batch_size: int = None):
+        """
+        Verarbeitet einen Iterator von Prompts abschnittsweise nebenläufig und liefert die Ergebnisse in der Reihenfolge der Prompts.
+        """
+
+        prompt_iter = iter(prompts)
+        chunk_size = max(batch_size or 1, self.max_concurrency) * 4
+        while True:
+            chunk = list(itertools.islice(prompt_iter, chunk_size))
+            if not chunk:
+                break
+            for prompt, completion in zip(chunk, asyncio.run(self.completeMany(chunk))):
+                yield [{"generated_text": prompt + completion}]
+
+    def close(self) -> None:
+        with self.pool_lock:
+            for connection in self.pool:
+                connection.close()
+            self.pool = []
+
+def loadBackend(backend: str, model_id: str, server_url: str = None, max_concurrency: int = 8, api_key: str = None):
     """
-    Generiert Prompts für die Stance Detection. Für jede der Kernaussagen (Target), die aus dem betrachteten Beitrag ermittelt wurde,
-    wird ein Prompt generiert, der die Haltung des Kommentars hinsichtlich der identifizierten Hauptaussage erfragen soll.
+    Lädt das Inferenz-Backend, über das die Prompts verarbeitet werden.
 
     Parameters:
-        aspects: Dictionary, das Beitrags-IDs und zugehörige, identifizierte Kernaussagen (Targets der Stance Detection) enthält.
-        comments_dict: Dictionary, das Beitrag-IDs die Beitragsinhalte sowie alle zugehörigen Kommentare zuordnet.
+        backend: 'hf' für die Pipeline von transformers im selben Prozess (siehe loadLLM), 'openai' für einen
+            OpenAI-kompatiblen Server (siehe OpenAICompatibleBackend).
+        model_id: Modell-ID des verwendeten Sprachmodells.
+        server_url: Basis-URL des Servers für das Backend 'openai'.
+        max_concurrency: Maximale Anzahl gleichzeitiger Anfragen an den Server.
+        api_key: Optionaler API-Schlüssel des Servers.
 
     Returns:
-        prompts: Eine Liste bestehend aus Tupeln, wobei jedes Tupel die Beitrags-ID, die Hauptaussage, die Kommentar-ID, den Kommentartext und den entsprechenden Prompt enthält.
-        
+        pipe: Pipeline bzw. Backend mit der Aufrufschnittstelle der Pipeline.
     """
 
-    prompts = []
+    if backend == 'openai':
+        return OpenAICompatibleBackend(server_url, model_id, max_concurrency, api_key=api_key)
 
-    # Statischer System-Prompt für die Stance Detection mit allgemeinen Informationen für das LLM
-    sd_system = """
-        <s>[INST] <<SYS>>
-        Du bist ein hilfreicher, respektvoller und ehrlicher Assistent eines Stadtplaners.
-        Deine Aufgabe ist es zu bewerten, wie ein Kommentar sich zu einer Hauptaussage positioniert.
-        Gib diese Polarität auf Deutsch wieder.
-        Stelle sicher, dass jede Polarität entweder Zustimmung, Widerspruch oder Neutralität ist.
-        Es sind ausschließlich diese Polaritäten zulässig. Andere Polaritäten sollen nicht ausgegeben werden.
-        Gib ausschließlich die Polarität aus. Andere Ergebnisse sollen nicht ausgegeben werden.
+    return loadLLM(model_id)
 
-        Definitionen:
-        - Zustimmung: Der Kommentar stimmt der Hauptaussage zu oder zeigt eine positive Reaktion auf den Inhalt der Hauptaussage. Das Problem, das Lob oder der Vorschlag wird befürwortet.
-        - Widerspruch: Der Kommentar widerspricht der Hauptaussage oder zeigt eine negative Reaktion auf den Inhalt der Hauptaussage. Das Problem, das Lob oder der Vorschlag wird abgelehnt.
-        - Neutralität: Der Kommentar thematisiert die Hauptaussage nicht und stellt keinen Bezug zu ihr her.
-        <</SYS>>
+def dynamicCache(past_key_values=None):
+    """
+    Liefert Key/Values als DynamicCache von transformers, der sich per crop auf eine kürzere Länge zurücksetzen lässt.
+    Ohne Angabe wird ein leerer DynamicCache erzeugt; Key/Values im älteren Tupel-Format werden umgewandelt.
+    """
+    from transformers import DynamicCache
+
+    if past_key_values is None:
+        return DynamicCache()
+    if hasattr(past_key_values, 'crop'):
+        return past_key_values
+    return DynamicCache.from_legacy_cache(past_key_values)
+
+class PrefixCache:
+    """
+    Zwischenspeicher für die Key/Values des LLM zu gemeinsamen Prompt-Präfixen. Die statischen System- und Beispiel-Prompts
+    werden dadurch nur einmalig verarbeitet; zusätzlich wird z. B. der Prompt-Teil einer Hauptaussage für alle Kommentare
+    zu dieser Hauptaussage wiederverwendet. Ein Präfix wird als Tupel seiner Bestandteile adressiert und auf Basis des
+    Eintrags seines kürzeren Präfixes berechnet. Es werden höchstens max_entries Einträge vorgehalten (LRU).
+
+    Tokenisiert wird stets der zusammengesetzte Text, nicht jeder Bestandteil einzeln, da Tokenizer wie SentencePiece an den
+    Grenzen der Bestandteile sonst andere Tokens erzeugen (z. B. ein zusätzliches "▁"). Das letzte Token eines Präfixes kann
+    mit dem folgenden Text zu einem anderen Token verschmelzen; es wird daher nicht in den Cache übernommen.
+    """
+
+    def __init__(self, pipe, max_entries: int = 8):
+        self.pipe = pipe
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, prefix_parts) -> tuple:
         """
-    # Statischer Beispiel-Prompt für die Stance Detection
-    sd_example = """
-        Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
-        Hauptaussage:
-        - Gehwege in schlechtem Zustand (Problem)
-        Kommentar:
-        - Einige Gehwege sind in schlechtem Zustand mit Stolperfallen durch Unebenheiten und teilweise abschüssig und sollten dringend saniert werden.
-        [/INST]
-        Polarität:
-        Zustimmung
-        [INST]
-        Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
-        Hauptaussage:
-        - Lärmbelästigung durch Feuerwehreinsätze (Problem)
-        Kommentar:
-        - Die Feuerwehr fährt mit Sicherheit nicht mega schnell - man sollte froh sein, dass diese schnell zum Einsatzort fahren kann und die „Lärmbelästigung „ ist auch nicht wirklich gegeben da oft - gerade in der Nacht - auf das Martinshorn verzichtet wird !
-        [/INST]
-        Polarität:
-        Widerspruch
+        Liefert die Token-IDs und Key/Values eines Präfixes und berechnet diese bei Bedarf.
+
+        Parameters:
+            prefix_parts: Bestandteile des Präfixes in Prompt-Reihenfolge.
+
+        Returns:
+            prefix_ids, past_key_values: Token-IDs des Präfixes ohne dessen letztes Token und zugehörige Key/Values des LLM
+                (DynamicCache). Die Key/Values dürfen nur vorübergehend erweitert werden und sind anschließend mit crop auf die
+                Länge des Präfixes zurückzusetzen.
+        """
+
+        key = tuple(prefix_parts)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        import torch
+
+        self.misses += 1
+        tokenizer = self.pipe.tokenizer
+        model = self.pipe.model
+
+        prefix_ids = tokenizer("".join(key), return_tensors='pt').input_ids[:, :-1].to(model.device)
+        with torch.no_grad():
+            parent_ids, parent_past = self.lookup(key[:-1]) if len(key) > 1 else (None, None)
+            if parent_ids is not None and startsWithIds(prefix_ids, parent_ids):
+                # Fortsetzung der Key/Values des kürzeren Präfixes um die übrigen Tokens
+                output = model(input_ids=prefix_ids[:, parent_ids.shape[1]:], past_key_values=copy.deepcopy(parent_past), use_cache=True)
+            else:
+                output = model(input_ids=prefix_ids, use_cache=True)
+
+        self.entries[key] = (prefix_ids, dynamicCache(output.past_key_values))
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return self.entries[key]
+
+    def clear(self) -> None:
+        """
+        Verwirft alle zwischengespeicherten Key/Values.
+        """
+
+        self.entries.clear()
+
+class ResultCache:
+    """
+    Persistenter Zwischenspeicher (SQLite) für die Ergebnisse der Target Identification und der Stance Detection.
+    Die Einträge werden über einen Hash aus Modell-ID, Version des Prompt-Templates und den Eingabetexten adressiert,
+    sodass bei erneuten Durchläufen nur neue oder geänderte Eingaben durch das LLM verarbeitet werden.
+    Überschreitet die Anzahl der Einträge max_entries, werden die am längsten nicht genutzten Einträge entfernt.
+    """
+
+    def __init__(self, db_file: str, model_id: str, max_entries: int = 1000000):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Autocommit, damit Zugriffe mehrerer Prozesse die Datenbank nicht dauerhaft sperren. Die Verbindung darf auch in anderen
+        # Threads genutzt werden (z. B. vom AsyncScheduler über asyncio.to_thread); gleichzeitige Zugriffe sind vom Aufrufer auszuschließen.
+        self.connection = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.size = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def key(self, kind: str, *texts: str) -> str:
+        """
+        Erzeugt den Schlüssel eines Eintrags aus Modell-ID, Art und Template-Version des Ergebnisses sowie den Eingabetexten.
+        """
+
+        components = [self.model_id, kind, promptTemplateVersion(kind)] + [str(text) for text in texts]
+        return hashlib.sha256("\x1f".join(components).encode('utf-8')).hexdigest()
+
+    def get(self, kind: str, *texts: str):
+        """
+        Liefert das zwischengespeicherte Ergebnis zu den Eingabetexten oder None, sofern es nicht vorliegt.
+        """
+
+        key = self.key(kind, *texts)
+        row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, kind: str, value, *texts: str) -> None:
+        """
+        Speichert ein Ergebnis zu den Eingabetexten und entfernt bei Bedarf die am längsten nicht genutzten Einträge.
+        """
+
+        cursor = self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, value, last_used) VALUES (?, ?, ?)",
+            (self.key(kind, *texts), json.dumps(value, ensure_ascii=False), time.time())
+        )
+        self.size += cursor.rowcount
+
+        # Entfernen der ältesten Einträge auf 90 % der maximalen Größe (überschriebene Einträge werden mitgezählt,
+        # daher wird die Anzahl vor dem Entfernen exakt ermittelt)
+        if self.size > self.max_entries:
+            self.size = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if self.size > self.max_entries:
+            surplus = self.size - int(self.max_entries * 0.9)
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (surplus,)
+            )
+            self.size = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+def promptTemplateVersion(kind: str) -> str:
+    """
+    Ermittelt die Version des Prompt-Templates als Hash des mit Platzhaltern gefüllten Prompts.
+    Jede Änderung an den Prompts führt dadurch zu neuen Schlüsseln im ResultCache.
+
+    Parameters:
+        kind: Art des Ergebnisses, 'targets', 'stance-<Modus>' oder 'stance-packed' (Pakete mehrerer Kommentare, siehe packedStanceResults).
+
+    Returns:
+        version: Kurzer Hash des Templates.
+    """
+
+    if kind == 'targets':
+        template = "".join(targetPromptParts('{Beitrag}'))
+    elif kind == 'stance-packed':
+        # Kommentare ohne gültige Polarität im Paket werden mit dem Template der Einzelverarbeitung nachverarbeitet
+        template = "".join(stancePackedPromptParts('{Hauptaussage}', ['{Kommentar}'])) + "".join(stancePromptParts('{Hauptaussage}', '{Kommentar}'))
+    else:
+        template = "".join(stancePromptParts('{Hauptaussage}', '{Kommentar}'))
+
+    return hashlib.sha256(template.encode('utf-8')).hexdigest()[:12]
+
+class RunCheckpoint:
+    """
+    Fortschrittsprotokoll eines Durchlaufs in einem Run-Verzeichnis, über das ein abgebrochener Durchlauf fortgesetzt werden kann.
+    Abgeschlossene Beiträge der Target Identification und abgeschlossene Paare der Stance Detection (Beitrags-ID, Kommentar-ID,
+    Hauptaussage) werden samt Ergebnis zeilenweise an JSON-Lines-Dateien angehängt und unmittelbar auf den Datenträger geschrieben.
+    Eine bei einem Absturz unvollständig geschriebene letzte Zeile wird beim Einlesen übersprungen.
+    """
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        os.makedirs(run_dir, exist_ok=True)
+        self.targets_file = os.path.join(run_dir, 'targets.jsonl')
+        self.stance_file = os.path.join(run_dir, 'stance.jsonl')
+        self.handles = {}
+
+    def checkSettings(self, settings: dict) -> bool:
+        """
+        Prüft, ob die Einstellungen mit denen des bisherigen Durchlaufs im Run-Verzeichnis übereinstimmen, und legt sie
+        bei einem neuen Durchlauf im Manifest ab.
+
+        Parameters:
+            settings: Dictionary mit den ergebnisrelevanten Einstellungen (z. B. Modell-ID und Modus der Stance Detection).
+
+        Returns:
+            True, sofern der Durchlauf mit diesen Einstellungen fortgesetzt werden kann.
+        """
+
+        manifest_file = os.path.join(self.run_dir, 'manifest.json')
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r', encoding='utf-8') as file:
+                return json.load(file) == settings
+
+        with open(manifest_file, 'w', encoding='utf-8') as file:
+            json.dump(settings, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        return True
+
+    def readRecords(self, path: str) -> list:
+        """
+        Liest die vollständig geschriebenen Einträge einer JSON-Lines-Datei ein.
+        """
+
+        records = []
+        if not os.path.exists(path):
+            return records
+
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Unvollständige Zeile eines abgebrochenen Schreibvorgangs
+                    continue
+
+        return records
+
+    def append(self, path: str, record: dict) -> None:
+        """
+        Hängt einen Eintrag an eine JSON-Lines-Datei an und schreibt ihn unmittelbar auf den Datenträger.
+        """
+
+        if path not in self.handles:
+            handle = open(path, 'a', encoding='utf-8')
+            # Abschluss einer ggf. unvollständig geschriebenen letzten Zeile
+            if handle.tell() > 0:
+                with open(path, 'rb') as file:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':
+                        handle.write('\n')
+            self.handles[path] = handle
+
+        handle = self.handles[path]
+        handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        handle.flush()
+        os.fsync(handle.fileno())
+
+    def completedTargets(self) -> dict:
+        """
+        Liefert die Hauptaussagen der bereits abgeschlossenen Beiträge als Dictionary der Form {BID: [Hauptaussagen]}.
+        """
+
+        return {record['Beitrags-ID']: record['Hauptaussagen'] for record in self.readRecords(self.targets_file)}
+
+    def appendTargets(self, con_id: str, statements: list) -> None:
+        self.append(self.targets_file, {'Beitrags-ID': con_id, 'Hauptaussagen': statements})
+
+    def completedStances(self, extras: bool = False) -> dict:
+        """
+        Liefert die Ergebnisse der bereits abgeschlossenen Paare als Dictionary der Form
+        {(Beitrags-ID, Kommentar-ID, Hauptaussage): Ergebnis}. Mit extras=True ist der Wert ein Tupel aus dem Ergebnis und
+        den mitprotokollierten Angaben des Vorfilters (Kosinus-Ähnlichkeit und Angabe, ob das Paar vorgefiltert wurde).
+        """
+
+        if extras:
+            return {tuple(record['Schlüssel']): (record['Ergebnis'], *record.get('Vorfilter', ())) for record in self.readRecords(self.stance_file)}
+        return {tuple(record['Schlüssel']): record['Ergebnis'] for record in self.readRecords(self.stance_file)}
+
+    def appendStance(self, key: tuple, result, extras: list = None) -> None:
+        record = {'Schlüssel': list(key), 'Ergebnis': result}
+        if extras:
+            record['Vorfilter'] = list(extras)
+        self.append(self.stance_file, record)
+
+    def close(self) -> None:
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+class PreviousRun:
+    """
+    Ergebnisse eines vorherigen Durchlaufs (Targets.csv und Stance.csv) für einen inkrementellen Durchlauf über kumulative Exporte.
+    Beiträge und Kommentare werden anhand ihrer ID und eines Hashwerts ihres Inhalts mit den aktuellen Eingaben abgeglichen.
+    Übernommen werden die Hauptaussagen unveränderter Beiträge sowie die Ergebnisse der Paare aus Hauptaussage und Kommentar,
+    deren Kommentar unverändert ist. Neue oder geänderte Beiträge sowie neue Kommentare und Paare mit geänderten Hauptaussagen
+    werden erneut durch das LLM verarbeitet. Übernommen werden nur Ergebnisse eines Durchlaufs, dessen abgelegte Einstellungen
+    (siehe saveSettings) zu den aktuellen passen; vorgefilterte Paare und Paare ohne erkannte Polarität werden neu verarbeitet.
+    """
+
+    # Name der Datei mit den Einstellungen eines Durchlaufs, die neben Targets.csv und Stance.csv abgelegt wird
+    SETTINGS_FILE = 'run_settings.json'
+    # Einstellungen, die für die Ergebnisse der Target Identification bzw. der Stance Detection übereinstimmen müssen.
+    # Der Vorfilter ist nicht enthalten, da vorgefilterte Paare ohnehin nicht übernommen werden.
+    TARGET_SETTINGS = ('model_id',)
+    STANCE_SETTINGS = ('model_id', 'stance_mode', 'comment_token_budget', 'pack_size')
+
+    def __init__(self, previous_dir: str, settings: dict = None):
+        self.targets_file = os.path.join(previous_dir, 'Targets.csv')
+        self.stance_file = os.path.join(previous_dir, 'Stance.csv')
+        self.settings_file = os.path.join(previous_dir, self.SETTINGS_FILE)
+        self.settings = settings
+
+    @classmethod
+    def saveSettings(cls, output_dir: str, settings: dict) -> None:
+        """
+        Legt die Einstellungen eines abgeschlossenen Durchlaufs neben dessen Ausgabedateien ab (siehe writeJsonAtomic).
+        """
+
+        writeJsonAtomic(os.path.join(output_dir, cls.SETTINGS_FILE), settings)
+
+    @classmethod
+    def invalidateSettings(cls, output_dir: str) -> None:
+        """
+        Entfernt die Einstellungen eines früheren Durchlaufs, bevor dessen Ausgabedateien überschrieben werden. Bricht der
+        Durchlauf ab, liegen zu den unvollständigen Ausgabedateien keine Einstellungen vor, sodass sie nicht übernommen werden
+        (siehe matchesSettings). Die Einstellungen werden erst nach Abschluss erneut abgelegt (siehe saveSettings).
+        """
+
+        try:
+            os.remove(os.path.join(output_dir, cls.SETTINGS_FILE))
+        except FileNotFoundError:
+            pass
+
+    def matchesSettings(self, keys: tuple, path: str) -> bool:
+        """
+        Prüft, ob die Einstellungen des vorherigen Durchlaufs für die angegebenen Schlüssel mit den aktuellen übereinstimmen.
+        Ohne aktuelle Einstellungen oder ohne Ausgabedatei wird nicht geprüft.
+        """
+
+        if self.settings is None or not os.path.exists(path):
+            return True
+
+        try:
+            with open(self.settings_file, 'r', encoding='utf-8') as file:
+                previous_settings = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            print(f"Zu '{path}' liegen keine lesbaren Einstellungen ('{self.settings_file}') vor; die Ergebnisse werden nicht übernommen.")
+            return False
+
+        if any(previous_settings.get(key) != self.settings.get(key) for key in keys):
+            print(f"'{path}' wurde mit anderen Einstellungen (z. B. Modell oder Modus) erstellt; die Ergebnisse werden nicht übernommen.")
+            return False
+        return True
+
+    @staticmethod
+    def contentHash(text) -> str:
+        return hashlib.sha256(str(text).encode('utf-8')).hexdigest()[:16]
+
+    def readRows(self, path: str):
+        """
+        Liefert die Zeilen einer Ausgabedatei des vorherigen Durchlaufs als Dictionaries. Fehlt die Datei, werden keine Zeilen geliefert.
+        """
+
+        if not os.path.exists(path):
+            print(f"Die Datei '{path}' des vorherigen Durchlaufs wurde nicht gefunden; alle Einträge werden neu verarbeitet.")
+            return
+
+        with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+            yield from csv.DictReader(csvfile, delimiter=';')
+
+    def completedTargets(self, contributions: dict) -> dict:
+        """
+        Liefert die Hauptaussagen der Beiträge, deren Text seit dem vorherigen Durchlauf unverändert ist.
+
+        Parameters:
+            contributions: Dictionary der aktuellen Beiträge der Form {BID: Beitragsinhalt}.
+
+        Returns:
+            completed: Dictionary der Form {BID: [Hauptaussagen]}.
+        """
+
+        if not self.matchesSettings(self.TARGET_SETTINGS, self.targets_file):
+            return {}
+
+        hashes = {str(con_id): self.contentHash(con_txt) for con_id, con_txt in contributions.items()}
+        completed = {}
+
+        for row in self.readRows(self.targets_file):
+            con_id = row['Beitrags-ID']
+            if hashes.get(con_id) == self.contentHash(row['Beitragstext']):
+                completed[con_id] = [statement.strip() for statement in row['Hauptaussagen'].split('\n') if statement.strip()]
+
+        return completed
+
+    def completedStances(self, entries: dict, stance_mode: str = 'generate') -> dict:
+        """
+        Liefert die Ergebnisse der Paare, deren Kommentar seit dem vorherigen Durchlauf unverändert ist. Da der Schlüssel die
+        Hauptaussage enthält, werden Paare geänderter Hauptaussagen nicht gefunden und erneut verarbeitet. Die Ergebnisse werden
+        aus den gespeicherten Spalten in der Form wiederhergestellt, die saveStance erwartet.
+
+        Parameters:
+            entries: Dictionary der aktuellen Beiträge mit zugehörigen Kommentaren (siehe joinConsComs).
+            stance_mode: Modus der Stance Detection. Im Modus 'classify' werden die Wahrscheinlichkeiten je Polarität benötigt.
+
+        Returns:
+            completed: Dictionary der Form {(Beitrags-ID, Kommentar-ID, Hauptaussage): Ergebnis} (siehe stanceKey).
+        """
+
+        if not self.matchesSettings(self.STANCE_SETTINGS, self.stance_file):
+            return {}
+
+        hashes = {(str(con_id), str(com_id)): self.contentHash(com_txt)
+                  for con_id, entry in entries.items() for com_id, com_txt in entry['Kommentare'].items()}
+        probability_columns = [f'P({label})' for label in STANCE_LABELS]
+        completed = {}
+
+        for row in self.readRows(self.stance_file):
+            if stance_mode == 'classify' and any(column not in row for column in probability_columns):
+                print(f"Die Datei '{self.stance_file}' enthält keine Wahrscheinlichkeiten je Polarität; die Stance Detection wird neu durchgeführt.")
+                return {}
+
+            if hashes.get((row['Beitrags-ID'], row['Kommentar-ID'])) != self.contentHash(row['Kommentartext']):
+                continue
+            # Vorgefilterte Paare und Paare ohne erkannte Polarität wurden nicht durch das LLM eingestuft
+            if row.get('Vorfilter') or row['Haltung'] == 'Unbekannt':
+                continue
+
+            key = (row['Beitrags-ID'], row['Kommentar-ID'], row['Hauptaussage'])
+            if stance_mode == 'classify':
+                completed[key] = {label: float(row[f'P({label})']) for label in STANCE_LABELS}
+            else:
+                # Wiederherstellung eines Textes, aus dem parseStance Haltung und Begründung unverändert ermittelt
+                completed[key] = f"Polarität: {row['Haltung']}\n{row['Begründung']}"
+
+        return completed
+
+class RunMetrics:
+    """
+    Erfasst Kennzahlen eines Durchlaufs je Stufe: Laufzeit, Latenz der einzelnen Aufrufe des LLM, Anzahl der Prompt- und
+    generierten Tokens sowie den bis zum Ende der Stufe erreichten Spitzenwert des Arbeitsspeichers (Peak RSS).
+    Optional wird der Fortschritt der laufenden Stufe mit geschätzter Restlaufzeit ausgegeben. Die Tokens werden mit dem
+    TokenCounter des Durchlaufs gezählt (siehe TokenCounter). Mit record_calls=False (z. B. nur Fortschrittsausgabe) werden
+    die Aufrufe des LLM nicht erfasst und keine Tokens gezählt.
+    """
+
+    def __init__(self, token_counter: 'TokenCounter' = None, progress_interval: float = None, record_calls: bool = True):
+        self.token_counter = token_counter if token_counter is not None else TokenCounter()
+        self.progress_interval = progress_interval
+        self.record_calls = record_calls
+        self.stages = {}
+        self.started = time.monotonic()
+
+    def entry(self, name: str) -> dict:
+        if name not in self.stages:
+            self.stages[name] = {'wall_time_s': None, 'latencies': [], 'prompt_tokens': 0, 'generated_tokens': 0,
+                                 'peak_rss_mb': None, 'done': 0, 'total': None, 'started': None, 'last_progress': None}
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name: str, total: int = None):
+        """
+        Misst die Laufzeit einer Stufe. total ist die erwartete Anzahl der Einheiten der Stufe für die Fortschrittsausgabe.
+        """
+
+        entry = self.entry(name)
+        entry['total'] = total
+        entry['started'] = entry['last_progress'] = time.monotonic()
+        try:
+            yield entry
+        finally:
+            entry['wall_time_s'] = (entry['wall_time_s'] or 0.0) + time.monotonic() - entry['started']
+            entry['peak_rss_mb'] = self.peakRss()
+
+    def countCall(self, prompt, generated_text: str = "", prompt_tokens: int = None) -> tuple:
+        """
+        Zählt die Prompt- und generierten Tokens eines Aufrufs des LLM. prompt ist der Prompt als Zeichenfolge oder als Liste
+        seiner Bestandteile, deren erster das statische Präfix ist. Nur das Präfix wird im TokenCounter vorgehalten; die übrigen
+        Bestandteile sind je Aufruf verschieden und werden ohne Cache gezählt. Alternativ kann die Anzahl der Prompt-Tokens
+        vorab bestimmt übergeben werden (siehe TokenCounter.templateTokens). Enthält generated_text wie bei der Pipeline den
+        Prompt, wird dieser nicht mitgezählt.
+
+        Returns:
+            prompt_tokens, generated_tokens: Tupel aus der Anzahl der Prompt- und der generierten Tokens.
+        """
+
+        if not isinstance(prompt, str):
+            if prompt_tokens is None:
+                prompt_tokens = self.token_counter.count(prompt[0]) + sum(self.token_counter.count(part, cache=False) for part in prompt[1:])
+            prompt = "".join(prompt)
+        elif prompt_tokens is None:
+            prompt_tokens = self.token_counter.count(prompt, cache=False)
+
+        if generated_text.startswith(prompt):
+            generated_text = generated_text[len(prompt):]
+        elif generated_text.lstrip().startswith(prompt.strip()):
+            generated_text = generated_text.lstrip()[len(prompt.strip()):]
+
+        return prompt_tokens, self.token_counter.count(generated_text, cache=False)
+
+    def recordCall(self, name: str, latency: float, prompt_tokens: int, generated_tokens: int) -> None:
+        if not self.record_calls:
+            return
+        entry = self.entry(name)
+        entry['latencies'].append(latency)
+        entry['prompt_tokens'] += prompt_tokens
+        entry['generated_tokens'] += generated_tokens
+
+    def record(self, name: str, latency: float, prompt, generated_text: str = "", prompt_tokens: int = None) -> None:
+        """
+        Erfasst einen Aufruf des LLM mit seinem Prompt (Zeichenfolge oder Liste der Bestandteile) und der Antwort (siehe countCall).
+        """
+
+        if self.record_calls:
+            self.recordCall(name, latency, *self.countCall(prompt, generated_text, prompt_tokens))
+
+    def merge(self, name: str, latencies: list, prompt_tokens: int, generated_tokens: int) -> None:
+        """
+        Übernimmt die in einem Worker-Prozess erfassten Aufrufe des LLM (siehe StanceWorkerPool).
+        """
+
+        entry = self.entry(name)
+        entry['latencies'].extend(latencies)
+        entry['prompt_tokens'] += prompt_tokens
+        entry['generated_tokens'] += generated_tokens
+
+    def advance(self, name: str, count: int = 1) -> None:
+        """
+        Zählt abgeschlossene Einheiten einer Stufe und gibt ggf. den Fortschritt mit geschätzter Restlaufzeit aus.
+        """
+
+        entry = self.entry(name)
+        entry['done'] += count
+        if self.progress_interval is None or entry['started'] is None:
+            return
+
+        now = time.monotonic()
+        if now - entry['last_progress'] < self.progress_interval and entry['done'] != entry['total']:
+            return
+        entry['last_progress'] = now
+        rate = entry['done'] / max(now - entry['started'], 1e-9)
+        if entry['total']:
+            remaining = int((entry['total'] - entry['done']) / rate) if rate > 0 else 0
+            print(f"{name}: {entry['done']}/{entry['total']} ({entry['done'] / entry['total']:.1%}), {rate:.2f}/s, "
+                  f"Restlaufzeit ca. {remaining // 3600}:{remaining % 3600 // 60:02d}:{remaining % 60:02d}")
+        else:
+            print(f"{name}: {entry['done']}, {rate:.2f}/s")
+
+    @staticmethod
+    def peakRss(children: bool = False) -> float:
+        """
+        Liefert den Spitzenwert des Arbeitsspeichers (Peak RSS) des Prozesses bzw. des größten beendeten Kindprozesses in MB.
+        Ohne das Modul resource (z. B. unter Windows) wird None geliefert.
+        """
+
+        try:
+            import resource
+        except ImportError:
+            return None
+
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss wird unter macOS in Byte, unter Linux in Kilobyte angegeben
+        return round(usage / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+    @staticmethod
+    def percentile(values: list, q: float) -> float:
+        """
+        Liefert das q-Perzentil der Werte nach dem Nearest-Rank-Verfahren.
+        """
+
+        ordered = sorted(values)
+        rank = max(int(-(-q * len(ordered) // 100)), 1)
+        return ordered[rank - 1]
+
+    def report(self, caches: dict = None) -> dict:
+        """
+        Fasst die Kennzahlen zusammen.
+
+        Parameters:
+            caches: Optionales Dictionary der Form {Name: Cache} mit Caches, die Treffer (hits) und Fehlzugriffe (misses) zählen.
+
+        Returns:
+            report: Dictionary mit den Kennzahlen je Stufe, des gesamten Durchlaufs und der Caches.
+        """
+
+        def tokensPerSecond(tokens, wall_time):
+            return round(tokens / wall_time, 2) if wall_time else None
+
+        stages = {}
+        for name, entry in self.stages.items():
+            latencies = entry['latencies']
+            stages[name] = {
+                'wall_time_s': round(entry['wall_time_s'], 3) if entry['wall_time_s'] is not None else None,
+                'calls': len(latencies),
+                'latency_s': {
+                    'mean': round(sum(latencies) / len(latencies), 4),
+                    'p50': round(self.percentile(latencies, 50), 4),
+                    'p95': round(self.percentile(latencies, 95), 4),
+                    'p99': round(self.percentile(latencies, 99), 4),
+                    'max': round(max(latencies), 4)
+                } if latencies else None,
+                'prompt_tokens': entry['prompt_tokens'],
+                'generated_tokens': entry['generated_tokens'],
+                'prompt_tokens_per_s': tokensPerSecond(entry['prompt_tokens'], entry['wall_time_s']),
+                'generated_tokens_per_s': tokensPerSecond(entry['generated_tokens'], entry['wall_time_s']),
+                'peak_rss_mb': entry['peak_rss_mb']
+            }
+
+        wall_time = time.monotonic() - self.started
+        prompt_tokens = sum(entry['prompt_tokens'] for entry in self.stages.values())
+        generated_tokens = sum(entry['generated_tokens'] for entry in self.stages.values())
+        caches = {name: cache for name, cache in (caches or {}).items() if cache is not None}
+
+        return {
+            'token_counts': 'tokenizer' if self.token_counter.tokenizer is not None else 'estimated',
+            'total': {
+                'wall_time_s': round(wall_time, 3),
+                'prompt_tokens': prompt_tokens,
+                'generated_tokens': generated_tokens,
+                'prompt_tokens_per_s': tokensPerSecond(prompt_tokens, wall_time),
+                'generated_tokens_per_s': tokensPerSecond(generated_tokens, wall_time),
+                'peak_rss_mb': self.peakRss(),
+                'peak_rss_children_mb': self.peakRss(children=True)
+            },
+            'stages': stages,
+            'caches': {
+                name: {
+                    'hits': cache.hits,
+                    'misses': cache.misses,
+                    'hit_rate': round(cache.hits / (cache.hits + cache.misses), 4) if cache.hits + cache.misses else None
+                }
+                for name, cache in caches.items()
+            }
+        }
+
+    def save(self, output_file: str, caches: dict = None) -> None:
+        with open(output_file, 'w', encoding='utf-8') as file:
+            json.dump(self.report(caches), file, ensure_ascii=False, indent=2)
+
+class TokenCounter:
+    """
+    Zählt die Tokens von Texten mit dem Tokenizer des LLM. Jeder Text wird nur einmal tokenisiert, sodass Hauptaussagen und
+    Kommentare, die in mehreren Prompts vorkommen, nicht erneut verarbeitet werden. Ohne Tokenizer (z. B. beim Backend 'openai')
+    wird die Anzahl der Tokens über die Anzahl der Zeichen geschätzt (siehe estimate). Ein TokenCounter wird je Durchlauf
+    erzeugt und an alle Stufen übergeben, die Tokens zählen.
+    """
+
+    def __init__(self, tokenizer=None, chars_per_token: float = 4.0):
+        self.tokenizer = tokenizer
+        self.chars_per_token = chars_per_token
+        self.counts = {}
+
+    def estimate(self, chars: int) -> int:
+        """
+        Schätzt die Anzahl der Tokens aus der Anzahl der Zeichen (aufgerundet).
+        """
+
+        return int(-(-chars // self.chars_per_token))
+
+    def count(self, text: str, cache: bool = True) -> int:
+        """
+        Liefert die Anzahl der Tokens eines Textes. Mit cache=False wird der Text weder nachgeschlagen noch vorgehalten,
+        z. B. für einmalige Texte wie generierte Antworten.
+        """
+
+        text = str(text)
+        tokens = self.counts.get(text) if cache else None
+        if tokens is None:
+            if not text:
+                tokens = 0
+            elif self.tokenizer is not None:
+                tokens = len(self.tokenizer(text, add_special_tokens=False).input_ids)
+            else:
+                tokens = self.estimate(len(text))
+            if cache:
+                self.counts[text] = tokens
+        return tokens
+
+    def truncate(self, text: str, budget: int) -> str:
+        """
+        Kürzt einen Text auf höchstens budget Tokens, indem Anfang und Ende erhalten bleiben und die Mitte durch " […] " ersetzt wird.
+        Reicht das Budget nicht für das Auslassungszeichen, wird nur der Anfang des Textes übernommen.
+
+        Parameters:
+            text: Zu kürzender Text
+            budget: Maximale Anzahl der Tokens
+
+        Returns:
+            text: Ungekürzter Text, sofern er das Budget einhält, andernfalls der gekürzte Text.
+        """
+
+        text = str(text)
+        if budget is None or self.count(text) <= budget:
+            return text
+
+        token_ids = self.tokenizer(text, add_special_tokens=False).input_ids if self.tokenizer is not None else None
+
+        def headText(tokens: int) -> str:
+            if token_ids is not None:
+                return self.tokenizer.decode(token_ids[:tokens], skip_special_tokens=True)
+            return text[:int(tokens * self.chars_per_token)]
+
+        def tailText(tokens: int) -> str:
+            if not tokens:
+                return ""
+            if token_ids is not None:
+                return self.tokenizer.decode(token_ids[len(token_ids) - tokens:], skip_special_tokens=True)
+            return text[len(text) - int(tokens * self.chars_per_token):]
+
+        # Das Auslassungszeichen wird auf das Budget angerechnet. Da Tokens an den Grenzen verschmelzen bzw. zerfallen können,
+        # wird der gekürzte Text nachgezählt und ggf. um den Überschuss weiter gekürzt.
+        available = budget - self.count("[…]")
+        while available > 0:
+            head, tail = available - available // 2, available // 2
+            truncated = f"{headText(head).rstrip()} […] {tailText(tail).lstrip()}".rstrip()
+            excess = self.count(truncated, cache=False) - budget
+            if excess <= 0:
+                return truncated
+            available -= excess
+
+        head = budget
+        while head > 0:
+            truncated = headText(head).rstrip()
+            excess = self.count(truncated, cache=False) - budget
+            if excess <= 0:
+                return truncated
+            head -= excess
+
+        return ""
+
+    def templateTokens(self, template, *texts) -> int:
+        """
+        Liefert die Anzahl der Tokens eines Prompts aus seiner Vorlage (z. B. stancePromptParts) und den eingesetzten Texten,
+        ohne den Prompt zu erzeugen: Tokens der Vorlage mit leeren Texten zuzüglich der Tokens der einzelnen Texte. Nur die
+        leere Vorlage und die Texte selbst werden vorgehalten, nicht die erzeugten Prompts. Listen von Texten (z. B. die Kommentare
+        eines Pakets) werden je Text gezählt. Da an den Grenzen zwischen Vorlage und Text Tokens verschmelzen können, ist die
+        Anzahl eine Näherung.
+        """
+
+        tokens = self.count("".join(template(*[[""] * len(text) if isinstance(text, list) else "" for text in texts])))
+        for text in texts:
+            tokens += sum(self.count(item) for item in text) if isinstance(text, list) else self.count(text)
+        return tokens
+
+    def stanceTokens(self, prompt_data: tuple) -> int:
+        """
+        Liefert die Anzahl der Tokens des vollständigen Prompts eines StancePrompt-Datensatzes (siehe templateTokens).
+        """
+
+        return self.templateTokens(STANCE_TEMPLATES[prompt_data.template], prompt_data.aspect_txt, prompt_data.com_txt)
+
+    def promptTokens(self, prompt_data: tuple) -> int:
+        """
+        Liefert die Anzahl der Tokens, um die sich Prompts zur Stance Detection unterscheiden (Hauptaussage und Kommentar).
+        Der statische Teil ist für alle Prompts identisch und wird nicht gezählt.
+        """
+
+        return self.count(prompt_data[1]) + self.count(prompt_data[3])
+
+class EmbeddingFilter:
+    """
+    Vorfilter der Stance Detection auf Basis von Satz-Embeddings. Paare, deren Hauptaussage und Kommentar eine Kosinus-Ähnlichkeit
+    unterhalb des Schwellenwerts aufweisen, werden ohne Aufruf des LLM als Neutralität eingestuft. Die Embeddings werden gebündelt
+    berechnet und je Text zwischengespeichert (LRU). Für die Kalibrierung wird ein fester, anhand des Paares bestimmter Anteil der
+    Paare unabhängig von der Ähnlichkeit durch das LLM verarbeitet und dessen Polarität zusammen mit der Ähnlichkeit erfasst.
+    """
+
+    def __init__(self, model, threshold: float = 0.2, batch_size: int = 64, calibration_rate: float = 0.0, max_entries: int = 100000):
+        self.model = model
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.calibration_rate = calibration_rate
+        self.max_entries = max_entries
+        self.vectors = OrderedDict()
+        self.calibration = []
+        self.filtered = 0
+        self.checked = 0
+
+    def embed(self, texts: list):
+        """
+        Liefert die normierten Embeddings der Texte als Matrix; noch nicht zwischengespeicherte Texte werden gebündelt berechnet.
+        """
+
+        import numpy as np
+
+        texts = [str(text) for text in texts]
+        missing = [text for text in dict.fromkeys(texts) if text not in self.vectors]
+        if missing:
+            vectors = self.model.encode(missing, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+            self.vectors.update(zip(missing, vectors))
+        for text in texts:
+            self.vectors.move_to_end(text)
+        matrix = np.stack([self.vectors[text] for text in texts])
+
+        # Verdrängen der am längsten nicht genutzten Embeddings
+        while len(self.vectors) > self.max_entries:
+            self.vectors.popitem(last=False)
+
+        return matrix
+
+    def similarities(self, stanceDetPrompts: list) -> list:
+        """
+        Liefert die Kosinus-Ähnlichkeit von Hauptaussage und Kommentar je Prompt-Tupel.
+        """
+
+        aspects = self.embed([prompt_data[1] for prompt_data in stanceDetPrompts])
+        comments = self.embed([prompt_data[3] for prompt_data in stanceDetPrompts])
+        return (aspects * comments).sum(axis=1).tolist()
+
+    def sampled(self, prompt_data: tuple) -> bool:
+        """
+        Gibt an, ob das Paar zur Kalibrierungsstichprobe gehört. Die Auswahl hängt nur vom Paar ab und ist daher reproduzierbar.
+        """
+
+        if self.calibration_rate <= 0:
+            return False
+        digest = hashlib.sha256(json.dumps(stanceKey(prompt_data), ensure_ascii=False).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') < self.calibration_rate * 2 ** 64
+
+    def skips(self, prompt_data: tuple, similarity: float) -> bool:
+        return similarity < self.threshold and not self.sampled(prompt_data)
+
+    def calibrationReport(self, thresholds: list = (0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5)) -> dict:
+        """
+        Vergleicht für die Kalibrierungsstichprobe die Einstufung durch den Vorfilter mit den Polaritäten des LLM.
+
+        Parameters:
+            thresholds: Schwellenwerte, die zusätzlich zum gewählten Schwellenwert ausgewertet werden.
+
+        Returns:
+            report: Dictionary mit dem gewählten Schwellenwert, dem Umfang der Stichprobe und je Schwellenwert dem Anteil der
+                vorgefilterten Paare (filtered_share), dem Anteil davon, den auch das LLM als Neutralität einstuft (precision),
+                dem Anteil der Neutralitäten des LLM, die vorgefiltert würden (recall), sowie der Übereinstimmung aller Paare
+                mit dem LLM bei Anwendung des Vorfilters (agreement).
+        """
+
+        samples = len(self.calibration)
+        neutral = sum(label == 'Neutralität' for _, label in self.calibration)
+        rows = []
+        for threshold in sorted(set(thresholds) | {self.threshold}):
+            below = [label for similarity, label in self.calibration if similarity < threshold]
+            below_neutral = sum(label == 'Neutralität' for label in below)
+            rows.append({
+                'threshold': threshold,
+                'filtered_share': round(len(below) / samples, 4) if samples else None,
+                'precision': round(below_neutral / len(below), 4) if below else None,
+                'recall': round(below_neutral / neutral, 4) if neutral else None,
+                'agreement': round(1 - (len(below) - below_neutral) / samples, 4) if samples else None
+            })
+
+        return {'threshold': self.threshold, 'samples': samples, 'filtered': self.filtered, 'checked': self.checked, 'thresholds': rows}
+
+def loadEmbeddingFilter(model_id: str, threshold: float = 0.2, calibration_rate: float = 0.0) -> EmbeddingFilter:
+    """
+    Lädt ein Modell für Satz-Embeddings (sentence-transformers) auf der CPU und erstellt damit den Vorfilter der Stance Detection.
+
+    Parameters:
+        model_id: Modell-ID des Embedding-Modells aus dem HuggingFace-Hub.
+        threshold: Schwellenwert der Kosinus-Ähnlichkeit, unterhalb dessen ein Paar als Neutralität eingestuft wird.
+        calibration_rate: Anteil der Paare, die für die Kalibrierung unabhängig von der Ähnlichkeit durch das LLM verarbeitet werden.
+
+    Returns:
+        embedding_filter: Vorfilter bzw. None, sofern sentence-transformers nicht installiert ist.
+    """
+
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("Für den Vorfilter wird das Paket 'sentence-transformers' benötigt.")
+        return None
+
+    return EmbeddingFilter(SentenceTransformer(model_id, device='cpu'), threshold, calibration_rate=calibration_rate)
+
+def stanceKey(prompt_data: tuple) -> tuple:
+    """
+    Erzeugt den Schlüssel (Beitrags-ID, Kommentar-ID, Hauptaussage) eines Prompt-Tupels für das Fortschrittsprotokoll.
+    """
+
+    return (str(prompt_data[0]), str(prompt_data[2]), prompt_data[1])
+
+def stanceCacheKind(stance_mode: str, pack_size: int = 1) -> str:
+    """
+    Liefert die Art der Ergebnisse der Stance Detection im ResultCache. Ergebnisse aus Paketen (Modus 'generate', pack_size > 1)
+    werden unter eigener Art gespeichert, da sie mit einem anderen Prompt ermittelt wurden (siehe promptTemplateVersion).
+    """
+
+    return 'stance-packed' if stance_mode == 'generate' and pack_size > 1 else f'stance-{stance_mode}'
+
+def stanceCacheTexts(prompt_data: tuple) -> tuple:
+    """
+    Liefert die Eingabetexte (Hauptaussage, Kommentar) eines Prompt-Tupels, unter denen sein Ergebnis im ResultCache abgelegt wird.
+    """
+
+    return (prompt_data[1], prompt_data[3])
+
+def startsWithIds(ids, prefix_ids) -> bool:
+    """
+    Prüft, ob die Token-IDs prefix_ids den Anfang von ids bilden und danach noch mindestens ein Token folgt.
+    """
+
+    length = prefix_ids.shape[1]
+    return 0 < length < ids.shape[1] and bool((ids[:, :length] == prefix_ids).all())
+
+def splitPromptIds(prompt_parts: list, pipe, prefix_cache: PrefixCache = None) -> tuple:
+    """
+    Tokenisiert den vollständigen Prompt einmalig und ermittelt die Key/Values seines Präfixes aus dem Präfix-Cache.
+    Der Cache wird nur verwendet, wenn die Token-IDs des Präfixes den Anfang der Token-IDs des Prompts bilden; andernfalls
+    wird der Prompt wie ohne Cache vollständig verarbeitet.
+
+    Parameters:
+        prompt_parts: Bestandteile des Prompts. Alle Bestandteile bis auf den letzten bilden das Präfix.
+        pipe: Pipeline, deren Modell und Tokenizer verwendet werden.
+        prefix_cache: Optionaler Präfix-Cache.
+
+    Returns:
+        prompt_ids, prefix_length, prefix_past: Token-IDs des Prompts, Anzahl der Tokens des Präfixes und dessen Key/Values
+            (bzw. 0 und None, sofern der Cache nicht verwendet wird).
+    """
+
+    model = pipe.model
+    prompt_ids = pipe.tokenizer("".join(prompt_parts), return_tensors='pt').input_ids.to(model.device)
+
+    if prefix_cache is not None and len(prompt_parts) > 1:
+        prefix_ids, prefix_past = prefix_cache.lookup(prompt_parts[:-1])
+        if startsWithIds(prompt_ids, prefix_ids):
+            return prompt_ids, prefix_ids.shape[1], prefix_past
+
+    return prompt_ids, 0, None
+
+def generateWithPrefix(prompt_parts: list, pipe, prefix_cache: PrefixCache) -> str:
+    """
+    Generiert die Antwort des LLM auf einen Prompt unter Wiederverwendung der Key/Values seines Präfixes (siehe splitPromptIds).
+    Wie bei der Pipeline enthält der zurückgegebene Text den Prompt sowie die generierte Antwort. Passen die Token-IDs des
+    Präfixes nicht zum vollständigen Prompt, wird der Prompt durch die Pipeline verarbeitet.
+
+    Parameters:
+        prompt_parts: Bestandteile des Prompts. Alle Bestandteile bis auf den letzten bilden das Präfix.
+        pipe: Pipeline, deren Modell und Tokenizer verwendet werden.
+        prefix_cache: Präfix-Cache
+
+    Returns:
+        generated_text: Prompt und generierte Antwort.
+    """
+    import torch
+
+    tokenizer = pipe.tokenizer
+    model = pipe.model
+
+    input_ids, prefix_length, prefix_past = splitPromptIds(prompt_parts, pipe, prefix_cache)
+    if prefix_past is None:
+        return pipe("".join(prompt_parts))[0]["generated_text"]
+
+    # Generierung auf Basis der Key/Values des Präfixes; verarbeitet werden nur die Tokens nach dem Präfix. Anschließend
+    # werden die Key/Values wieder auf die Länge des Präfixes gekürzt, statt sie vorab je Prompt zu kopieren.
+    try:
+        with torch.no_grad():
+            output_ids = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=prefix_past,
+                pad_token_id=tokenizer.pad_token_id,
+                **GENERATION_KWARGS
+            )
+    finally:
+        prefix_past.crop(prefix_length)
+    answer = tokenizer.decode(output_ids[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    return "".join(prompt_parts) + answer
+
+def targetPromptParts(con_txt: str) -> list:
+    """
+    Erstellt die Bestandteile eines Prompts zur Target Identification. Der erste Bestandteil ist für alle Beiträge identisch.
+
+    Parameters:
+        con_txt: Beitragstext
+
+    Returns:
+        parts: Liste aus statischem Präfix (System- und Beispiel-Prompt) und beitragsspezifischem Prompt.
+    """
+
+    ti_main = f"""
         [INST]
-        Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
-        Hauptaussage:
-        - Fehlende Parkmöglichkeit für Lastenräder und mit Verankerung (Problem)
-        Kommentar:
-        - Mich stören schon E-Roller. Bitte keine klobigen Drahtesel überall im Stadtbild.
+        Ermittle die Hauptaussagen des folgenden Beitrages.
+        Beitrag:
+        {con_txt}
         [/INST]
-        Polarität:
-        Neutralität
+        Hauptaussagen:
         """
-    
+
+    return [TI_SYSTEM + TI_EXAMPLE, ti_main]
+
+def stancePromptParts(aspect_txt: str, com_txt: str) -> list:
+    """
+    Erstellt die Bestandteile eines Prompts zur Stance Detection. Der erste Bestandteil ist für alle Prompts identisch,
+    der zweite für alle Kommentare zur selben Hauptaussage.
+
+    Parameters:
+        aspect_txt: Hauptaussage (Target)
+        com_txt: Kommentartext
+
+    Returns:
+        parts: Liste aus statischem Präfix (System- und Beispiel-Prompt), Prompt-Teil zur Hauptaussage und Prompt-Teil zum Kommentar.
+    """
+
+    sd_aspect = f"""
+                          [INST]
+                          Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
+                          Hauptaussage:
+                          - {aspect_txt}
+                          Kommentar:
+                          - """
+    sd_comment = f"""{com_txt}
+                          [/INST]
+                          Polarität:
+                          """
+
+    return [SD_SYSTEM + SD_EXAMPLE, sd_aspect, sd_comment]
+
+def stancePackedPromptParts(aspect_txt: str, com_txts: list) -> list:
+    """
+    Erstellt die Bestandteile eines Prompts, der die Haltung mehrerer Kommentare zu einer Hauptaussage in einem Aufruf erfragt.
+    Die Antwort wird als nummerierte Liste der Polaritäten erwartet (siehe parsePackedStances).
+
+    Parameters:
+        aspect_txt: Hauptaussage (Target)
+        com_txts: Liste der Kommentartexte
+
+    Returns:
+        parts: Liste aus statischem Präfix (System- und Beispiel-Prompt), Prompt-Teil zur Hauptaussage und Prompt-Teil zu den Kommentaren.
+    """
+
+    sd_aspect = f"""
+                          [INST]
+                          Klassifiziere für jeden der folgenden nummerierten Kommentare, ob er der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
+                          Gib für jeden Kommentar genau eine Zeile der Form "Nummer. Polarität" aus.
+                          Hauptaussage:
+                          - {aspect_txt}
+                          Kommentare:
+                          """
+    # Kommentare werden einzeilig aufgeführt, damit die Nummerierung eindeutig bleibt
+    sd_comments = "".join(f"{number}. {' '.join(str(com_txt).split())}\n                          " for number, com_txt in enumerate(com_txts, 1))
+    sd_comments += """[/INST]
+                          Polaritäten:
+                          """
+
+    return [SD_SYSTEM + SD_EXAMPLE, sd_aspect, sd_comments]
+
+def generatePromptsForTargetIdentification(cons: dict) -> dict:
+    """
+    Generiert Prompts für die Ermittlung von Kernaussagen innerhalb von Beiträgen, welche die späteren Ziele (Targets) der Stance Detection bilden.
+
+    Parameters:
+        contribs: Dictionary mit Beiträgen {BID: Inhalt}
+
+    Returns:
+        prompt_dict: Dictionary der Form {BID: Prompt} bestehend aus Beitrags-IDs mit zugehörigen Prompts
+        zur Ermittlung der Kernaussagen.
+    """
+
+    prompt_dict = {}
+
+    # Iteration über die Beiträge des übergebenen Dictionarys und Erstellung eines Prompts zur Target Identification für jeden Beitrag daraus
+    for con_id, con_txt in cons.items():
+        # Kombination von System-, Beispiel- und beitragsspezifischem Prompt und Hinzufügen zum Prompt-Dictionary für Targetbestimmung
+        prompt = "".join(targetPromptParts(con_txt))
+        prompt_dict[str(con_id)] = [prompt]
+
+    return prompt_dict
+
+
+def parseTargets(generated_text: str) -> list:
+    """
+    Extrahiert die Hauptaussagen (Targets) aus der Antwort des LLM auf einen Prompt zur Target Identification.
+
+    Parameters:
+        generated_text: Vom LLM generierter Text inklusive Prompt.
+
+    Returns:
+        statements: Liste der Hauptaussagen
+    """
+
+    generated_answer = generated_text.strip().split('Hauptaussagen:')[-1].strip()
+
+    return [statement.strip() for statement in generated_answer.split('\n') if statement.strip()]
+
+def extractTargetsInContributions(prompt_dict: dict, pipe, prefix_cache: PrefixCache = None, result_cache: ResultCache = None, checkpoint: RunCheckpoint = None,
+                                  metrics: RunMetrics = None, previous_targets: dict = None) -> dict:
+    """
+    Extrahiert die Hauptaussagen (Targets) aus den Beiträgen durch die Übergabe der Prompts an die Pipeline des LLM.
+
+    Parameters:
+        prompt_dict: Dictionary bestehend aus Beitrags-IDs mit zugehörigen Prompts zur Ermittlung der Kernaussagen.
+        pipe: Pipeline zur Verarbeitung der Prompts durch das LLM
+        prefix_cache: Optionaler Präfix-Cache, über den die Key/Values des statischen System- und Beispiel-Prompts wiederverwendet werden.
+        result_cache: Optionaler persistenter Ergebnis-Cache. Bereits verarbeitete Beiträge werden daraus übernommen.
+        checkpoint: Optionales Fortschrittsprotokoll. Bereits abgeschlossene Beiträge werden übersprungen, neu abgeschlossene protokolliert.
+        metrics: Optionale Erfassung der Kennzahlen. Jeder Aufruf des LLM wird in der Stufe 'targets' erfasst.
+        previous_targets: Optionales Dictionary der Form {BID: [Hauptaussagen]} unveränderter Beiträge eines vorherigen Durchlaufs
+            (siehe PreviousRun.completedTargets). Diese Beiträge werden nicht erneut verarbeitet.
+
+    Returns:
+        aspect_results: Dictionary der Form {BID: [Hauptaussagen]} bestehend aus Beitrags-IDs und den in den Beiträgen 
+            identifizierten Hauptaussagen als Liste.
+    """
+
+    aspect_results = {}
+    ti_prefix = TI_SYSTEM + TI_EXAMPLE
+    completed = checkpoint.completedTargets() if checkpoint is not None else {}
+    if previous_targets is not None:
+        completed = {**previous_targets, **completed}
+
+    # Iteration über die Prompts zur Extraktion der Hauptaussagen im Prompt-Dictionary
+    for con_id, prompts in prompt_dict.items():
+        # Übernahme der Hauptaussagen bereits abgeschlossener Beiträge eines fortgesetzten bzw. vorherigen Durchlaufs
+        if con_id in completed:
+            aspect_results[con_id] = completed[con_id]
+            if metrics is not None:
+                metrics.advance('targets')
+            continue
+
+        aspect_results[con_id] = []
+        # Generieren aller Hauptaussagen (Targets) eines jeweiligen Beitrags
+        for prompt in prompts:
+            # Übernahme bereits zwischengespeicherter Hauptaussagen
+            if result_cache is not None:
+                statements = result_cache.get('targets', prompt)
+                if statements is not None:
+                    aspect_results[con_id].extend(statements)
+                    continue
+
+            # Wiederverwendung der Key/Values des statischen Präfixes, sofern ein Präfix-Cache übergeben wurde
+            prompt_parts = [ti_prefix, prompt[len(ti_prefix):]] if prompt.startswith(ti_prefix) else [prompt]
+            start = time.monotonic()
+            if prefix_cache is not None and len(prompt_parts) > 1:
+                generated_text = generateWithPrefix(prompt_parts, pipe, prefix_cache)
+            else:
+                answer = pipe(prompt)
+                generated_text = answer[0]["generated_text"]
+            if metrics is not None:
+                metrics.record('targets', time.monotonic() - start, prompt_parts, generated_text)
+            # Extraktion der Hauptaussagen (Targets) aus der modellgenerierten Antwort
+            statements = parseTargets(generated_text)
+            aspect_results[con_id].extend(statements)
+            if result_cache is not None:
+                result_cache.put('targets', statements, prompt)
+
+        if checkpoint is not None:
+            checkpoint.appendTargets(con_id, aspect_results[con_id])
+        if metrics is not None:
+            metrics.advance('targets')
+
+    return aspect_results
+
+class StancePrompt(NamedTuple):
+    """
+    Kompakter Datensatz eines Prompts zur Stance Detection. Gespeichert werden nur IDs, Verweise auf die Texte und die ID der
+    Prompt-Vorlage; der vollständige Prompt wird erst bei Bedarf erzeugt (siehe prompt und parts).
+    """
+
+    aspect_id: int
+    aspect_txt: str
+    com_id: str
+    com_txt: str
+    template: str = 'stance'
+
+    @property
+    def parts(self) -> list:
+        return STANCE_TEMPLATES[self.template](self.aspect_txt, self.com_txt)
+
+    @property
+    def prompt(self) -> str:
+        return "".join(self.parts)
+
+# Prompt-Vorlagen der Stance Detection, auf die StancePrompt.template verweist
+STANCE_TEMPLATES = {'stance': stancePromptParts}
+
+def countStancePrompts(aspects: dict, com_dict: dict) -> int:
+    """
+    Liefert die Anzahl der Prompts, die generatePromptsForStanceDetection für die übergebenen Hauptaussagen erzeugt.
+    """
+
+    return sum(len(aspect_list) * len(com_dict[int(aspect_id)]['Kommentare']) for aspect_id, aspect_list in aspects.items() if int(aspect_id) in com_dict)
+
+def generatePromptsForStanceDetection(aspects: dict, com_dict: dict, token_counter: TokenCounter = None, comment_token_budget: int = None):
+    """
+    Generiert Prompts für die Stance Detection. Für jede der Kernaussagen (Target), die aus dem betrachteten Beitrag ermittelt wurde,
+    wird ein Prompt generiert, der die Haltung des Kommentars hinsichtlich der identifizierten Hauptaussage erfragen soll.
+    Die Prompts werden schrittweise als kompakte Datensätze (StancePrompt) geliefert und erst bei ihrer Verarbeitung erzeugt,
+    sodass der Speicherbedarf nicht mit der Anzahl der Paare wächst.
+
+    Parameters:
+        aspects: Dictionary, das Beitrags-IDs und zugehörige, identifizierte Kernaussagen (Targets der Stance Detection) enthält.
+        comments_dict: Dictionary, das Beitrag-IDs die Beitragsinhalte sowie alle zugehörigen Kommentare zuordnet.
+        token_counter: Optionaler TokenCounter für die Kürzung der Kommentare. Ohne Angabe wird die Anzahl der Tokens geschätzt.
+        comment_token_budget: Optionale maximale Anzahl der Tokens je Kommentar. Längere Kommentare werden gekürzt, wobei Anfang
+            und Ende erhalten bleiben (siehe TokenCounter.truncate). Ohne Angabe werden die Kommentare nicht gekürzt.
+
+    Returns:
+        Generator, der StancePrompt-Datensätze aus Beitrags-ID, Hauptaussage, Kommentar-ID, (ggf. gekürztem) Kommentartext und
+        ID der Prompt-Vorlage liefert.
+        
+    """
+
+    if comment_token_budget is not None and token_counter is None:
+        token_counter = TokenCounter()
+
     aspects_int_keys = {int(key): value for key, value in aspects.items()}
     
     # Iteration über die identifizierten Hauptaussagen (Targets)
     for aspect_id, aspect_list in aspects_int_keys.items():
         # Überprüfung, ob der zu einer Hauptaussage (Target) gehöriger Beitrag überhaupt Kommentare besitzt
         if aspect_id in com_dict:
-            # Abrufen der zugehörigen Kommentare
+            # Abrufen der zugehörigen Kommentare; Kürzung einmalig je Kommentar, nicht je Hauptaussage
             comments_to_contrib = com_dict[aspect_id]['Kommentare']
+            if comment_token_budget is not None:
+                comments_to_contrib = {com_id: token_counter.truncate(com_txt, comment_token_budget) for com_id, com_txt in comments_to_contrib.items()}
             # Iteration über alle Hauptaussagen (Targets) eines Beitrags
             for aspect_txt in aspect_list:
                 # Iteration über alle zum Beitrag der Hauptaussage gehörenden Kommentare
                 for com_id, com_txt in comments_to_contrib.items():
-                    # Generieren des Stance Detection-Prompts für jedes Hauptaussage-Kommentar-Paar
-                    sd_main = f"""
-                          [INST]
-                          Klassifiziere, ob der folgende Kommentar der folgenden Hauptaussage zustimmt, widerspricht oder neutral gegenüber ist.
-                          Hauptaussage:
-                          - {aspect_txt}
-                          Kommentar:
-                          - {com_txt}
-                          [/INST]
-                          Polarität:
-                          """
-                    # Erstellen eines Tupels aus Beitrags-ID, Hauptaussage, Kommentar-ID, Kommentartext und Prompt und
-                    # Hinzufügen zur Liste mit den Prompts für die Stance Detection
-                    prompt_data = (aspect_id, aspect_txt, com_id, com_txt, sd_system + sd_example + sd_main)
-                    prompts.append(prompt_data)
+                    # Liefern des Datensatzes für jedes Hauptaussage-Kommentar-Paar; die Texte werden nur referenziert
+                    yield StancePrompt(aspect_id, aspect_txt, com_id, com_txt)
+
+def estimateRun(target_contributions: dict, com_dict: dict, targets_per_contribution: int = 3, aspect_chars: int = 100,
+                comment_token_budget: int = None, token_counter: TokenCounter = None) -> dict:
+    """
+    Schätzt den Umfang eines Durchlaufs, ohne Modell oder Tokenizer zu laden. Da die Hauptaussagen erst durch das LLM ermittelt
+    werden, wird für die Stance Detection eine feste Anzahl an Hauptaussagen je Beitrag und eine feste Länge je Hauptaussage angenommen.
+    Die Anzahl der Tokens wird über die Anzahl der Zeichen abgeschätzt (siehe TokenCounter.estimate).
+
+    Parameters:
+        target_contributions: Dictionary der Beiträge {BID: Inhalt}, deren Hauptaussagen ermittelt werden.
+        com_dict: Dictionary, das Beitrag-IDs die Beitragsinhalte sowie alle zugehörigen Kommentare zuordnet (siehe joinConsComs).
+        targets_per_contribution: Angenommene Anzahl der Hauptaussagen je Beitrag. Der Default-Parameter ist 3 (wie im Beispiel-Prompt).
+        aspect_chars: Angenommene Anzahl der Zeichen je Hauptaussage. Der Default-Parameter ist 100.
+        comment_token_budget: Optionale maximale Anzahl der Tokens je Kommentar (siehe generatePromptsForStanceDetection).
+        token_counter: Optionaler TokenCounter, dessen Schätzung verwendet wird. Ohne Angabe werden vier Zeichen je Token angenommen.
+
+    Returns:
+        estimate: Dictionary mit der Anzahl der Beiträge, Kommentare und Paare sowie den geschätzten Prompt-Tokens je Stufe.
+    """
+
+    if token_counter is None:
+        token_counter = TokenCounter()
+
+    # Zeichen der Prompts zur Target Identification
+    target_chars = sum(len("".join(targetPromptParts(con_txt))) for con_txt in target_contributions.values())
+
+    # Zeichen der Prompts zur Stance Detection: fester Anteil je Paar zuzüglich des jeweiligen Kommentars
+    pair_chars = len("".join(stancePromptParts("", ""))) + aspect_chars
+    comment_chars = int(comment_token_budget * token_counter.chars_per_token) if comment_token_budget is not None else None
+    num_comments = 0
+    stance_chars = 0
+    for entry in com_dict.values():
+        num_comments += len(entry['Kommentare'])
+        stance_chars += sum(pair_chars + min(len(str(com_txt)), comment_chars or len(str(com_txt))) for com_txt in entry['Kommentare'].values()) * targets_per_contribution
+
+    return {
+        'contributions': len(target_contributions),
+        'commented_contributions': len(com_dict),
+        'comments': num_comments,
+        'pairs': num_comments * targets_per_contribution,
+        'target_prompt_tokens': token_counter.estimate(target_chars),
+        'stance_prompt_tokens': token_counter.estimate(stance_chars)
+    }
+
+class AsyncScheduler:
+    """
+    Nebenläufige Verarbeitung beider Stufen (Target Identification und Stance Detection) mittels asyncio.
+    Es sind höchstens max_in_flight Anfragen gleichzeitig an das Backend gerichtet. Aufträge werden über begrenzte
+    Warteschlangen verteilt (Backpressure): Ist die Warteschlange der Stance Detection voll, wartet die Target Identification.
+    Sobald die Hauptaussagen eines Beitrags vorliegen, werden dessen Prompts zur Stance Detection eingereiht, sodass sich
+    beide Stufen überlappen. Vorübergehende Fehler des Backends werden mit exponentiell wachsender, zufällig gestreuter
+    Wartezeit wiederholt. Ergebnisse eines vorherigen Durchlaufs (previous_targets, previous_stances; siehe PreviousRun) werden
+    wie die eines fortgesetzten Durchlaufs übernommen.
+    """
+
+    def __init__(self, pipe, max_in_flight: int = 8, queue_size: int = 64, max_retries: int = 3, retry_delay: float = 1.0,
+                 result_cache: ResultCache = None, checkpoint: RunCheckpoint = None, metrics: RunMetrics = None, comment_token_budget: int = None,
+                 previous_targets: dict = None, previous_stances: dict = None, token_counter: TokenCounter = None):
+        self.pipe = pipe
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.result_cache = result_cache
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.comment_token_budget = comment_token_budget
+        self.previous_targets = previous_targets or {}
+        self.previous_stances = previous_stances or {}
+        self.token_counter = token_counter if token_counter is not None else TokenCounter(getattr(pipe, 'tokenizer', None))
+        # Jeder Prompt wird einzeln generiert (Modus 'generate', ohne Pakete); Ergebnisse teilen sich den Cache mit saveStance
+        self.stance_kind = stanceCacheKind('generate')
+        # Die Pipeline von transformers wird nicht nebenläufig aufgerufen
+        self.pipe_lock = threading.Lock()
+        # Zugriffe auf Ergebnis-Cache und Fortschrittsprotokoll erfolgen außerhalb der Ereignisschleife, aber nacheinander
+        self.io_lock = threading.Lock()
+
+    def callPipe(self, prompt: str) -> str:
+        with self.pipe_lock:
+            return self.pipe(prompt)[0]["generated_text"]
+
+    def callIO(self, function, *args):
+        with self.io_lock:
+            return function(*args)
+
+    async def runIO(self, function, *args):
+        """
+        Führt einen blockierenden Zugriff auf Ergebnis-Cache oder Fortschrittsprotokoll in einem Thread aus, damit die
+        Ereignisschleife währenddessen weitere Anfragen bearbeitet.
+        """
+
+        return await asyncio.to_thread(self.callIO, function, *args)
+
+    async def generate(self, prompt: str, semaphore: asyncio.Semaphore, stage: str = None, prompt_parts: list = None, prompt_data: StancePrompt = None) -> str:
+        """
+        Generiert die Antwort auf einen Prompt (inklusive Prompt) und wiederholt die Anfrage bei vorübergehenden Fehlern.
+        Die Latenz der erfolgreichen Anfrage wird ggf. in der Stufe stage erfasst. Die Prompt-Tokens werden aus dem StancePrompt-Datensatz
+        (siehe TokenCounter.stanceTokens) bzw. aus den Bestandteilen des Prompts gezählt (siehe RunMetrics.countCall).
+        """
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    start = time.monotonic()
+                    if hasattr(self.pipe, 'acomplete'):
+                        generated_text = prompt + await self.pipe.acomplete(prompt)
+                    else:
+                        generated_text = await asyncio.to_thread(self.callPipe, prompt)
+                if self.metrics is not None and self.metrics.record_calls and stage is not None:
+                    prompt_tokens = self.token_counter.stanceTokens(prompt_data) if prompt_data is not None else None
+                    self.metrics.record(stage, time.monotonic() - start, prompt_parts or prompt, generated_text, prompt_tokens)
+                return generated_text
+            except BackendError as error:
+                if not error.transient or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def run(self, target_prompts: dict, entries: dict) -> tuple:
+        """
+        Führt Target Identification und Stance Detection nebenläufig durch.
 
-    return prompts
+        Parameters:
+            target_prompts: Dictionary der Form {BID: [Prompt]} (siehe generatePromptsForTargetIdentification).
+            entries: Dictionary der Beiträge mit zugehörigen Kommentaren (siehe joinConsComs).
+
+        Returns:
+            targets, stance_results: Dictionary der Form {BID: [Hauptaussagen]} sowie Dictionary der Ergebnisse der Stance Detection
+                der Form {(Beitrags-ID, Kommentar-ID, Hauptaussage): Antwort des LLM} (siehe stanceKey und stanceCompletion).
+        """
+
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        target_queue = asyncio.Queue(self.queue_size)
+        stance_queue = asyncio.Queue(self.queue_size)
+        targets = {con_id: None for con_id in target_prompts}
+        stance_results = {}
+        completed_targets = {**self.previous_targets, **(await self.runIO(self.checkpoint.completedTargets) if self.checkpoint is not None else {})}
+        completed_stances = {**self.previous_stances, **(await self.runIO(self.checkpoint.completedStances) if self.checkpoint is not None else {})}
+
+        async def targetWorker():
+            while True:
+                con_id, prompts = await target_queue.get()
+                try:
+                    statements = completed_targets.get(con_id)
+                    if statements is None:
+                        statements = []
+                        for prompt in prompts:
+                            cached = await self.runIO(self.result_cache.get, 'targets', prompt) if self.result_cache is not None else None
+                            if cached is None:
+                                prompt_parts = [TI_SYSTEM + TI_EXAMPLE, prompt[len(TI_SYSTEM + TI_EXAMPLE):]] if prompt.startswith(TI_SYSTEM + TI_EXAMPLE) else None
+                                cached = parseTargets(await self.generate(prompt, semaphore, 'targets', prompt_parts))
+                                if self.result_cache is not None:
+                                    await self.runIO(self.result_cache.put, 'targets', cached, prompt)
+                            statements.extend(cached)
+                        if self.checkpoint is not None:
+                            await self.runIO(self.checkpoint.appendTargets, con_id, statements)
+                    targets[con_id] = statements
+                    if self.metrics is not None:
+                        self.metrics.advance('targets')
+
+                    # Einreihen der Stance Detection für die Kommentare des Beitrags
+                    for prompt_data in generatePromptsForStanceDetection({con_id: statements}, entries, self.token_counter, self.comment_token_budget):
+                        await stance_queue.put(prompt_data)
+                finally:
+                    target_queue.task_done()
+
+        async def stanceWorker():
+            while True:
+                prompt_data = await stance_queue.get()
+                try:
+                    key = stanceKey(prompt_data)
+                    result = completed_stances.get(key)
+                    if result is None:
+                        texts = stanceCacheTexts(prompt_data)
+                        result = await self.runIO(self.result_cache.get, self.stance_kind, *texts) if self.result_cache is not None else None
+                        if result is None:
+                            # Bis zum Speichern wird nur die Antwort ohne Prompt vorgehalten
+                            prompt = prompt_data.prompt
+                            result = stanceCompletion(prompt, await self.generate(prompt, semaphore, 'stance', prompt_data=prompt_data))
+                            if self.result_cache is not None:
+                                await self.runIO(self.result_cache.put, self.stance_kind, result, *texts)
+                        if self.checkpoint is not None:
+                            await self.runIO(self.checkpoint.appendStance, key, result)
+                    stance_results[key] = result
+                    if self.metrics is not None:
+                        self.metrics.advance('stance')
+                finally:
+                    stance_queue.task_done()
+
+        workers = [asyncio.create_task(targetWorker()) for _ in range(self.max_in_flight)]
+        workers += [asyncio.create_task(stanceWorker()) for _ in range(self.max_in_flight)]
+
+        try:
+            # Einreihen der Target Identification; wartet bei voller Warteschlange
+            for con_id, prompts in target_prompts.items():
+                await self.waitFor(target_queue.put((con_id, prompts)), workers)
+            await self.waitFor(target_queue.join(), workers)
+            await self.waitFor(stance_queue.join(), workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return targets, stance_results
+
+    async def waitFor(self, awaitable, workers: list) -> None:
+        """
+        Wartet auf awaitable und bricht ab, sobald ein Worker mit einem Fehler beendet wurde. Da ein fehlgeschlagener Worker
+        seinen Auftrag dennoch als erledigt markiert, wird auch nach Abschluss von awaitable auf beendete Worker geprüft.
+        """
+
+        waiter = asyncio.ensure_future(awaitable)
+        await asyncio.wait([waiter] + workers, return_when=asyncio.FIRST_COMPLETED)
+        for worker in workers:
+            if worker.done():
+                waiter.cancel()
+                worker.result()
+        await waiter
 
 def getTargets(aspect_ids: list, aspects: dict) -> list:
     """
@@ -404,55 +2131,794 @@ def saveTargets(contributions: dict, aspects: dict, output_file: str = 'Targets.
                 'Hauptaussagen': aspects_combined
                 })
     
-import csv
+def parseStance(generated_text: str) -> tuple:
+    """
+    Extrahiert die Haltung und eine ggf. mitgenerierte Begründung aus der Antwort des LLM.
+
+    Parameters:
+        generated_text: Vom LLM generierter Text inklusive Prompt.
+
+    Returns:
+        stance, reasoning: Tupel aus der ermittelten Haltung und der Begründung.
+    """
+
+    # Postprocessing des generierten Textes für das erwünschte Antwortformat
+    last_stance_index = generated_text.rfind('Polarität:')
+    if last_stance_index != -1:
+        stance_text = generated_text[last_stance_index + len('Polarität:'):].strip()
+        stance_lines = stance_text.split('\n', 1)
+        stance = stance_lines[0].strip()
+        reasoning = stance_lines[1].strip() if len(stance_lines) > 1 else ""
+    else:
+        stance = 'Unbekannt'
+        reasoning = generated_text
+
+    return stance, reasoning
+
+def stanceCompletion(prompt: str, generated_text: str) -> str:
+    """
+    Liefert die Antwort des LLM auf einen Prompt zur Stance Detection ohne den Prompt in der Form "Polarität:\n<Antwort>",
+    aus der parseStance dieselbe Haltung und Begründung ermittelt wie aus dem vollständigen generierten Text. So werden im
+    Fortschrittsprotokoll und im Ergebnis-Cache nur die Antworten gespeichert.
+
+    Parameters:
+        prompt: Prompt zur Stance Detection.
+        generated_text: Vom LLM generierter Text inklusive Prompt.
+
+    Returns:
+        completion: Antwort des LLM mit vorangestelltem "Polarität:".
+    """
+
+    if generated_text.startswith(prompt):
+        generated_text = generated_text[len(prompt):]
+
+    return "Polarität:\n" + generated_text.strip()
+
+def runStanceBatches(stanceDetPrompts, pipe, batch_size: int, bucket_window: int = 16, token_counter: TokenCounter = None, metrics: RunMetrics = None):
+    """
+    Verarbeitet die Prompts zur Stance Detection gebündelt (Batches) durch die Pipeline des LLM.
+    Innerhalb eines Fensters von batch_size * bucket_window Prompts werden diese nach ihrer Anzahl an Tokens sortiert,
+    sodass die Batches möglichst wenig Padding enthalten. Die Ergebnisse werden in der ursprünglichen Reihenfolge zurückgegeben.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von StancePrompt-Datensätzen.
+        pipe: Pipeline zur Verarbeitung der Prompts durch das LLM.
+        batch_size: Anzahl der gleichzeitig verarbeiteten Prompts.
+        bucket_window: Anzahl der Batches, über die hinweg nach Länge sortiert wird.
+        token_counter: Optionaler TokenCounter, z. B. aus der Erstellung der Prompts. Ohne Angabe wird ein TokenCounter mit dem
+            Tokenizer der Pipeline verwendet.
+        metrics: Optionale Erfassung der Kennzahlen. Jeder Batch wird als ein Aufruf des LLM in der Stufe 'stance' erfasst.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel und Antwort des LLM (siehe stanceCompletion) in der ursprünglichen Reihenfolge liefert.
+    """
+
+    if token_counter is None:
+        token_counter = TokenCounter(getattr(pipe, 'tokenizer', None))
+    prompt_iter = iter(stanceDetPrompts)
+    window_size = max(batch_size, 1) * max(bucket_window, 1)
+
+    while True:
+        window = list(itertools.islice(prompt_iter, window_size))
+        if not window:
+            break
+
+        # Sortierung der Prompts nach ihrer Anzahl an Tokens (Length Bucketing) zur Reduktion des Paddings
+        order = sorted(range(len(window)), key=lambda i: token_counter.promptTokens(window[i]))
+        prompts = [window[i].prompt for i in order]
+        # Übergabe als Liste; einen Iterator, der kein Generator ist, behandelt die Pipeline von transformers als einzelne Eingabe
+        outputs = pipe(prompts, batch_size=batch_size)
+
+        # Zuordnung der Antworten (ohne Prompt) zur ursprünglichen Position des Prompts
+        generated = [None] * len(window)
+        start, call_tokens = time.monotonic(), [0, 0]
+        for number, (i, prompt, answer) in enumerate(zip(order, prompts, outputs), 1):
+            generated[i] = stanceCompletion(prompt, answer[0]["generated_text"])
+            # Erfassung je Batch; die Antworten eines Batches werden gemeinsam generiert
+            if metrics is not None and metrics.record_calls:
+                prompt_tokens, generated_tokens = metrics.countCall(prompt, answer[0]["generated_text"], token_counter.stanceTokens(window[i]))
+                call_tokens = [call_tokens[0] + prompt_tokens, call_tokens[1] + generated_tokens]
+                if number % batch_size == 0 or number == len(window):
+                    metrics.recordCall('stance', time.monotonic() - start, *call_tokens)
+                    start, call_tokens = time.monotonic(), [0, 0]
+
+        for prompt_data, generated_text in zip(window, generated):
+            yield prompt_data, generated_text
+
+def commonPrefixLength(ids, other_ids) -> int:
+    """
+    Liefert die Anzahl der übereinstimmenden Token-IDs am Anfang zweier Folgen von Token-IDs.
+    """
+
+    length = min(ids.shape[1], other_ids.shape[1])
+    mismatches = (ids[0, :length] != other_ids[0, :length]).nonzero()
+    return int(mismatches[0, 0]) if len(mismatches) else length
+
+def scoreStanceLabels(prompt_parts: list, pipe, labels: list = STANCE_LABELS, prefix_cache: PrefixCache = None) -> dict:
+    """
+    Bewertet die zulässigen Polaritäten für einen Prompt zur Stance Detection, ohne eine Antwort frei zu generieren.
+    Jede Polarität wird wie in den Beispielen als Fortsetzung des Prompts tokenisiert (Prompt und Polarität gemeinsam);
+    bewertet werden die Tokens, in denen sich diese Tokenisierung von der des Prompts unterscheidet. Der gemeinsame Teil
+    des Prompts wird einmalig durch das LLM verarbeitet. Nach jeder Polarität werden die Key/Values wieder auf dessen Länge
+    gekürzt, statt sie je Polarität zu kopieren; ebenso wird der Eintrag des Präfix-Caches nur vorübergehend erweitert.
+
+    Parameters:
+        prompt_parts: Prompt zur Stance Detection als Zeichenfolge oder als Liste seiner Bestandteile (siehe stancePromptParts).
+        pipe: Pipeline, deren Modell und Tokenizer für die Bewertung verwendet werden.
+        labels: Liste der zu bewertenden Polaritäten. Der Default-Parameter ist STANCE_LABELS.
+        prefix_cache: Optionaler Präfix-Cache für die Wiederverwendung der Key/Values gemeinsamer Prompt-Präfixe.
+
+    Returns:
+        probabilities: Dictionary der Form {Polarität: Wahrscheinlichkeit}, normiert über die übergebenen Polaritäten.
+    """
+    import torch
+
+    tokenizer = pipe.tokenizer
+    model = pipe.model
+
+    if isinstance(prompt_parts, str):
+        prompt_parts = [prompt_parts]
+    prompt = "".join(prompt_parts)
+
+    # Token-IDs des Prompts und der Fortsetzungen um die jeweilige Polarität samt Beginn der Polarität
+    prompt_ids, prefix_length, prefix_past = splitPromptIds(prompt_parts, pipe, prefix_cache)
+    label_ids = [tokenizer(prompt + label, return_tensors='pt').input_ids.to(model.device) for label in labels]
+    label_starts = [max(commonPrefixLength(prompt_ids, ids), 1) for ids in label_ids]
+    # Gemeinsamer Kontext aller Polaritäten; dessen letztes Token liefert je Polarität die Wahrscheinlichkeit des ersten Tokens
+    context_length = min(label_starts) - 1
+
+    use_prefix = prefix_past is not None and context_length >= prefix_length
+    past = prefix_past if use_prefix else dynamicCache()
+    try:
+        with torch.no_grad():
+            if context_length > past.get_seq_length():
+                model(input_ids=prompt_ids[:, past.get_seq_length():context_length], past_key_values=past, use_cache=True)
+
+            scores = []
+            # Berechnung der Log-Wahrscheinlichkeit der Tokens jeder Polarität als Fortsetzung des Prompts
+            for ids, label_start in zip(label_ids, label_starts):
+                label_output = model(input_ids=ids[:, context_length:-1], past_key_values=past, use_cache=True)
+                # Verwerfen der Key/Values der Polarität für die Bewertung der nächsten Polarität
+                past.crop(context_length)
+                label_logprobs = torch.log_softmax(label_output.logits[0].float(), dim=-1)
+                token_logprobs = label_logprobs.gather(1, ids[0, context_length + 1:].unsqueeze(1))
+                scores.append(token_logprobs[label_start - context_length - 1:].sum())
+
+            probabilities = torch.softmax(torch.stack(scores), dim=0)
+    finally:
+        if use_prefix:
+            past.crop(prefix_length)
+
+    return {label: probability.item() for label, probability in zip(labels, probabilities)}
+
+def parsePackedStances(generated_text: str, count: int) -> dict:
+    """
+    Extrahiert die Polaritäten aus der Antwort auf einen Prompt mit mehreren Kommentaren (siehe stancePackedPromptParts).
+    Berücksichtigt werden nur Zeilen der Form "Nummer. Polarität" mit einer Nummer zwischen 1 und count und einer zulässigen
+    Polarität; bei mehrfach genannter Nummer gilt die erste Nennung.
+
+    Parameters:
+        generated_text: Vom LLM generierter Text inklusive Prompt.
+        count: Anzahl der Kommentare im Prompt.
+
+    Returns:
+        stances: Dictionary der Form {Nummer: Polarität} der erkannten Polaritäten.
+    """
+
+    stances = {}
+    answer = generated_text[generated_text.rfind('Polaritäten:') + len('Polaritäten:'):] if 'Polaritäten:' in generated_text else generated_text
+
+    for line in answer.split('\n'):
+        match = re.match(r'\s*[-*]?\s*(\d+)\s*[.):\-]\s*\**\s*([A-Za-zÄÖÜäöüß]+)', line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        label = next((label for label in STANCE_LABELS if match.group(2).lower().startswith(label[:7].lower())), None)
+        if label is not None and 1 <= number <= count and number not in stances:
+            stances[number] = label
+
+    return stances
+
+def packStancePrompts(stanceDetPrompts, pack_size: int, pipe=None, token_counter: TokenCounter = None):
+    """
+    Fasst aufeinanderfolgende Prompt-Tupel derselben Hauptaussage zu Paketen von höchstens pack_size Kommentaren zusammen.
+    Sofern die Pipeline einen Tokenizer und ein Modell mit bekannter Kontextlänge besitzt, wird die Paketgröße zusätzlich
+    so begrenzt, dass Prompt und Antwort in den Kontext des Modells passen.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln, geordnet nach Hauptaussage.
+        pack_size: Maximale Anzahl der Kommentare je Paket.
+        pipe: Optionale Pipeline zur Bestimmung von Tokenanzahl und Kontextlänge.
+        token_counter: Optionaler TokenCounter. Ohne Angabe wird ein TokenCounter mit dem Tokenizer der Pipeline verwendet.
+
+    Returns:
+        Generator, der Pakete als Listen von Prompt-Tupeln liefert.
+    """
+
+    tokenizer = getattr(pipe, 'tokenizer', None)
+    config = getattr(getattr(pipe, 'model', None), 'config', None)
+    context_length = getattr(config, 'max_position_embeddings', None)
+
+    # Begrenzung der Paketgröße durch die Länge der Antwort (ca. 8 Tokens je Kommentar)
+    pack_size = max(min(pack_size, GENERATION_KWARGS['max_new_tokens'] // 8), 1)
+    token_budget = context_length - GENERATION_KWARGS['max_new_tokens'] if tokenizer is not None and context_length else None
+
+    if token_budget and token_counter is None:
+        token_counter = TokenCounter(tokenizer)
+
+    pack, pack_tokens = [], 0
+    for prompt_data in stanceDetPrompts:
+        same_aspect = pack and (pack[0][0], pack[0][1]) == (prompt_data[0], prompt_data[1])
+        comment_tokens = token_counter.count(prompt_data[3]) + 4 if token_budget else 0
+
+        if pack and (not same_aspect or len(pack) >= pack_size or (token_budget and pack_tokens + comment_tokens > token_budget)):
+            yield pack
+            pack, pack_tokens = [], 0
+
+        if not pack and token_budget:
+            pack_tokens = token_counter.templateTokens(stancePackedPromptParts, prompt_data[1], [])
+        pack.append(prompt_data)
+        pack_tokens += comment_tokens
+
+    if pack:
+        yield pack
+
+def packedStanceResults(stanceDetPrompts, pipe, pack_size: int, fallback, prefix_cache: PrefixCache = None, token_counter: TokenCounter = None,
+                        metrics: RunMetrics = None):
+    """
+    Führt die Stance Detection paketweise durch: Ein Prompt enthält eine Hauptaussage und bis zu pack_size Kommentare.
+    Für Kommentare, deren Polarität in der Antwort fehlt oder nicht zulässig ist, wird die Stance Detection einzeln über
+    fallback durchgeführt.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln.
+        pipe: Pipeline zur Verarbeitung der Prompts durch das LLM.
+        pack_size: Maximale Anzahl der Kommentare je Prompt.
+        fallback: Funktion, die für eine Liste von Prompt-Tupeln Tupel aus Prompt-Tupel und Ergebnis liefert (siehe computeStanceResults).
+        prefix_cache: Optionaler Präfix-Cache.
+        token_counter: Optionaler TokenCounter für die Begrenzung der Pakete (siehe packStancePrompts).
+        metrics: Optionale Erfassung der Kennzahlen. Jedes Paket wird als ein Aufruf des LLM in der Stufe 'stance' erfasst.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel und Ergebnis in der Reihenfolge der Prompts liefert. Das Ergebnis hat das Format
+        des generierten Textes, sodass es mit parseStance ausgewertet werden kann.
+    """
+
+    for pack in packStancePrompts(stanceDetPrompts, pack_size, pipe, token_counter):
+        parts = stancePackedPromptParts(pack[0][1], [prompt_data[3] for prompt_data in pack])
+        start = time.monotonic()
+        if prefix_cache is not None:
+            generated_text = generateWithPrefix(parts, pipe, prefix_cache)
+        else:
+            generated_text = pipe("".join(parts))[0]["generated_text"]
+        if metrics is not None and metrics.record_calls:
+            metrics.record('stance', time.monotonic() - start, parts, generated_text,
+                           metrics.token_counter.templateTokens(stancePackedPromptParts, pack[0][1], [prompt_data[3] for prompt_data in pack]))
+        stances = parsePackedStances(generated_text, len(pack))
+
+        # Einzelverarbeitung der Kommentare ohne gültige Polarität
+        missing = [prompt_data for number, prompt_data in enumerate(pack, 1) if number not in stances]
+        fallback_results = iter(fallback(missing)) if missing else iter(())
+
+        for number, prompt_data in enumerate(pack, 1):
+            if number in stances:
+                yield prompt_data, f"Polarität:\n{stances[number]}"
+            else:
+                yield next(fallback_results)
+
+def computeStanceResults(stanceDetPrompts, pipe, batch_size: int = 1, stance_mode: str = 'generate', prefix_cache: PrefixCache = None, pack_size: int = 1,
+                         token_counter: TokenCounter = None, metrics: RunMetrics = None):
+    """
+    Führt die Stance Detection für die übergebenen Prompts durch, einzeln oder gebündelt.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von StancePrompt-Datensätzen.
+        pipe: Pipeline zur Verarbeitung der Prompts durch das LLM.
+        batch_size: Anzahl der Prompts, die gebündelt durch die Pipeline verarbeitet werden.
+        stance_mode: 'generate' oder 'classify' (siehe saveStance).
+        prefix_cache: Optionaler Präfix-Cache.
+        pack_size: Maximale Anzahl der Kommentare je Prompt im Modus 'generate' (siehe packedStanceResults). Bei 1 wird jedes Paar einzeln verarbeitet.
+        token_counter: Optionaler TokenCounter für die Sortierung der Batches und die Begrenzung der Pakete (siehe runStanceBatches
+            und packStancePrompts).
+        metrics: Optionale Erfassung der Kennzahlen. Jeder Aufruf des LLM (Prompt, Batch oder Paket) wird in der Stufe 'stance' erfasst.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel und Ergebnis in der Reihenfolge der Prompts liefert. Das Ergebnis ist die Antwort
+        des LLM ohne Prompt (Modus 'generate', siehe stanceCompletion) bzw. ein Dictionary der Wahrscheinlichkeiten je Polarität (Modus 'classify').
+    """
+
+    if stance_mode == 'generate' and pack_size > 1:
+        return packedStanceResults(stanceDetPrompts, pipe, pack_size, lambda missing: computeStanceResults(missing, pipe, batch_size, stance_mode, prefix_cache,
+                                                                                                            token_counter=token_counter, metrics=metrics),
+                                   prefix_cache, token_counter, metrics)
+    if stance_mode == 'generate' and prefix_cache is None and batch_size > 1:
+        return runStanceBatches(stanceDetPrompts, pipe, batch_size, token_counter=token_counter, metrics=metrics)
+
+    def computeSingle(prompt_data):
+        # Einzelne Verarbeitung eines Prompts und Erfassung des Aufrufs
+        prompt_parts = prompt_data.parts
+        prompt = "".join(prompt_parts)
+        start = time.monotonic()
+        if stance_mode == 'classify':
+            result = scoreStanceLabels(prompt_parts, pipe, prefix_cache=prefix_cache)
+            generated_text = ""
+        else:
+            generated_text = generateWithPrefix(prompt_parts, pipe, prefix_cache) if prefix_cache is not None else pipe(prompt)[0]["generated_text"]
+            result = stanceCompletion(prompt, generated_text)
+        if metrics is not None and metrics.record_calls:
+            metrics.record('stance', time.monotonic() - start, prompt, generated_text, metrics.token_counter.stanceTokens(prompt_data))
+        return result
+
+    return ((prompt_data, computeSingle(prompt_data)) for prompt_data in stanceDetPrompts)
+
+def cachedStanceResults(stanceDetPrompts, compute, result_cache: ResultCache, stance_mode: str, window_size: int = 1024, pack_size: int = 1):
+    """
+    Ergänzt die Stance Detection um den persistenten Ergebnis-Cache. Nur Prompts ohne zwischengespeichertes Ergebnis
+    werden an compute übergeben; die Ergebnisse werden in der ursprünglichen Reihenfolge der Prompts geliefert.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln.
+        compute: Funktion, die für eine Liste von Prompt-Tupeln Tupel aus Prompt-Tupel und Ergebnis liefert (siehe computeStanceResults).
+        result_cache: Persistenter Ergebnis-Cache
+        stance_mode: Modus der Stance Detection, Bestandteil des Cache-Schlüssels.
+        window_size: Anzahl der Prompts, die gemeinsam nachgeschlagen und verarbeitet werden.
+        pack_size: Maximale Anzahl der Kommentare je Prompt. Ergebnisse aus Paketen (Modus 'generate', pack_size > 1) werden
+            unter eigenem Schlüssel gespeichert, da sie mit einem anderen Prompt ermittelt wurden.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel und Ergebnis liefert.
+    """
+
+    kind = stanceCacheKind(stance_mode, pack_size)
+    prompt_iter = iter(stanceDetPrompts)
+
+    while True:
+        window = list(itertools.islice(prompt_iter, window_size))
+        if not window:
+            break
+
+        # Nachschlagen der Ergebnisse im Cache; mehrfach enthaltene Paare werden nur einmal verarbeitet
+        cached = [result_cache.get(kind, *stanceCacheTexts(prompt_data)) for prompt_data in window]
+        missing = {}
+        for prompt_data, result in zip(window, cached):
+            if result is None:
+                missing.setdefault(stanceCacheTexts(prompt_data), prompt_data)
+
+        # Verarbeitung der fehlenden Prompts durch das LLM und Speichern der Ergebnisse im Cache
+        computed = {}
+        for prompt_data, result in compute(list(missing.values())):
+            computed[stanceCacheTexts(prompt_data)] = result
+            result_cache.put(kind, result, *stanceCacheTexts(prompt_data))
+
+        for prompt_data, result in zip(window, cached):
+            if result is None:
+                result = computed[stanceCacheTexts(prompt_data)]
+            yield prompt_data, result
+
+def resumedStanceResults(stanceDetPrompts, compute, checkpoint: RunCheckpoint):
+    """
+    Ergänzt die Stance Detection um das Fortschrittsprotokoll eines Durchlaufs. Bereits abgeschlossene Paare werden aus dem
+    Protokoll übernommen, alle übrigen an compute übergeben und nach ihrer Verarbeitung protokolliert.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln.
+        compute: Funktion, die für Prompt-Tupel Tupel aus Prompt-Tupel und Ergebnis liefert (siehe computeStanceResults).
+            Weitere Angaben der Tupel (z. B. des Vorfilters, siehe prefilteredStanceResults) werden mitprotokolliert und durchgereicht.
+        checkpoint: Fortschrittsprotokoll des Durchlaufs.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel, Ergebnis und ggf. weiteren Angaben in der Reihenfolge der Prompts liefert.
+    """
+
+    completed = checkpoint.completedStances(extras=True)
+    all_prompts, open_prompts = itertools.tee(stanceDetPrompts)
+    computed = iter(compute(prompt_data for prompt_data in open_prompts if stanceKey(prompt_data) not in completed))
+
+    for prompt_data in all_prompts:
+        key = stanceKey(prompt_data)
+        if key in completed:
+            yield (prompt_data,) + completed[key]
+        else:
+            _, result, *extras = next(computed)
+            checkpoint.appendStance(key, result, extras)
+            yield (prompt_data, result, *extras)
+
+def previousStanceResults(stanceDetPrompts, compute, previous_stances: dict):
+    """
+    Ergänzt die Stance Detection um die Ergebnisse eines vorherigen Durchlaufs. Paare, deren Ergebnis übernommen werden kann
+    (siehe PreviousRun.completedStances), werden nicht erneut verarbeitet, alle übrigen an compute übergeben.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln.
+        compute: Funktion, die für Prompt-Tupel Tupel aus Prompt-Tupel und Ergebnis liefert (siehe computeStanceResults).
+        previous_stances: Dictionary der Form {(Beitrags-ID, Kommentar-ID, Hauptaussage): Ergebnis}.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel, Ergebnis und ggf. weiteren Angaben von compute in der Reihenfolge der Prompts liefert.
+    """
+
+    all_prompts, open_prompts = itertools.tee(stanceDetPrompts)
+    computed = iter(compute(prompt_data for prompt_data in open_prompts if stanceKey(prompt_data) not in previous_stances))
+
+    for prompt_data in all_prompts:
+        result = previous_stances.get(stanceKey(prompt_data))
+        if result is None:
+            yield (prompt_data, *next(computed)[1:])
+        else:
+            yield prompt_data, result
 
-def saveStance(stanceDetPrompts: list, pipe, contributions: dict, output_file: str = 'Stance.csv') -> None:
+def stanceLabel(result) -> str:
+    """
+    Liefert die Polarität eines Ergebnisses der Stance Detection (generierter Text bzw. Wahrscheinlichkeiten je Polarität).
+    """
+
+    if isinstance(result, dict):
+        return max(result, key=result.get)
+    stance = parseStance(result)[0]
+    return next((label for label in STANCE_LABELS if stance.lower().startswith(label[:7].lower())), stance)
+
+def prefilteredStanceResults(stanceDetPrompts, compute, embedding_filter: EmbeddingFilter, stance_mode: str, window_size: int = 1024):
+    """
+    Ergänzt die Stance Detection um den Vorfilter auf Basis von Satz-Embeddings. Paare unterhalb des Schwellenwerts werden
+    direkt als Neutralität eingestuft, alle übrigen an compute übergeben.
+
+    Parameters:
+        stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln.
+        compute: Funktion, die für eine Liste von Prompt-Tupeln Tupel aus Prompt-Tupel und Ergebnis liefert (siehe computeStanceResults).
+        embedding_filter: Vorfilter
+        stance_mode: 'generate' oder 'classify'; bestimmt das Format des Ergebnisses vorgefilterter Paare.
+        window_size: Anzahl der Prompts, deren Embeddings gemeinsam berechnet werden.
+
+    Returns:
+        Generator, der Tupel aus Prompt-Tupel, Ergebnis, Kosinus-Ähnlichkeit und der Angabe, ob das Paar vorgefiltert wurde,
+        in der Reihenfolge der Prompts liefert.
+    """
+
+    if stance_mode == 'classify':
+        neutral = {label: float(label == 'Neutralität') for label in STANCE_LABELS}
+    else:
+        neutral = "Polarität:\nNeutralität"
+    prompt_iter = iter(stanceDetPrompts)
+
+    while True:
+        window = list(itertools.islice(prompt_iter, window_size))
+        if not window:
+            break
+
+        similarities = embedding_filter.similarities(window)
+        skipped = [embedding_filter.skips(prompt_data, similarity) for prompt_data, similarity in zip(window, similarities)]
+        computed = iter(compute([prompt_data for prompt_data, skip in zip(window, skipped) if not skip]))
+        embedding_filter.checked += len(window)
+        embedding_filter.filtered += sum(skipped)
+
+        for prompt_data, similarity, skip in zip(window, similarities, skipped):
+            if skip:
+                yield prompt_data, neutral, similarity, True
+                continue
+            _, result = next(computed)
+            # Erfassen der Polarität des LLM für die Kalibrierungsstichprobe
+            if embedding_filter.sampled(prompt_data):
+                embedding_filter.calibration.append((similarity, stanceLabel(result)))
+            yield prompt_data, result, similarity, False
+
+def partitionPrompts(stanceDetPrompts: list, num_shards: int) -> list:
+    """
+    Teilt die Prompts zur Stance Detection anhand der Beitrags-ID auf mehrere Shards auf. Alle Prompts eines Beitrags
+    gelangen in denselben Shard; die Beiträge werden absteigend nach Anzahl ihrer Prompts jeweils dem Shard mit den
+    bislang wenigsten Prompts zugeordnet.
+
+    Parameters:
+        stanceDetPrompts: Liste von Prompt-Tupeln.
+        num_shards: Anzahl der Shards
+
+    Returns:
+        shards: Liste von Shards, jeweils als Liste von Tupeln aus Position des Prompts und Prompt-Tupel.
+    """
+
+    positions_by_contribution = {}
+    for position, prompt_data in enumerate(stanceDetPrompts):
+        positions_by_contribution.setdefault(prompt_data[0], []).append(position)
+
+    shards = [[] for _ in range(num_shards)]
+    loads = [(0, shard_index) for shard_index in range(num_shards)]
+    for positions in sorted(positions_by_contribution.values(), key=len, reverse=True):
+        load, shard_index = heapq.heappop(loads)
+        shards[shard_index].extend((position, stanceDetPrompts[position]) for position in positions)
+        heapq.heappush(loads, (load + len(positions), shard_index))
+
+    # Verarbeitung innerhalb eines Shards in der ursprünglichen Reihenfolge
+    for shard in shards:
+        shard.sort(key=lambda item: item[0])
+
+    return shards
+
+def stanceWorker(shard_index: int, task_queue, model_id: str, threads: int, batch_size: int, stance_mode: str, use_prefix_cache: bool, pack_size: int, result_queue,
+                 record_metrics: bool = True) -> None:
+    """
+    Worker-Prozess der verteilten Stance Detection. Lädt einmalig ein eigenes LLM und verarbeitet anschließend Aufträge aus
+    task_queue, bis None empfangen wird. Ein Auftrag besteht aus Auftragsnummer und Shard (Liste von Tupeln aus Position und
+    Prompt-Tupel). Jedes Ergebnis wird als Tupel aus Shard-Index, Auftragsnummer, Position des Prompts und Ergebnis übermittelt,
+    der Abschluss eines Auftrags als (Shard-Index, Auftragsnummer, None, Kennzahlen) mit den Latenzen sowie der Anzahl der Prompt-
+    und generierten Tokens der Aufrufe des LLM, ein Fehler als (Shard-Index, None, None, Fehlermeldung).
+    """
+
+    try:
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        # Jeder Worker erhält eine eigene GPU (reihum) bzw. lädt das Modell ohne Quantisierung auf die CPU
+        if torch.cuda.is_available():
+            device = f'cuda:{shard_index % torch.cuda.device_count()}'
+        else:
+            device = 'cpu'
+        pipe = loadLLM(model_id, device)
+        prefix_cache = PrefixCache(pipe) if use_prefix_cache else None
+        token_counter = TokenCounter(pipe.tokenizer)
+        metrics = RunMetrics(token_counter, record_calls=record_metrics)
+
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            task_id, shard = task
+
+            positions = [position for position, _ in shard]
+            results = computeStanceResults([prompt_data for _, prompt_data in shard], pipe, batch_size, stance_mode, prefix_cache, pack_size, token_counter, metrics)
+            for position, (_, result) in zip(positions, results):
+                result_queue.put((shard_index, task_id, position, result))
+            # Übermittlung der Kennzahlen des Auftrags; anschließend werden sie für den nächsten Auftrag zurückgesetzt
+            entry = metrics.entry('stance')
+            result_queue.put((shard_index, task_id, None, (entry['latencies'], entry['prompt_tokens'], entry['generated_tokens'])))
+            metrics.stages.clear()
+
+    except Exception as error:
+        result_queue.put((shard_index, None, None, f"{type(error).__name__}: {error}"))
+
+class StanceWorkerPool:
+    """
+    Verteilt die Stance Detection anhand der Beitrags-ID auf mehrere Worker-Prozesse, die jeweils einmalig ein eigenes LLM laden.
+    Die Worker werden beim ersten Auftrag gestartet und bis close() weiterverwendet, sodass Ergebnis-Cache, Vorfilter und
+    Fortschrittsprotokoll die Prompts abschnittsweise übergeben können, ohne dass das LLM je Abschnitt erneut geladen wird.
+    Die in den Workern erfassten Aufrufe des LLM werden je Auftrag in metrics übernommen.
+    """
+
+    def __init__(self, model_id: str, num_workers: int, threads_per_worker: int = None, batch_size: int = 1, stance_mode: str = 'generate',
+                 use_prefix_cache: bool = False, pack_size: int = 1, progress_interval: float = 30.0, metrics: RunMetrics = None):
+        self.model_id = model_id
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = batch_size
+        self.stance_mode = stance_mode
+        self.use_prefix_cache = use_prefix_cache
+        self.pack_size = pack_size
+        self.progress_interval = progress_interval
+        self.metrics = metrics
+        self.workers = []
+        self.task_queues = []
+        self.result_queue = None
+        self.task_id = 0
+
+    def start(self) -> None:
+        """
+        Startet die Worker-Prozesse, sofern sie noch nicht laufen.
+        """
+
+        if self.workers:
+            return
+
+        threads_per_worker = self.threads_per_worker or max((os.cpu_count() or 1) // self.num_workers, 1)
+
+        # 'spawn', damit jeder Worker eine eigene, unabhängige Instanz von torch initialisiert
+        context = multiprocessing.get_context('spawn')
+        self.result_queue = context.Queue()
+        self.task_queues = [context.Queue() for _ in range(self.num_workers)]
+        self.workers = [
+            context.Process(target=stanceWorker, args=(shard_index, task_queue, self.model_id, threads_per_worker, self.batch_size, self.stance_mode,
+                                                       self.use_prefix_cache, self.pack_size, self.result_queue,
+                                                       self.metrics is not None and self.metrics.record_calls))
+            for shard_index, task_queue in enumerate(self.task_queues)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def results(self, stanceDetPrompts):
+        """
+        Verarbeitet Prompts durch die Worker. Die Ergebnisse werden in der ursprünglichen Reihenfolge der Prompts geliefert,
+        sobald sie lückenlos vorliegen. In regelmäßigen Abständen wird der Fortschritt je Shard ausgegeben.
+
+        Parameters:
+            stanceDetPrompts: Liste (oder Iterator) von Prompt-Tupeln.
+
+        Returns:
+            Generator, der Tupel aus Prompt-Tupel und Ergebnis in der Reihenfolge der Prompts liefert.
+        """
+
+        prompts = list(stanceDetPrompts)
+        if not prompts:
+            return
+
+        self.start()
+        self.task_id += 1
+        task_id = self.task_id
+        shards = partitionPrompts(prompts, self.num_workers)
+        pending = set()
+        for shard_index, shard in enumerate(shards):
+            if shard:
+                self.task_queues[shard_index].put((task_id, shard))
+                pending.add(shard_index)
+
+        results = {}
+        next_position = 0
+        done = [0] * len(shards)
+        last_report = time.monotonic()
+
+        # Warten auf alle Ergebnisse sowie den Abschluss aller Shards, der die Kennzahlen der Worker enthält
+        while next_position < len(prompts) or pending:
+            try:
+                shard_index, result_task_id, position, result = self.result_queue.get(timeout=self.progress_interval)
+            except queue.Empty:
+                # Abbruch, sofern ein Worker ohne Rückmeldung beendet wurde
+                for shard_index, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        raise RuntimeError(f"Worker {shard_index} wurde unerwartet beendet (Exit-Code {worker.exitcode}).")
+            else:
+                if result_task_id is None:
+                    raise RuntimeError(f"Worker {shard_index} ist fehlgeschlagen: {result}")
+                # Ergebnisse eines abgebrochenen früheren Auftrags werden verworfen
+                if result_task_id == task_id and position is not None:
+                    results[position] = result
+                    done[shard_index] += 1
+                elif position is None:
+                    if result_task_id == task_id:
+                        pending.discard(shard_index)
+                    if self.metrics is not None:
+                        self.metrics.merge('stance', *result)
+
+                # Ausgabe der Ergebnisse in ursprünglicher Reihenfolge, sobald sie lückenlos vorliegen
+                while next_position in results:
+                    yield prompts[next_position], results.pop(next_position)
+                    next_position += 1
+
+            # Fortschrittsausgabe je Shard
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                print(" | ".join(f"Shard {shard_index}: {done[shard_index]}/{len(shard)}" for shard_index, shard in enumerate(shards) if shard))
+
+    def close(self) -> None:
+        """
+        Beendet die Worker-Prozesse.
+        """
+
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.task_queues = []
+
+def saveStance(stanceDetPrompts, pipe, contributions: dict, output_file: str = 'Stance.csv', batch_size: int = 1, stance_mode: str = 'generate', prefix_cache: PrefixCache = None, result_cache: ResultCache = None, checkpoint: RunCheckpoint = None,
+               num_workers: int = 1, model_id: str = None, threads_per_worker: int = None, pack_size: int = 1, stance_results: dict = None,
+               metrics: RunMetrics = None, token_counter: TokenCounter = None, comments: dict = None, embedding_filter: EmbeddingFilter = None,
+               previous_stances: dict = None) -> None:
     """
     Speichert die Ergebnisse der Stance Detection zusammen mit den Beitrags- und Kommentardaten in einer CSV-Datei.
 
     Parameters:
-        stanceDetPrompts: Liste von Tupeln. Ein Tupel enthält die Beitrags-ID, die extrahierte Hauptaussage, die Kommentar-ID, den Kommentartext und den entsprechenden Prompt zur Stance Detection.
+        stanceDetPrompts: Liste (oder Iterator) von StancePrompt-Datensätzen aus Beitrags-ID, extrahierter Hauptaussage, Kommentar-ID, Kommentartext und ID der Prompt-Vorlage (siehe generatePromptsForStanceDetection).
         pipe: Pipeline zur Verarbeitung des Prompts für die Stance Detection.
         contributions: Dictionary, das Beitrag-IDs mit zugehörigen Beitragsinhalten enthält.
         output_file: Dateipfad zur CSV-Datei, in der die Daten gespeichert werden sollen. Der Default-Parameter ist 'Stance.csv'.
+        batch_size: Anzahl der Prompts, die gebündelt durch die Pipeline verarbeitet werden. Bei 1 wird jeder Prompt einzeln verarbeitet.
+            Im Modus 'classify' wird batch_size nicht berücksichtigt.
+        stance_mode: 'generate' für die freie Generierung der Antwort, 'classify' für die Bewertung der zulässigen Polaritäten
+            mittels scoreStanceLabels. Im Modus 'classify' werden zusätzlich die Wahrscheinlichkeiten je Polarität gespeichert.
+        prefix_cache: Optionaler Präfix-Cache. Ist er übergeben, werden die Prompts einzeln unter Wiederverwendung der Key/Values
+            des statischen Präfixes und der jeweiligen Hauptaussage verarbeitet; batch_size wird dann nicht berücksichtigt.
+        result_cache: Optionaler persistenter Ergebnis-Cache. Bereits klassifizierte Paare aus Hauptaussage und Kommentar werden daraus übernommen.
+        checkpoint: Optionales Fortschrittsprotokoll. Abgeschlossene Paare eines fortgesetzten Durchlaufs werden übernommen, neue protokolliert.
+        num_workers: Anzahl der Worker-Prozesse. Bei mehr als einem Worker wird die Stance Detection anhand der Beitrags-ID auf
+            Worker verteilt, die jeweils einmalig das LLM mit der Modell-ID model_id laden; pipe wird dann nicht verwendet. Ein übergebener
+            Präfix-Cache bewirkt, dass jeder Worker einen eigenen Präfix-Cache verwendet.
+        model_id: Modell-ID des LLM für die Worker-Prozesse.
+        threads_per_worker: Anzahl der Threads je Worker. Ohne Angabe werden die CPU-Kerne gleichmäßig aufgeteilt.
+        pack_size: Maximale Anzahl der Kommentare zu einer Hauptaussage, deren Haltung im Modus 'generate' in einem gemeinsamen
+            Prompt erfragt wird. Kommentare ohne gültige Polarität in der Antwort werden einzeln nachverarbeitet. Der Default-Parameter ist 1.
+        stance_results: Optionales Dictionary bereits ermittelter Ergebnisse der Form {(Beitrags-ID, Kommentar-ID, Hauptaussage): Ergebnis},
+            z. B. aus dem AsyncScheduler. Ist es übergeben, werden die Ergebnisse nur daraus in Prompt-Reihenfolge gespeichert.
+        metrics: Optionale Erfassung der Kennzahlen. Jeder Aufruf des LLM wird in der Stufe 'stance' erfasst, auch in den Worker-Prozessen.
+        token_counter: Optionaler TokenCounter für die Sortierung der Batches (siehe runStanceBatches).
+        comments: Optionales Dictionary der Form {Kommentar-ID: Kommentartext}. Ist es übergeben, wird der Kommentartext daraus
+            gespeichert, z. B. der ungekürzte Kommentar, sofern die Kommentare in den Prompts gekürzt wurden.
+        embedding_filter: Optionaler Vorfilter (siehe prefilteredStanceResults). Ist er übergeben, werden zusätzlich die Kosinus-Ähnlichkeit
+            (Spalte 'Ähnlichkeit') und die Kennzeichnung vorgefilterter Paare (Spalte 'Vorfilter') gespeichert.
+        previous_stances: Optionales Dictionary übernehmbarer Ergebnisse eines vorherigen Durchlaufs (siehe previousStanceResults).
+            Nur die übrigen Paare werden verarbeitet; gespeichert werden alle Paare in Prompt-Reihenfolge.
 
     """
 
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+    # Die Worker-Prozesse werden erst bei Bedarf gestartet und für alle Abschnitte weiterverwendet (siehe StanceWorkerPool)
+    worker_pool = StanceWorkerPool(model_id, num_workers, threads_per_worker, batch_size, stance_mode, prefix_cache is not None, pack_size, metrics=metrics)
+
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile, contextlib.closing(worker_pool):
         # Definieren der Spaltennamen für die CSV-Datei
         columns = ['Beitrags-ID', 'Beitragstext', 'Hauptaussage', 'Kommentar-ID', 'Kommentartext', 'Haltung', 'Begründung']
+        if stance_mode == 'classify':
+            columns += [f'P({label})' for label in STANCE_LABELS]
+        if embedding_filter is not None:
+            columns += ['Ähnlichkeit', 'Vorfilter']
         writer = csv.DictWriter(csvfile, fieldnames=columns, delimiter=';')
         writer.writeheader()
-        
-        # Iteration über die erstellten Prompts zur Stance Detection
-        for aspect_id, aspect, com_id, comment, prompt in stanceDetPrompts:
-            # Stance Detection für den jeweiligen Prompt
-            result = pipe(prompt)
-            generated_text = result[0]["generated_text"].strip()
-            
-            # Postprocessing des generierten Textes für das erwünschte Antwortformat
-            last_stance_index = generated_text.rfind('Polarität:')
-            if last_stance_index != -1:
-                stance_text = generated_text[last_stance_index + len('Polarität:'):].strip()
-                stance_lines = stance_text.split('\n', 1)
-                stance = stance_lines[0].strip()
-                reasoning = stance_lines[1].strip() if len(stance_lines) > 1 else ""
+
+        # Stance Detection für die erstellten Prompts, einzeln oder gebündelt und ggf. unter Nutzung des Ergebnis-Caches
+        def computeUncached(prompts):
+            if num_workers > 1:
+                results = worker_pool.results(prompts)
             else:
-                stance = 'Unbekannt'
-                reasoning = generated_text
-            
-            # # Einfügen der Daten in die Datei
-            writer.writerow({
+                results = computeStanceResults(prompts, pipe, batch_size, stance_mode, prefix_cache, pack_size, token_counter, metrics)
+            return results
+
+        def computeUnfiltered(prompts):
+            if result_cache is not None:
+                return cachedStanceResults(prompts, computeUncached, result_cache, stance_mode, pack_size=pack_size)
+            return computeUncached(prompts)
+
+        # Der Vorfilter liegt vor dem Ergebnis-Cache, damit vorgefilterte Paare nicht als Ergebnis des LLM zwischengespeichert werden
+        def compute(prompts):
+            if embedding_filter is not None:
+                return prefilteredStanceResults(prompts, computeUnfiltered, embedding_filter, stance_mode)
+            return computeUnfiltered(prompts)
+
+        def computeResumed(prompts):
+            if checkpoint is not None:
+                return resumedStanceResults(prompts, compute, checkpoint)
+            return compute(prompts)
+
+        if stance_results is not None:
+            results = ((prompt_data, stance_results[stanceKey(prompt_data)]) for prompt_data in stanceDetPrompts)
+        elif previous_stances is not None:
+            results = previousStanceResults(stanceDetPrompts, computeResumed, previous_stances)
+        else:
+            results = computeResumed(stanceDetPrompts)
+
+        # Iteration über die Ergebnisse der Stance Detection in der Reihenfolge der Prompts
+        for prompt_data, result, *prefilter in results:
+            aspect_id, aspect, com_id, comment, _ = prompt_data
+            row = {
                 'Beitrags-ID': aspect_id, 
                 'Beitragstext': contributions[aspect_id], 
                 'Hauptaussage': aspect, 
                 'Kommentar-ID': com_id, 
-                'Kommentartext': comment, 
-                'Haltung': stance,
-                'Begründung': reasoning
-            })
+                'Kommentartext': comments[com_id] if comments is not None else comment
+            }
+
+            if stance_mode == 'classify':
+                # Auswahl der wahrscheinlichsten Polarität
+                row['Haltung'] = max(result, key=result.get)
+                row['Begründung'] = ""
+                row.update({f'P({label})': round(probability, 4) for label, probability in result.items()})
+            else:
+                row['Haltung'], row['Begründung'] = parseStance(result)
 
-def main(contributions_file: str, comments_file: str, api_key_file: str, model_id: str = 'mistralai/Mistral-8x7B-Instruct-v0.1') -> None:
+            # Kennzeichnung der Paare, die der Vorfilter ohne Aufruf des LLM als Neutralität eingestuft hat; Paare, die nicht den
+            # Vorfilter durchlaufen haben (z. B. aus einem vorherigen Durchlauf), bleiben ohne Angabe
+            if embedding_filter is not None:
+                similarity, skipped = prefilter if prefilter else (None, False)
+                row['Ähnlichkeit'] = round(similarity, 4) if similarity is not None else ''
+                row['Vorfilter'] = 'Neutralität' if skipped else ''
+
+            # # Einfügen der Daten in die Datei
+            writer.writerow(row)
+            if metrics is not None and stance_results is None:
+                metrics.advance('stance')
+
+def main(contributions_file: str, comments_file: str, api_key_file: str, model_id: str = 'mistralai/Mistral-8x7B-Instruct-v0.1', batch_size: int = 1, stance_mode: str = 'generate', use_prefix_cache: bool = False, result_cache_file: str = None, result_cache_size: int = 1000000, run_dir: str = None, all_targets: bool = False, use_input_cache: bool = True, num_workers: int = 1,
+         threads_per_worker: int = None, pack_size: int = 1, backend: str = 'hf', server_url: str = 'http://127.0.0.1:8080',
+         max_concurrency: int = 8, use_async: bool = False, max_in_flight: int = 8, queue_size: int = 64, max_retries: int = 3, dry_run: bool = False,
+         metrics_file: str = None, progress_interval: float = None, comment_token_budget: int = None, prefilter_model: str = None,
+         prefilter_threshold: float = 0.2, prefilter_calibration: float = 0.0, prefilter_report: str = None, previous_dir: str = None) -> None:
     """
     Hauptfunktion zur Verarbeitung von Beitrags- und Kommentardaten mittels Stance Detection
 
@@ -461,42 +2927,254 @@ def main(contributions_file: str, comments_file: str, api_key_file: str, model_i
         comments_file: Pfad zur Kommentardatei.
         api_key_file: Pfad zur Datei mit dem API-Schlüssel der HuggiongFace-API.
         model_id: Modell-ID des verwendeten Sprachmodells. Der Default-Parameter und damit das standardmäßig verwendete Modell ist 'mistralai/Mistral-8x7B-Instruct-v0.1'.
+        batch_size: Anzahl der gebündelt verarbeiteten Prompts in der Stance Detection. Der Default-Parameter ist 1. Im Modus
+            'classify' werden die Prompts einzeln bewertet; ein Wert größer 1 wird dort abgelehnt.
+        stance_mode: Modus der Stance Detection, 'generate' (freie Generierung) oder 'classify' (Bewertung der zulässigen Polaritäten).
+        use_prefix_cache: Gibt an, ob die Key/Values gemeinsamer Prompt-Präfixe zwischengespeichert und wiederverwendet werden.
+        result_cache_file: Optionaler Pfad zur SQLite-Datei des persistenten Ergebnis-Caches. Ohne Angabe wird kein Ergebnis-Cache genutzt.
+        result_cache_size: Maximale Anzahl der Einträge im Ergebnis-Cache. Der Default-Parameter ist 1000000.
+        run_dir: Optionales Run-Verzeichnis. Der Fortschritt wird darin protokolliert, sodass ein abgebrochener Durchlauf durch
+            einen erneuten Aufruf mit demselben Verzeichnis fortgesetzt wird. Targets.csv und Stance.csv werden darin gespeichert.
+        all_targets: Gibt an, ob die Hauptaussagen aller Beiträge ermittelt werden. Standardmäßig werden nur Beiträge mit
+            mindestens einem Kommentar verarbeitet, da nur diese in die Stance Detection eingehen.
+        use_input_cache: Gibt an, ob eine Excel-Beitragsdatei über eine zwischengespeicherte spaltenorientierte Kopie gelesen wird.
+        num_workers: Anzahl der Worker-Prozesse für die Stance Detection. Der Default-Parameter ist 1 (keine Verteilung).
+        threads_per_worker: Anzahl der Threads je Worker. Ohne Angabe werden die CPU-Kerne gleichmäßig aufgeteilt.
+        pack_size: Maximale Anzahl der Kommentare je Prompt der Stance Detection im Modus 'generate'. Der Default-Parameter ist 1.
+        backend: Inferenz-Backend, 'hf' (Pipeline von transformers, Default) oder 'openai' (OpenAI-kompatibler Server).
+        server_url: Basis-URL des Servers für das Backend 'openai'. Der Default-Parameter ist 'http://127.0.0.1:8080'.
+        max_concurrency: Maximale Anzahl gleichzeitiger Anfragen an den Server. Der Default-Parameter ist 8.
+        use_async: Gibt an, ob beide Stufen nebenläufig über den AsyncScheduler verarbeitet werden.
+        max_in_flight: Maximale Anzahl gleichzeitiger Anfragen des AsyncSchedulers. Der Default-Parameter ist 8.
+        queue_size: Größe der Warteschlangen des AsyncSchedulers. Der Default-Parameter ist 64.
+        max_retries: Maximale Anzahl der Wiederholungen bei vorübergehenden Fehlern des Backends. Der Default-Parameter ist 3.
+        dry_run: Gibt an, ob nur die Eingaben eingelesen und zusammengeführt werden und der Umfang des Durchlaufs ausgegeben wird,
+            ohne das LLM zu laden (siehe estimateRun).
+        metrics_file: Optionaler Pfad zur JSON-Datei, in der die Kennzahlen des Durchlaufs je Stufe gespeichert werden (siehe RunMetrics).
+        progress_interval: Optionaler Abstand der Fortschrittsausgaben in Sekunden. Ohne Angabe wird kein Fortschritt ausgegeben.
+        comment_token_budget: Optionale maximale Anzahl der Tokens je Kommentar in den Prompts der Stance Detection. Längere
+            Kommentare werden unter Erhalt von Anfang und Ende gekürzt; in Stance.csv wird der ungekürzte Kommentar gespeichert.
+        prefilter_model: Optionale Modell-ID eines Modells für Satz-Embeddings. Ist sie angegeben, werden Paare mit einer Kosinus-Ähnlichkeit
+            unterhalb von prefilter_threshold ohne Aufruf des LLM als Neutralität eingestuft (siehe EmbeddingFilter).
+        prefilter_threshold: Schwellenwert der Kosinus-Ähnlichkeit für den Vorfilter. Der Default-Parameter ist 0.2.
+        prefilter_calibration: Anteil der Paare, die für die Kalibrierung des Vorfilters unabhängig von der Ähnlichkeit durch das LLM
+            verarbeitet werden. Der Default-Parameter ist 0 (keine Kalibrierung).
+        prefilter_report: Optionaler Pfad zur JSON-Datei mit dem Kalibrierungsbericht des Vorfilters.
+        previous_dir: Optionales Verzeichnis mit Targets.csv, Stance.csv und run_settings.json eines vorherigen Durchlaufs.
+            Es werden nur neue oder geänderte Beiträge sowie neue Kommentare und Paare geänderter Hauptaussagen durch das LLM
+            verarbeitet; die übrigen Ergebnisse werden übernommen und mit den neuen in Targets.csv und Stance.csv zusammengeführt
+            (siehe PreviousRun). Ergebnisse eines Durchlaufs mit anderen Einstellungen werden nicht übernommen.
 
     """
+    # Prüfung der Optionen, die den Zugriff auf Modell und Tokenizer im selben Prozess erfordern
+    if backend == 'openai' and (stance_mode == 'classify' or use_prefix_cache or num_workers > 1):
+        print("Der Modus 'classify', der Präfix-Cache und Worker-Prozesse werden nur mit dem Backend 'hf' unterstützt.")
+        return
+    if stance_mode == 'classify' and batch_size > 1:
+        print("Im Modus 'classify' werden die Prompts einzeln bewertet; --batch_size wird dort nicht unterstützt.")
+        return
+    if use_async and (stance_mode == 'classify' or use_prefix_cache or num_workers > 1 or pack_size > 1 or prefilter_model):
+        print("Die nebenläufige Verarbeitung ist nicht mit dem Modus 'classify', dem Präfix-Cache, Worker-Prozessen, Paketen oder dem Vorfilter kombinierbar.")
+        return
+
+    # Prüfung der Eingabedateien, bevor Bibliotheken wie pandas oder torch geladen werden
+    for input_file, label in ((contributions_file, 'Beitrags-Datei'), (comments_file, 'Kommentar-Datei')):
+        if not os.path.isfile(input_file):
+            print(f"Die {label} '{input_file}' konnte nicht gefunden werden.")
+            return
+
+    # Erfassung der Kennzahlen je Stufe
+    # Aufrufe des LLM und Tokens werden nur erfasst, wenn die Kennzahlen gespeichert werden
+    metrics = RunMetrics(progress_interval=progress_interval, record_calls=metrics_file is not None)
+
     # Import der Beiträge und Kommentare
-    contributions = importCons(contributions_file)
-    comments = importComs(comments_file)
-    entries = joinConsComs(contributions, comments)
+    with metrics.stage('import_contributions'):
+        contributions = importCons(contributions_file, use_input_cache)
+    if contributions is None:
+        return
+    with metrics.stage('import_comments'):
+        entries = importJoinedComs(contributions, comments_file)
+    if entries is None:
+        return
 
-    # Laden des API-Schlüssels
-    api_key = loadApiKey(api_key_file)
-    if api_key:
-        login(api_key)
+    # Auswahl der Beiträge für die Target Identification: alle Beiträge oder nur Beiträge mit Kommentaren
+    if all_targets:
+        target_contributions = contributions
     else:
-        print('API-Schlüssel konnte nicht geladen werden.')
+        target_contributions = {con_id: entry['Beitrag'] for con_id, entry in entries.items()}
+
+    # Ergebnisrelevante Einstellungen für das Run-Verzeichnis und den Abgleich mit einem vorherigen Durchlauf
+    settings = {'model_id': model_id, 'stance_mode': stance_mode}
+    if comment_token_budget is not None:
+        settings['comment_token_budget'] = comment_token_budget
+    if pack_size > 1 and stance_mode == 'generate':
+        settings['pack_size'] = pack_size
+    if prefilter_model:
+        settings.update(prefilter_model=prefilter_model, prefilter_threshold=prefilter_threshold, prefilter_calibration=prefilter_calibration)
+
+    # Abgleich mit den Ergebnissen eines vorherigen Durchlaufs anhand der IDs und Hashwerte der Beitrags- und Kommentartexte
+    previous_targets, previous_stances = None, None
+    if previous_dir:
+        previous_run = PreviousRun(previous_dir, settings)
+        with metrics.stage('import_previous'):
+            previous_targets = previous_run.completedTargets(target_contributions)
+            previous_stances = previous_run.completedStances(entries, stance_mode)
+        print(f"Vorheriger Durchlauf: {len(previous_targets)} von {len(target_contributions)} Beiträgen und {len(previous_stances)} Paare "
+              f"unverändert, {len(target_contributions) - len(previous_targets)} Beiträge für die Target Identification")
+
+    # Ausgabe des geschätzten Umfangs ohne Laden des LLMs
+    if dry_run:
+        estimate = estimateRun(target_contributions, entries, comment_token_budget=comment_token_budget)
+        print(f"Beiträge: {len(contributions)} (davon {estimate['commented_contributions']} mit Kommentaren, {estimate['contributions']} für die Target Identification)")
+        print(f"Kommentare: {estimate['comments']}")
+        print(f"Paare aus Hauptaussage und Kommentar (geschätzt): {estimate['pairs']}")
+        print(f"Prompt-Tokens (geschätzt): {estimate['target_prompt_tokens']} Target Identification, {estimate['stance_prompt_tokens']} Stance Detection")
         return
 
-    # Laden des LLMs
-    pipe = loadLLM(model_id)
+    # Laden des API-Schlüssels (für das Backend 'openai' optional als Schlüssel des Servers)
+    api_key = loadApiKey(api_key_file)
+    if backend == 'hf':
+        if api_key:
+            from huggingface_hub import login
+            login(api_key)
+        else:
+            print('API-Schlüssel konnte nicht geladen werden.')
+            return
+
+    # Vorbereiten des Run-Verzeichnisses für einen fortsetzbaren Durchlauf
+    checkpoint = None
+    targets_file, stance_file = 'Targets.csv', 'Stance.csv'
+    if run_dir:
+        checkpoint = RunCheckpoint(run_dir)
+        if not checkpoint.checkSettings(settings):
+            print(f"Das Run-Verzeichnis '{run_dir}' gehört zu einem Durchlauf mit anderen Einstellungen (z. B. Modell, Modus oder Paketgröße).")
+            return
+        targets_file, stance_file = os.path.join(run_dir, targets_file), os.path.join(run_dir, stance_file)
+
+    # Laden des Embedding-Modells für den Vorfilter der Stance Detection (vor dem LLM, damit ein fehlendes Paket früh auffällt)
+    embedding_filter = None
+    if prefilter_model:
+        with metrics.stage('load_prefilter'):
+            embedding_filter = loadEmbeddingFilter(prefilter_model, prefilter_threshold, prefilter_calibration)
+        if embedding_filter is None:
+            return
+
+    # Laden des LLMs bzw. des Inferenz-Backends; Tokens werden mit dessen Tokenizer gezählt, sofern vorhanden
+    with metrics.stage('load_model'):
+        pipe = loadBackend(backend, model_id, server_url, max_concurrency, api_key)
+    token_counter = TokenCounter(getattr(pipe, 'tokenizer', None))
+    metrics.token_counter = token_counter
+    prefix_cache = PrefixCache(pipe) if use_prefix_cache else None
+    result_cache = ResultCache(result_cache_file, model_id, result_cache_size) if result_cache_file else None
+
+    # Extrahieren der Hauptaussagen (Targets) aus den Beiträgen; im nebenläufigen Modus zugleich Durchführung der Stance Detection
+    contributionPrompts = generatePromptsForTargetIdentification(target_contributions)
+    stance_results = None
+    if use_async:
+        # Beide Stufen überlappen sich; ihre Laufzeit umfasst daher jeweils den gesamten nebenläufigen Abschnitt
+        with metrics.stage('targets', total=len(contributionPrompts)), metrics.stage('stance'):
+            scheduler = AsyncScheduler(pipe, max_in_flight, queue_size, max_retries, result_cache=result_cache, checkpoint=checkpoint, metrics=metrics,
+                                       comment_token_budget=comment_token_budget, previous_targets=previous_targets, previous_stances=previous_stances,
+                                       token_counter=token_counter)
+            targets, stance_results = asyncio.run(scheduler.run(contributionPrompts, entries))
+    else:
+        with metrics.stage('targets', total=len(contributionPrompts)):
+            targets = extractTargetsInContributions(contributionPrompts, pipe, prefix_cache, result_cache, checkpoint, metrics, previous_targets)
 
-    # Extrahieren der Hauptaussagen (Targets) aus den Beiträgen
-    contributionPrompts = generatePromptsForTargetIdentification(contributions)
-    targets = extractTargetsInContributions(contributionPrompts, pipe)
+    # Entfernen der Einstellungen eines früheren Durchlaufs, da dessen Ausgabedateien im Folgenden überschrieben werden
+    output_dir = os.path.dirname(stance_file) or '.'
+    PreviousRun.invalidateSettings(output_dir)
 
     # Speichern der Hauptaussagen (Targets)
-    saveTargets(contributions, targets)
-
-    # Generieren von Prompts für die Stance Detection
-    stance_det_prompts = generatePromptsForStanceDetection(targets, entries)
+    saveTargets(target_contributions, targets, targets_file)
+
+    # Generieren der Datensätze für die Stance Detection; die Prompts werden erst bei ihrer Verarbeitung erzeugt
+    stance_det_prompts = generatePromptsForStanceDetection(targets, entries, token_counter, comment_token_budget)
+    comments = {com_id: com_txt for entry in entries.values() for com_id, com_txt in entry['Kommentare'].items()} if comment_token_budget is not None else None
+
+    # Freigeben des LLMs, sofern die Worker-Prozesse der Stance Detection jeweils ein eigenes LLM laden
+    if num_workers > 1:
+        pipe = None
+        if prefix_cache is not None:
+            prefix_cache.clear()
+            prefix_cache.pipe = None
+        gc.collect()
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
     # Erheben und Speichern der Daten der Stance Detection
-    saveStance(stance_det_prompts, pipe, contributions)
+    with metrics.stage('save_stance' if use_async else 'stance', total=countStancePrompts(targets, entries)):
+        saveStance(stance_det_prompts, pipe, contributions, stance_file, batch_size=batch_size, stance_mode=stance_mode, prefix_cache=prefix_cache,
+                   result_cache=result_cache, checkpoint=checkpoint, num_workers=num_workers, model_id=model_id, threads_per_worker=threads_per_worker,
+                   pack_size=pack_size, stance_results=stance_results, metrics=metrics, token_counter=token_counter, comments=comments,
+                   embedding_filter=embedding_filter, previous_stances=previous_stances)
+
+    # Ablage der Einstellungen neben Targets.csv und Stance.csv für einen späteren inkrementellen Durchlauf
+    PreviousRun.saveSettings(output_dir, settings)
+
+    # Ausgabe der Trefferquote und Schließen des Ergebnis-Caches
+    if result_cache is not None:
+        print(f'Ergebnis-Cache: {result_cache.hits} Treffer, {result_cache.misses} Fehlzugriffe')
+        result_cache.close()
+    if checkpoint is not None:
+        checkpoint.close()
+
+    # Ausgabe des Anteils vorgefilterter Paare und der Übereinstimmung der Kalibrierungsstichprobe mit dem LLM
+    if embedding_filter is not None:
+        report = embedding_filter.calibrationReport()
+        print(f"Vorfilter: {report['filtered']} von {report['checked']} Paaren als Neutralität eingestuft (Schwellenwert {prefilter_threshold})")
+        if report['samples']:
+            chosen = next(row for row in report['thresholds'] if row['threshold'] == prefilter_threshold)
+            print(f"Kalibrierung ({report['samples']} Paare): Übereinstimmung {chosen['agreement']}, Präzision {chosen['precision']}, Recall {chosen['recall']}")
+        if prefilter_report:
+            with open(prefilter_report, 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    # Speichern der Kennzahlen des Durchlaufs
+    if metrics_file:
+        metrics.save(metrics_file, {'result_cache': result_cache, 'prefix_cache': prefix_cache})
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Führt eine Stance Detection für Kommentare zu Beiträgen durch.')
-    parser.add_argument("contributions_file", type=str, help="Pfad zur Datei mit den Beiträgen")
+    parser.add_argument("contributions_file", type=str, help="Pfad zur Datei mit den Beiträgen (Excel, CSV oder Parquet)")
     parser.add_argument("comments_file", type=str, help="Pfad zur Datei mit den Kommentaren")
     parser.add_argument("api_key_file", type=str, help="Pfad zur Datei mit dem HF-API-Schlüssel")
-    parser.add_argument("model_id", type=str, default='mistralai/Mixtral-8x7B-Instruct-v0.1', help="Modell-ID des verwendeten Sprachmodells")
+    parser.add_argument("model_id", type=str, nargs='?', default='mistralai/Mixtral-8x7B-Instruct-v0.1', help="Modell-ID des verwendeten Sprachmodells")
+    parser.add_argument("--batch_size", type=int, default=1, help="Anzahl der gebündelt verarbeiteten Prompts in der Stance Detection")
+    parser.add_argument("--stance_mode", choices=['generate', 'classify'], default='generate', help="Modus der Stance Detection: freie Generierung oder Bewertung der zulässigen Polaritäten")
+    parser.add_argument("--prefix_cache", action='store_true', help="Wiederverwendung der Key/Values gemeinsamer Prompt-Präfixe")
+    parser.add_argument("--result_cache", type=str, default=None, help="Pfad zur SQLite-Datei des persistenten Ergebnis-Caches")
+    parser.add_argument("--result_cache_size", type=int, default=1000000, help="Maximale Anzahl der Einträge im Ergebnis-Cache")
+    parser.add_argument("--run_dir", type=str, default=None, help="Run-Verzeichnis für einen fortsetzbaren Durchlauf")
+    parser.add_argument("--all_targets", action='store_true', help="Ermittlung der Hauptaussagen aller Beiträge, auch ohne Kommentare")
+    parser.add_argument("--no_input_cache", action='store_true', help="Kein Zwischenspeichern der Excel-Beitragsdatei als spaltenorientierte Kopie")
+    parser.add_argument("--workers", type=int, default=1, help="Anzahl der Worker-Prozesse für die Stance Detection")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Anzahl der Threads je Worker-Prozess")
+    parser.add_argument("--pack_size", type=int, default=1, help="Maximale Anzahl der Kommentare zu einer Hauptaussage je Prompt der Stance Detection")
+    parser.add_argument("--backend", choices=['hf', 'openai'], default='hf', help="Inferenz-Backend: Pipeline von transformers oder OpenAI-kompatibler Server")
+    parser.add_argument("--server_url", type=str, default='http://127.0.0.1:8080', help="Basis-URL des OpenAI-kompatiblen Servers")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximale Anzahl gleichzeitiger Anfragen an den Server")
+    parser.add_argument("--async_scheduler", action='store_true', help="Nebenläufige Verarbeitung beider Stufen mit begrenzter Anzahl gleichzeitiger Anfragen")
+    parser.add_argument("--max_in_flight", type=int, default=8, help="Maximale Anzahl gleichzeitiger Anfragen der nebenläufigen Verarbeitung")
+    parser.add_argument("--queue_size", type=int, default=64, help="Größe der Warteschlangen der nebenläufigen Verarbeitung")
+    parser.add_argument("--max_retries", type=int, default=3, help="Maximale Anzahl der Wiederholungen bei vorübergehenden Fehlern des Backends")
+    parser.add_argument("--dry_run", "--dry-run", action='store_true', help="Nur Einlesen der Eingaben und Ausgabe des geschätzten Umfangs, ohne das LLM zu laden")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Pfad zur JSON-Datei mit den Kennzahlen des Durchlaufs je Stufe")
+    parser.add_argument("--comment_token_budget", type=int, default=None, help="Maximale Anzahl der Tokens je Kommentar in den Prompts der Stance Detection")
+    parser.add_argument("--prefilter_model", type=str, default=None, help="Modell für Satz-Embeddings des Vorfilters, z. B. sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--prefilter_threshold", type=float, default=0.2, help="Schwellenwert der Kosinus-Ähnlichkeit, unterhalb dessen ein Paar als Neutralität eingestuft wird")
+    parser.add_argument("--prefilter_calibration", type=float, default=0.0, help="Anteil der Paare, die für die Kalibrierung des Vorfilters durch das LLM verarbeitet werden")
+    parser.add_argument("--prefilter_report", type=str, default=None, help="Pfad zur JSON-Datei mit dem Kalibrierungsbericht des Vorfilters")
+    parser.add_argument("--previous_dir", type=str, default=None, help="Verzeichnis mit Targets.csv und Stance.csv eines vorherigen Durchlaufs für einen inkrementellen Durchlauf")
+    parser.add_argument("--progress", type=float, nargs='?', const=10.0, default=None, help="Ausgabe des Fortschritts mit geschätzter Restlaufzeit alle N Sekunden (Standard: 10)")
     args = parser.parse_args()
-    main(args.contributions_file, args.comments_file, args.api_key_file, args.model_id)
\ No newline at end of file
+    main(args.contributions_file, args.comments_file, args.api_key_file, args.model_id, batch_size=args.batch_size, stance_mode=args.stance_mode,
+         use_prefix_cache=args.prefix_cache, result_cache_file=args.result_cache, result_cache_size=args.result_cache_size, run_dir=args.run_dir,
+         all_targets=args.all_targets, use_input_cache=not args.no_input_cache, num_workers=args.workers, threads_per_worker=args.threads_per_worker,
+         pack_size=args.pack_size, backend=args.backend, server_url=args.server_url, max_concurrency=args.concurrency,
+         use_async=args.async_scheduler, max_in_flight=args.max_in_flight, queue_size=args.queue_size, max_retries=args.max_retries,
+         dry_run=args.dry_run, metrics_file=args.metrics_file, progress_interval=args.progress,
+         comment_token_budget=args.comment_token_budget, prefilter_model=args.prefilter_model, prefilter_threshold=args.prefilter_threshold,
+         prefilter_calibration=args.prefilter_calibration, prefilter_report=args.prefilter_report,
+         previous_dir=args.previous_dir)
\ No newline at end of file
@@ -0,0 +1,124 @@
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import FakePipe
+
+
+class StubServer(http.server.ThreadingHTTPServer):
+    """
+    Minimaler OpenAI-kompatibler Server (/v1/completions) für Tests ohne Modell. Die Antworten stammen von FakePipe.
+    Erfasst werden die Anzahl der Anfragen, die genutzten Verbindungen (Port des Clients) und die höchste Anzahl
+    gleichzeitig bearbeiteter Anfragen. failures gibt an, wie oft jeder Prompt zunächst mit status beantwortet wird;
+    delay(prompt) bestimmt die Bearbeitungszeit einer Anfrage.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, failures: int = 0, status: int = 503, delay=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.fake = FakePipe(token_latency=0)
+        self.failures = failures
+        self.status = status
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.attempts = {}
+        self.connections = set()
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        prompt = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['prompt']
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address[1])
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            attempt = server.attempts.get(prompt, 0)
+            server.attempts[prompt] = attempt + 1
+
+        try:
+            if server.delay is not None:
+                time.sleep(server.delay(prompt))
+            if attempt < server.failures:
+                status, body = server.status, b'{"error": "busy"}'
+            else:
+                status, body = 200, json.dumps({'choices': [{'text': server.fake.answer(prompt)}]}).encode('utf-8')
+        finally:
+            with server.lock:
+                server.active -= 1
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(**kwargs) -> StubServer:
+        server = StubServer(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope='session')
+def tiny_pipe(tmp_path_factory):
+    """
+    Pipeline mit einem zufällig initialisierten Mini-Modell (Mistral-Architektur) und einem auf den Prompt-Vorlagen trainierten
+    Tokenizer, der wie SentencePiece jedem Text ein "▁" voranstellt und Leerzeichen als "▁" kodiert. Gierige Dekodierung.
+    """
+
+    torch = pytest.importorskip('torch')
+    transformers = pytest.importorskip('transformers')
+    tokenizers = pytest.importorskip('tokenizers')
+    import stancedetection_code as sd
+
+    texts = [sd.TI_SYSTEM + sd.TI_EXAMPLE, sd.SD_SYSTEM + sd.SD_EXAMPLE, "".join(sd.stancePromptParts("Der Radweg wird gebaut.", "Bäume"))]
+    texts += [" ".join(sd.STANCE_LABELS)] * 20
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.BPE(unk_token='<unk>', byte_fallback=True))
+    tokenizer.normalizer = tokenizers.normalizers.Sequence([tokenizers.normalizers.Prepend('▁'), tokenizers.normalizers.Replace(' ', '▁')])
+    tokenizer.decoder = tokenizers.decoders.Sequence([tokenizers.decoders.Replace('▁', ' '), tokenizers.decoders.ByteFallback(),
+                                                      tokenizers.decoders.Fuse(), tokenizers.decoders.Strip(' ', 1, 0)])
+    special_tokens = ['<unk>', '<s>', '</s>'] + [f'<0x{byte:02X}>' for byte in range(256)]
+    tokenizer.train_from_iterator(texts, tokenizers.trainers.BpeTrainer(vocab_size=600, special_tokens=special_tokens))
+    tokenizer.post_processor = tokenizers.processors.TemplateProcessing(single='<s> $A', special_tokens=[('<s>', 1)])
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token='<s>', eos_token='</s>', unk_token='<unk>', pad_token='</s>')
+
+    config = transformers.MistralConfig(vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+                                        num_key_value_heads=2, max_position_embeddings=4096, bos_token_id=1, eos_token_id=2)
+    torch.manual_seed(0)
+    model = transformers.MistralForCausalLM(config).eval()
+
+    return transformers.pipeline('text-generation', model=model, tokenizer=tokenizer, do_sample=False, max_new_tokens=8)
+
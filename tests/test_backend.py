@@ -0,0 +1,49 @@
+import pytest
+
+import stancedetection_code as sd
+
+
+def test_backend_reuses_pooled_connections_and_keeps_order(stub_server):
+    # Spätere Prompts werden schneller beantwortet, sodass die Antworten in umgekehrter Reihenfolge eintreffen
+    prompts = [f"Prompt {number}\nHauptaussagen:" for number in range(32)]
+    server = stub_server(delay=lambda prompt: 0.02 * (1 - int(prompt.split()[1]) / 32))
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub', max_concurrency=4)
+
+    try:
+        results = [result[0]["generated_text"] for result in backend(prompts)]
+    finally:
+        backend.close()
+
+    assert results == [prompt + server.fake.answer(prompt) for prompt in prompts]
+    assert server.requests == len(prompts)
+    assert server.max_active <= 4
+    assert len(server.connections) <= 4
+
+
+def test_backend_single_prompt_returns_prompt_and_completion(stub_server):
+    server = stub_server()
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub')
+
+    try:
+        first = backend("Kommentar\nPolarität:")
+        second = backend("Kommentar\nPolarität:")
+    finally:
+        backend.close()
+
+    assert first == second == [{"generated_text": "Kommentar\nPolarität:" + server.fake.answer("Kommentar\nPolarität:")}]
+    assert len(server.connections) == 1
+
+
+def test_backend_classifies_server_errors(stub_server):
+    busy = sd.OpenAICompatibleBackend(stub_server(failures=1, status=503).url, 'stub')
+    rejected = sd.OpenAICompatibleBackend(stub_server(failures=1, status=400).url, 'stub')
+
+    with pytest.raises(sd.BackendError) as busy_error:
+        busy.complete("Prompt")
+    with pytest.raises(sd.BackendError) as rejected_error:
+        rejected.complete("Prompt")
+
+    assert busy_error.value.transient
+    assert not rejected_error.value.transient
+    busy.close()
+    rejected.close()
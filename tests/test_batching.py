@@ -0,0 +1,34 @@
+import pytest
+
+import stancedetection_code as sd
+from benchmark import FakePipe
+
+
+class RecordingPipe(FakePipe):
+    # Erfasst die Reihenfolge, in der die Prompts die Pipeline erreichen
+    def __init__(self):
+        super().__init__(token_latency=0)
+        self.received = []
+
+    def iterate(self, prompts, batch_size: int = None):
+        def record():
+            for prompt in prompts:
+                self.received.append(prompt)
+                yield prompt
+        return super().iterate(record(), batch_size)
+
+
+@pytest.mark.parametrize('batch_size, bucket_window', [(2, 1), (3, 4), (8, 16)])
+def test_run_stance_batches_returns_results_in_prompt_order(batch_size, bucket_window):
+    # Abwechselnd lange und kurze Kommentare, damit die Sortierung nach Länge die Reihenfolge ändert
+    prompts = [sd.StancePrompt(aspect_id, f"Hauptaussage {aspect_id}", f"k{number}", f"Kommentar {number} " + "lang " * (number % 5) * 20)
+               for aspect_id in range(3) for number in range(11)]
+    pipe = RecordingPipe()
+
+    results = list(sd.runStanceBatches(prompts, pipe, batch_size, bucket_window))
+
+    assert [prompt_data for prompt_data, _ in results] == prompts
+    assert [result for _, result in results] == [sd.stanceCompletion(prompt_data.prompt, prompt_data.prompt + pipe.answer(prompt_data.prompt))
+                                                 for prompt_data in prompts]
+    assert sorted(pipe.received) == sorted(prompt_data.prompt for prompt_data in prompts)
+    assert pipe.received != [prompt_data.prompt for prompt_data in prompts]
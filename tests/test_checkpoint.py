@@ -0,0 +1,32 @@
+import stancedetection_code as sd
+
+
+def test_checkpoint_skips_torn_last_line_and_continues_after_it(tmp_path):
+    run_dir = str(tmp_path / "run")
+    checkpoint = sd.RunCheckpoint(run_dir)
+    checkpoint.appendTargets("1", ["Aussage A"])
+    checkpoint.appendStance(("1", "k1", "Aussage A"), "Polarität:\nZustimmung")
+    checkpoint.appendStance(("1", "k2", "Aussage A"), "Polarität:\nWiderspruch", extras=[0.25, True])
+    checkpoint.close()
+
+    # Abbruch während des Schreibens eines Eintrags
+    with open(checkpoint.stance_file, 'a', encoding='utf-8') as file:
+        file.write('{"Schlüssel": ["1", "k3", "Aussa')
+
+    resumed = sd.RunCheckpoint(run_dir)
+    assert resumed.completedTargets() == {"1": ["Aussage A"]}
+    assert resumed.completedStances() == {("1", "k1", "Aussage A"): "Polarität:\nZustimmung",
+                                          ("1", "k2", "Aussage A"): "Polarität:\nWiderspruch"}
+    assert resumed.completedStances(extras=True)[("1", "k2", "Aussage A")] == ("Polarität:\nWiderspruch", 0.25, True)
+
+    resumed.appendStance(("1", "k3", "Aussage A"), "Polarität:\nNeutralität")
+    resumed.close()
+
+    assert len(sd.RunCheckpoint(run_dir).completedStances()) == 3
+
+
+def test_checkpoint_rejects_other_settings(tmp_path):
+    run_dir = str(tmp_path / "run")
+    assert sd.RunCheckpoint(run_dir).checkSettings({'model_id': 'a', 'stance_mode': 'generate'})
+    assert sd.RunCheckpoint(run_dir).checkSettings({'model_id': 'a', 'stance_mode': 'generate'})
+    assert not sd.RunCheckpoint(run_dir).checkSettings({'model_id': 'b', 'stance_mode': 'generate'})
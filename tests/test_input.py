@@ -0,0 +1,190 @@
+import json
+import os
+import random
+
+import pytest
+
+import stancedetection_code as sd
+
+COLUMNS = ["contribution_id", "contribution_content"]
+
+
+@pytest.fixture
+def comments_file(tmp_path):
+    comments = [
+        {"k1": {"text": "Radweg &amp; Bäume", "related_node_id": "1"}},
+        None,
+        {"k2": {"text": "Zeile 1\nZeile 2 mit \"Zitat\" und ] sowie [", "related_node_id": "1"}},
+        {"k3": {"text": None, "related_node_id": "2"}},
+        {"k4": {"text": "Umlaute äöüß und Emoji \U0001F6B2", "related_node_id": "2"}},
+        {"k5": {"related_node_id": "3"}},
+    ]
+    path = tmp_path / "comments.json"
+    path.write_text(json.dumps(comments, ensure_ascii=False, indent=1), encoding='utf-8')
+    return str(path)
+
+
+def test_stream_coms_is_independent_of_chunk_boundaries(comments_file):
+    expected = [
+        ("k1", "1", "Radweg & Bäume"),
+        ("k2", "1", "Zeile 1\nZeile 2 mit \"Zitat\" und ] sowie ["),
+        ("k3", "2", None),
+        ("k4", "2", "Umlaute äöüß und Emoji \U0001F6B2"),
+        ("k5", "3", ""),
+    ]
+
+    for chunk_size in list(range(1, 40)) + [1 << 20]:
+        assert list(sd.streamComs(comments_file, chunk_size)) == expected, chunk_size
+
+
+def test_stream_coms_rejects_truncated_file(tmp_path):
+    path = tmp_path / "comments.json"
+    path.write_text('[{"k1": {"text": "a", "related_node_id": "1"}}, {"k2": {"text": "b', encoding='utf-8')
+
+    with pytest.raises(json.JSONDecodeError):
+        list(sd.streamComs(str(path), 8))
+
+
+def test_stream_coms_reads_empty_array(tmp_path):
+    path = tmp_path / "comments.json"
+    path.write_text(' [ ] ', encoding='utf-8')
+
+    assert list(sd.streamComs(str(path), 1)) == []
+
+
+def baselineJoinConsComs(contributions: dict, comments: dict) -> dict:
+    # Ursprünglicher Join über verschachtelte Schleifen als Referenz
+    joinedData = {}
+    for contribution_id, contribution_content in contributions.items():
+        joinedEntry = {'Beitrag': contribution_content, 'Kommentare': {}}
+        for comment_id, comment_data in comments.items():
+            if comment_data['Beitragsnummer'] == str(contribution_id):
+                joinedEntry['Kommentare'][comment_id] = comment_data['Kommentartext']
+        if joinedEntry['Kommentare']:
+            joinedData[contribution_id] = joinedEntry
+    return joinedData
+
+
+def ordered(joined: dict) -> list:
+    return [(con_id, entry['Beitrag'], list(entry['Kommentare'].items())) for con_id, entry in joined.items()]
+
+
+def seededJoinInput(seed: int) -> tuple:
+    rng = random.Random(seed)
+    # Beitrags-IDs in zufälliger Reihenfolge, teils ohne Kommentare; Kommentare teils zu unbekannten Beiträgen
+    contribution_ids = rng.sample(range(1, 200), 60)
+    contributions = {contribution_id: f"Beitrag {contribution_id}" for contribution_id in contribution_ids}
+    comments = {f"k{rng.randrange(10 ** 6)}-{number}": {'Beitragsnummer': str(rng.choice(contribution_ids[:45] + [500, 501])),
+                                                        'Kommentartext': f"Kommentar {number}"}
+                for number in range(400)}
+    return contributions, comments
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_join_cons_coms_matches_nested_loop_baseline(seed):
+    contributions, comments = seededJoinInput(seed)
+
+    joined = sd.joinConsComs(contributions, comments)
+
+    assert joined == baselineJoinConsComs(contributions, comments)
+    # Auch die Reihenfolge der Beiträge und der Kommentare je Beitrag bleibt erhalten
+    assert ordered(joined) == ordered(baselineJoinConsComs(contributions, comments))
+
+
+def test_join_cons_coms_matches_integer_related_node_id():
+    contributions, comments = seededJoinInput(0)
+    # Im JSON als Zahl angegebene Beitrags-IDs werden wie ihre Darstellung als Zeichenfolge zugeordnet
+    integer_comments = {comment_id: {**comment_data, 'Beitragsnummer': int(comment_data['Beitragsnummer'])} if number % 2 else comment_data
+                        for number, (comment_id, comment_data) in enumerate(comments.items())}
+
+    joined = sd.joinConsComs(contributions, integer_comments)
+
+    assert ordered(joined) == ordered(baselineJoinConsComs(contributions, comments))
+
+
+@pytest.fixture
+def excel_file(tmp_path):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    pytest.importorskip('openpyxl')
+
+    path = str(tmp_path / "beitraege.xlsx")
+    pd.DataFrame({"contribution_id": [2, 1], "contribution_content": ["Bäume", "Radweg"]}).to_excel(path, index=False)
+    return path
+
+
+def rejectExcel(*args, **kwargs):
+    raise AssertionError("Die Excel-Datei darf nicht erneut gelesen werden")
+
+
+def test_read_excel_cached_reuses_copy(excel_file, monkeypatch):
+    import pandas as pd
+
+    first = sd.readExcelCached(excel_file, COLUMNS)
+    monkeypatch.setattr(pd, 'read_excel', rejectExcel)
+    second = sd.readExcelCached(excel_file, COLUMNS)
+
+    assert second.equals(first)
+    assert first["contribution_content"].tolist() == ["Bäume", "Radweg"]
+
+
+def test_read_excel_cached_rereads_changed_file(excel_file):
+    import pandas as pd
+
+    sd.readExcelCached(excel_file, COLUMNS)
+    pd.DataFrame({"contribution_id": [1, 2, 3], "contribution_content": ["Radweg", "Bäume", "Neuer Beitrag mit längerem Text"]}).to_excel(excel_file, index=False)
+    stat = os.stat(excel_file)
+    os.utime(excel_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert sd.readExcelCached(excel_file, COLUMNS)["contribution_content"].tolist() == ["Radweg", "Bäume", "Neuer Beitrag mit längerem Text"]
+
+
+def test_read_excel_cached_uses_hash_when_only_mtime_changed(excel_file, monkeypatch):
+    import pandas as pd
+
+    first = sd.readExcelCached(excel_file, COLUMNS)
+    stat = os.stat(excel_file)
+    os.utime(excel_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    monkeypatch.setattr(pd, 'read_excel', rejectExcel)
+
+    assert sd.readExcelCached(excel_file, COLUMNS).equals(first)
+    # Der neue Änderungszeitpunkt wird übernommen, sodass der Hash nicht erneut berechnet wird
+    with open(excel_file + '.arrow.json', 'r', encoding='utf-8') as file:
+        assert json.load(file)['mtime'] == os.stat(excel_file).st_mtime_ns
+
+
+@pytest.mark.parametrize('delimiter', [',', ';', '\t'])
+def test_import_cons_sniffs_csv_delimiter(tmp_path, delimiter):
+    pytest.importorskip('pandas')
+    path = tmp_path / "beitraege.csv"
+    path.write_text(f"contribution_id{delimiter}contribution_content\n2{delimiter}Bäume\n1{delimiter}\"Radweg, breit; neu\"\n", encoding='utf-8')
+
+    assert sd.importCons(str(path)) == {1: "Radweg, breit; neu", 2: "Bäume"}
+
+
+def test_import_cons_reports_csv_without_required_columns(tmp_path):
+    pytest.importorskip('pandas')
+    path = tmp_path / "beitraege.csv"
+    path.write_text("contribution_id\n1\n2\n", encoding='utf-8')
+
+    assert sd.importCons(str(path)) is None
+
+
+def test_stream_coms_limits_buffer_for_malformed_element(tmp_path):
+    path = tmp_path / "comments.json"
+    # Nicht geschlossene Zeichenfolge im zweiten Element; ohne Begrenzung würde der Rest der Datei gepuffert
+    path.write_text('[{"k1": {"text": "a", "related_node_id": "1"}}, {"k2": {"text": "' + "b" * 100000 + ', {"k3": {}}]', encoding='utf-8')
+
+    comments = sd.streamComs(str(path), chunk_size=64, max_element_size=1000)
+    assert next(comments) == ("k1", "1", "a")
+    with pytest.raises(json.JSONDecodeError, match="maximale Größe") as error:
+        next(comments)
+    assert len(error.value.doc) <= 1000 + 2 * 64
+
+
+def test_stream_coms_reads_element_up_to_maximum_size(tmp_path):
+    path = tmp_path / "comments.json"
+    text = "c" * 900
+    path.write_text(json.dumps([{"k1": {"text": text, "related_node_id": "1"}}]), encoding='utf-8')
+
+    assert list(sd.streamComs(str(path), chunk_size=64, max_element_size=1000)) == [("k1", "1", text)]
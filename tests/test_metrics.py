@@ -0,0 +1,44 @@
+import pytest
+
+import stancedetection_code as sd
+from benchmark import FakePipe
+
+
+def stancePrompts(count: int = 6) -> list:
+    return [sd.StancePrompt(1, "Der Radweg wird gebaut.", f"k{number}", f"Kommentar {number}: Der Radweg ist {'gut' * number}.")
+            for number in range(count)]
+
+
+@pytest.mark.parametrize('batch_size, pack_size', [(1, 1), (2, 1), (1, 3)])
+def test_metrics_count_texts_instead_of_rendered_prompts(batch_size, pack_size):
+    prompts = stancePrompts()
+    counter = sd.TokenCounter()
+    metrics = sd.RunMetrics(counter)
+
+    results = list(sd.computeStanceResults(prompts, FakePipe(token_latency=0), batch_size, pack_size=pack_size, token_counter=counter, metrics=metrics))
+
+    assert len(results) == len(prompts)
+    entry = metrics.entry('stance')
+    assert entry['latencies'] and entry['generated_tokens'] > 0
+    # Vorgehalten werden nur die Texte und leere Vorlagen, keine erzeugten Prompts mit Kommentar
+    for text in counter.counts:
+        assert not any(prompt_data.com_txt in text and text != prompt_data.com_txt for prompt_data in prompts)
+    # Die Zählung aus Texten und Vorlage weicht nur durch das Aufrunden je Bestandteil von der Zählung des Prompts ab
+    rendered = sum(counter.count(prompt_data.prompt, cache=False) for prompt_data in prompts)
+    if pack_size == 1:
+        assert rendered <= entry['prompt_tokens'] <= rendered + 3 * len(prompts)
+
+
+def test_metrics_without_record_calls_count_no_tokens():
+    counter = sd.TokenCounter()
+    metrics = sd.RunMetrics(counter, record_calls=False)
+
+    with metrics.stage('stance', total=6):
+        results = list(sd.computeStanceResults(stancePrompts(), FakePipe(token_latency=0), 1, token_counter=counter, metrics=metrics))
+        metrics.record('targets', 0.1, "Prompt", "Prompt Antwort")
+
+    assert len(results) == 6
+    assert not counter.counts
+    assert metrics.entry('stance')['latencies'] == [] and metrics.entry('stance')['prompt_tokens'] == 0
+    assert metrics.entry('targets')['latencies'] == []
+    assert metrics.entry('stance')['wall_time_s'] is not None
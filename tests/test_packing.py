@@ -0,0 +1,16 @@
+import stancedetection_code as sd
+
+
+def test_parse_packed_stances_reads_numbered_answer_after_prompt():
+    prompt = "Kommentare:\n1. Ablehnung im Prompt\nPolaritäten:"
+    answer = "\n1. Zustimmung\n2) Widerspruch\n- 3: **Neutralität**\n1. Widerspruch\n5. Zustimmung\nx. Zustimmung\n4. Vielleicht"
+
+    assert sd.parsePackedStances(prompt + answer, 4) == {1: 'Zustimmung', 2: 'Widerspruch', 3: 'Neutralität'}
+
+
+def test_parse_packed_stances_accepts_inflected_labels():
+    assert sd.parsePackedStances("Polaritäten:\n1. Zustimmend\n2. widersprüchlich", 2) == {1: 'Zustimmung', 2: 'Widerspruch'}
+
+
+def test_parse_packed_stances_without_marker_uses_whole_text():
+    assert sd.parsePackedStances("2. Neutralität", 2) == {2: 'Neutralität'}
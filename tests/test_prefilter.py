@@ -0,0 +1,90 @@
+import pytest
+
+import stancedetection_code as sd
+
+np = pytest.importorskip('numpy')
+
+ASPECT = "Der Radweg wird gebaut."
+# Normierte Embeddings; die Kosinus-Ähnlichkeit zur Hauptaussage entspricht der ersten Komponente
+VECTORS = {ASPECT: (1.0, 0.0), "gleich": (1.0, 0.0), "orthogonal": (0.0, 1.0), "schräg": (0.6, 0.8), "fern": (0.2, 0.96 ** 0.5)}
+# Polaritäten, die das LLM für die Kommentare liefert
+ANSWERS = {"gleich": "Zustimmung", "orthogonal": "Neutralität", "schräg": "Widerspruch", "fern": "Zustimmung"}
+
+
+class StubEncoder:
+    # Ersatz für SentenceTransformer mit festen Embeddings; erfasst die berechneten Texte
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=False, convert_to_numpy=True, show_progress_bar=False):
+        assert normalize_embeddings and convert_to_numpy
+        self.encoded.extend(texts)
+        return np.array([VECTORS[text] for text in texts], dtype=np.float32)
+
+
+class StubCompute:
+    def __init__(self):
+        self.received = []
+
+    def __call__(self, prompts):
+        self.received.extend(prompts)
+        return [(prompt_data, f"Polarität:\n{ANSWERS[prompt_data.com_txt]}") for prompt_data in prompts]
+
+
+def stancePrompts() -> list:
+    return [sd.StancePrompt(1, ASPECT, f"k{number}", com_txt) for number, com_txt in enumerate(["gleich", "orthogonal", "schräg", "fern", "orthogonal"])]
+
+
+def test_prefilter_skips_dissimilar_pairs_and_keeps_order():
+    encoder, compute = StubEncoder(), StubCompute()
+    embedding_filter = sd.EmbeddingFilter(encoder, threshold=0.3)
+    prompts = stancePrompts()
+
+    results = list(sd.prefilteredStanceResults(prompts, compute, embedding_filter, 'generate', window_size=2))
+
+    assert [prompt_data for prompt_data, *_ in results] == prompts
+    assert [skip for *_, skip in results] == [False, True, False, True, True]
+    assert [similarity for _, _, similarity, _ in results] == pytest.approx([1.0, 0.0, 0.6, 0.2, 0.0], abs=1e-6)
+    assert [result for _, result, _, skip in results if skip] == ["Polarität:\nNeutralität"] * 3
+    assert compute.received == [prompts[0], prompts[2]]
+    assert (embedding_filter.checked, embedding_filter.filtered) == (5, 3)
+    # Jeder Text wird nur einmal eingebettet, auch über mehrere Fenster hinweg
+    assert sorted(encoder.encoded) == sorted(VECTORS)
+    assert embedding_filter.calibration == []
+
+
+def test_prefilter_classify_mode_returns_neutral_distribution():
+    embedding_filter = sd.EmbeddingFilter(StubEncoder(), threshold=0.3)
+
+    results = list(sd.prefilteredStanceResults(stancePrompts()[1:2], StubCompute(), embedding_filter, 'classify'))
+
+    assert results[0][1] == {label: float(label == 'Neutralität') for label in sd.STANCE_LABELS}
+    assert sd.stanceLabel(results[0][1]) == 'Neutralität'
+
+
+def test_calibration_report_compares_prefilter_with_llm():
+    compute = StubCompute()
+    embedding_filter = sd.EmbeddingFilter(StubEncoder(), threshold=0.3, calibration_rate=1.0)
+    prompts = stancePrompts()[:4]
+
+    results = list(sd.prefilteredStanceResults(prompts, compute, embedding_filter, 'generate'))
+
+    # Mit vollständiger Stichprobe wird kein Paar vorgefiltert, aber jedes mit seiner Ähnlichkeit erfasst
+    assert not any(skip for *_, skip in results) and compute.received == prompts
+    report = embedding_filter.calibrationReport(thresholds=(0.1, 0.5))
+    assert (report['threshold'], report['samples'], report['filtered'], report['checked']) == (0.3, 4, 0, 4)
+    assert report['thresholds'] == [
+        {'threshold': 0.1, 'filtered_share': 0.25, 'precision': 1.0, 'recall': 1.0, 'agreement': 1.0},
+        {'threshold': 0.3, 'filtered_share': 0.5, 'precision': 0.5, 'recall': 1.0, 'agreement': 0.75},
+        {'threshold': 0.5, 'filtered_share': 0.5, 'precision': 0.5, 'recall': 1.0, 'agreement': 0.75},
+    ]
+
+
+def test_calibration_sample_depends_only_on_pair():
+    embedding_filter = sd.EmbeddingFilter(StubEncoder(), calibration_rate=0.5)
+    prompts = [sd.StancePrompt(con_id, ASPECT, f"k{number}", "gleich") for con_id in range(20) for number in range(10)]
+
+    sampled = [embedding_filter.sampled(prompt_data) for prompt_data in prompts]
+
+    assert sampled == [embedding_filter.sampled(prompt_data) for prompt_data in prompts]
+    assert 0.35 < sum(sampled) / len(sampled) < 0.65
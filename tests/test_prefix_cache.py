@@ -0,0 +1,81 @@
+import copy
+
+import pytest
+
+import stancedetection_code as sd
+
+
+@pytest.fixture
+def greedy(monkeypatch):
+    monkeypatch.setitem(sd.GENERATION_KWARGS, 'max_new_tokens', 8)
+    monkeypatch.setitem(sd.GENERATION_KWARGS, 'do_sample', False)
+
+
+@pytest.mark.parametrize('com_txt', ["Kommentar zum Radweg", " führendes Leerzeichen", "Leerzeichen am Ende   ", "Zeile 1\nZeile 2", "-"])
+def test_prefix_cache_matches_uncached_prompt(tiny_pipe, com_txt):
+    torch = pytest.importorskip('torch')
+    prefix_cache = sd.PrefixCache(tiny_pipe)
+    parts = sd.stancePromptParts("Der Radweg wird gebaut.", com_txt)
+
+    prompt_ids, prefix_length, prefix_past = sd.splitPromptIds(parts, tiny_pipe, prefix_cache)
+    with torch.no_grad():
+        cached = tiny_pipe.model(input_ids=prompt_ids[:, prefix_length:], past_key_values=copy.deepcopy(prefix_past)).logits[0, -1]
+        uncached = tiny_pipe.model(input_ids=prompt_ids).logits[0, -1]
+
+    # Der Cache wird verwendet und das Modell erhält dieselben Tokens wie ohne Cache
+    assert prefix_past is not None and prefix_length > 0
+    assert prompt_ids.tolist() == tiny_pipe.tokenizer("".join(parts), return_tensors='pt').input_ids.tolist()
+    assert torch.allclose(cached, uncached, atol=1e-4)
+
+
+def test_generate_with_prefix_matches_pipeline(tiny_pipe, greedy):
+    prefix_cache = sd.PrefixCache(tiny_pipe)
+
+    for con_txt in ["Beitrag über den Radweg", "Zweiter Beitrag  mit  Leerraum"]:
+        parts = sd.targetPromptParts(con_txt)
+        assert sd.generateWithPrefix(parts, tiny_pipe, prefix_cache) == tiny_pipe("".join(parts), **sd.GENERATION_KWARGS)[0]["generated_text"]
+
+    assert prefix_cache.misses == 1 and prefix_cache.hits == 1
+
+
+def referenceLabelScores(pipe, prompt: str) -> dict:
+    """
+    Bewertet die Polaritäten ohne Key/Values: je Polarität ein vollständiger Durchlauf über Prompt und Polarität.
+    """
+
+    torch = pytest.importorskip('torch')
+    prompt_ids = pipe.tokenizer(prompt, return_tensors='pt').input_ids
+    scores = []
+    with torch.no_grad():
+        for label in sd.STANCE_LABELS:
+            ids = pipe.tokenizer(prompt + label, return_tensors='pt').input_ids
+            start = sd.commonPrefixLength(prompt_ids, ids)
+            logprobs = torch.log_softmax(pipe.model(input_ids=ids).logits[0, :-1].float(), dim=-1)
+            scores.append(logprobs.gather(1, ids[0, 1:].unsqueeze(1))[start - 1:].sum())
+    return dict(zip(sd.STANCE_LABELS, torch.softmax(torch.stack(scores), dim=0).tolist()))
+
+
+def test_label_scores_use_the_tokens_of_prompt_and_label(tiny_pipe):
+    prefix_cache = sd.PrefixCache(tiny_pipe)
+
+    for com_txt in ["Kommentar zum Radweg", "Noch ein Kommentar"]:
+        parts = sd.stancePromptParts("Der Radweg wird gebaut.", com_txt)
+        expected = referenceLabelScores(tiny_pipe, "".join(parts))
+        prefix_length = sd.splitPromptIds(parts, tiny_pipe, prefix_cache)[1]
+
+        for scores in (sd.scoreStanceLabels(parts, tiny_pipe), sd.scoreStanceLabels(parts, tiny_pipe, prefix_cache=prefix_cache)):
+            assert scores == pytest.approx(expected, abs=1e-5)
+        # Der Eintrag des Präfix-Caches wird nach der Bewertung auf seine ursprüngliche Länge zurückgesetzt
+        assert prefix_cache.lookup(parts[:-1])[1].get_seq_length() == prefix_length
+
+
+def test_label_tokens_differ_from_separately_tokenized_labels(tiny_pipe):
+    tokenize = lambda text: tiny_pipe.tokenizer(text, return_tensors='pt').input_ids
+    prompt = "".join(sd.stancePromptParts("Der Radweg wird gebaut.", "Kommentar"))
+
+    for label in sd.STANCE_LABELS:
+        ids = tokenize(prompt + label)
+        continuation = ids[0, sd.commonPrefixLength(tokenize(prompt), ids):].tolist()
+        # Einzeln tokenisiert erhielte die Polarität ein eigenes führendes "▁" nach dem Leerraum des Prompts
+        assert continuation != tiny_pipe.tokenizer(label, add_special_tokens=False).input_ids
+        assert tiny_pipe.tokenizer.decode(continuation).strip().endswith(label)
@@ -0,0 +1,97 @@
+import csv
+import os
+
+import pytest
+
+import stancedetection_code as sd
+from benchmark import FakePipe
+
+
+class FailingPipe:
+    def __call__(self, *args, **kwargs):
+        raise AssertionError("Übernommene Ergebnisse dürfen nicht erneut verarbeitet werden")
+
+
+def runStages(contributions: dict, entries: dict, output_dir: str, pipe, previous_run: sd.PreviousRun = None) -> None:
+    previous_targets = previous_run.completedTargets(contributions) if previous_run is not None else None
+    previous_stances = previous_run.completedStances(entries) if previous_run is not None else None
+    targets = sd.extractTargetsInContributions(sd.generatePromptsForTargetIdentification(contributions), pipe, previous_targets=previous_targets)
+    sd.saveTargets(contributions, targets, os.path.join(output_dir, 'Targets.csv'))
+    sd.saveStance(sd.generatePromptsForStanceDetection(targets, entries), pipe, contributions, os.path.join(output_dir, 'Stance.csv'),
+                  previous_stances=previous_stances)
+
+
+def readFile(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def test_previous_run_round_trip_reuses_all_results(tmp_path):
+    contributions = {1: "Beitrag über den Radweg", 2: "Beitrag über Bäume; mit \"Zitat\""}
+    entries = {con_id: {'Beitrag': con_txt, 'Kommentare': {f"k{con_id}-{number}": f"Kommentar {number}\nmit Umbruch; und Trenner" for number in range(3)}}
+               for con_id, con_txt in contributions.items()}
+    settings = {'model_id': 'stub', 'stance_mode': 'generate'}
+    first_dir, second_dir = tmp_path / "first", tmp_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+
+    runStages(contributions, entries, str(first_dir), FakePipe(token_latency=0))
+    sd.PreviousRun.saveSettings(str(first_dir), settings)
+    runStages(contributions, entries, str(second_dir), FailingPipe(), sd.PreviousRun(str(first_dir), settings))
+
+    for name in ('Targets.csv', 'Stance.csv'):
+        assert readFile(str(second_dir / name)) == readFile(str(first_dir / name))
+
+
+def test_previous_run_ignores_mismatched_or_unfinished_results(tmp_path):
+    contributions = {1: "Beitrag über den Radweg"}
+    entries = {1: {'Beitrag': contributions[1], 'Kommentare': {"k1": "Kommentar A", "k2": "Kommentar B"}}}
+    settings = {'model_id': 'stub', 'stance_mode': 'generate'}
+    runStages(contributions, entries, str(tmp_path), FakePipe(token_latency=0))
+
+    # Ohne abgelegte Einstellungen werden keine Ergebnisse übernommen
+    assert sd.PreviousRun(str(tmp_path), settings).completedStances(entries) == {}
+
+    sd.PreviousRun.saveSettings(str(tmp_path), settings)
+    assert sd.PreviousRun(str(tmp_path), {**settings, 'model_id': 'other'}).completedTargets(contributions) == {}
+    assert sd.PreviousRun(str(tmp_path), {**settings, 'pack_size': 4}).completedStances(entries) == {}
+    assert len(sd.PreviousRun(str(tmp_path), {**settings, 'pack_size': 4}).completedTargets(contributions)) == 1
+
+    # Geänderte Kommentare und Paare ohne erkannte Polarität werden neu verarbeitet
+    stance_file = str(tmp_path / 'Stance.csv')
+    with open(stance_file, 'r', newline='', encoding='utf-8') as file:
+        rows = list(csv.DictReader(file, delimiter=';'))
+    rows[0]['Haltung'] = 'Unbekannt'
+    with open(stance_file, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]), delimiter=';')
+        writer.writeheader()
+        writer.writerows(rows)
+    entries[1]['Kommentare']['k2'] = "Kommentar B, bearbeitet"
+
+    completed = sd.PreviousRun(str(tmp_path), settings).completedStances(entries)
+    expected = {(row['Beitrags-ID'], row['Kommentar-ID'], row['Hauptaussage']) for row in rows[1:] if row['Kommentar-ID'] == 'k1'}
+    assert expected and set(completed) == expected
+
+
+def test_aborted_run_leaves_no_settings_for_partial_outputs(tmp_path, stub_server, monkeypatch):
+    from benchmark import writeCorpus
+
+    paths = writeCorpus(str(tmp_path), 20, formats=('csv',))
+    server = stub_server()
+    output_dir = tmp_path / "run"
+    options = dict(backend='openai', server_url=server.url, model_id='stub', run_dir=str(output_dir))
+
+    sd.main(paths['csv'], paths['json'], str(tmp_path / "missing_key.txt"), **options)
+    assert (output_dir / sd.PreviousRun.SETTINGS_FILE).exists()
+
+    # Abbruch nach dem Überschreiben von Targets.csv: die Einstellungen des früheren Durchlaufs gelten nicht mehr
+    def failingSaveStance(*args, **kwargs):
+        raise RuntimeError("Abbruch")
+
+    monkeypatch.setattr(sd, 'saveStance', failingSaveStance)
+    with pytest.raises(RuntimeError):
+        sd.main(paths['csv'], paths['json'], str(tmp_path / "missing_key.txt"), **options)
+
+    assert (output_dir / 'Targets.csv').exists()
+    assert not (output_dir / sd.PreviousRun.SETTINGS_FILE).exists()
+    assert sd.PreviousRun(str(output_dir), {'model_id': 'stub', 'stance_mode': 'generate'}).completedTargets({1: "Beitrag"}) == {}
@@ -0,0 +1,52 @@
+import itertools
+
+import pytest
+
+import stancedetection_code as sd
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Streng monoton steigende Zeitstempel, damit die Reihenfolge der Nutzung eindeutig ist
+    ticks = itertools.count(1)
+    monkeypatch.setattr(sd.time, 'time', lambda: float(next(ticks)))
+
+
+def test_result_cache_evicts_least_recently_used_down_to_90_percent(tmp_path, clock):
+    cache = sd.ResultCache(str(tmp_path / "cache.sqlite"), 'stub', max_entries=10)
+    for number in range(10):
+        cache.put('targets', [f"Aussage {number}"], f"Beitrag {number}")
+    # Überschreiben vorhandener Einträge löst keine Verdrängung aus
+    cache.put('targets', ["Aussage 0"], "Beitrag 0")
+    assert cache.size == 10
+
+    assert cache.get('targets', "Beitrag 0") == ["Aussage 0"]
+    assert cache.get('targets', "Beitrag 1") == ["Aussage 1"]
+    cache.put('targets', ["Aussage 10"], "Beitrag 10")
+
+    # 11 Einträge überschreiten das Maximum; entfernt werden die zwei am längsten nicht genutzten (Beitrag 2 und 3)
+    assert cache.size == 9
+    assert cache.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 9
+    assert cache.get('targets', "Beitrag 2") is None
+    assert cache.get('targets', "Beitrag 3") is None
+    for number in (0, 1, 4, 9, 10):
+        assert cache.get('targets', f"Beitrag {number}") == [f"Aussage {number}"]
+    assert (cache.hits, cache.misses) == (7, 2)
+    cache.close()
+
+    reopened = sd.ResultCache(str(tmp_path / "cache.sqlite"), 'stub', max_entries=10)
+    assert reopened.size == 9 and (reopened.hits, reopened.misses) == (0, 0)
+    reopened.close()
+
+
+def test_result_cache_separates_models_and_kinds(tmp_path):
+    cache = sd.ResultCache(str(tmp_path / "cache.sqlite"), 'stub')
+    other_model = sd.ResultCache(str(tmp_path / "cache.sqlite"), 'other')
+    cache.put('stance-generate', "Polarität:\nZustimmung", "Aussage", "Kommentar")
+
+    assert cache.get('stance-generate', "Aussage", "Kommentar") == "Polarität:\nZustimmung"
+    assert cache.get('stance-classify', "Aussage", "Kommentar") is None
+    assert other_model.get('stance-generate', "Aussage", "Kommentar") is None
+    assert (cache.hits, cache.misses, other_model.misses) == (1, 1, 1)
+    cache.close()
+    other_model.close()
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import zlib
+
+import pytest
+
+import stancedetection_code as sd
+
+
+def schedulerInputs(num_contributions: int = 4, num_comments: int = 3) -> tuple:
+    contributions = {con_id: f"Beitrag {con_id} über den Radweg" for con_id in range(1, num_contributions + 1)}
+    entries = {con_id: {'Beitrag': con_txt, 'Kommentare': {f"k{con_id}-{number}": f"Kommentar {number} zu {con_id}" for number in range(num_comments)}}
+               for con_id, con_txt in contributions.items()}
+    return sd.generatePromptsForTargetIdentification(contributions), entries
+
+
+def test_scheduler_retries_transient_errors(stub_server):
+    server = stub_server(failures=2, status=503)
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub', max_concurrency=4)
+    target_prompts, entries = schedulerInputs()
+    scheduler = sd.AsyncScheduler(backend, max_in_flight=4, max_retries=3, retry_delay=0.001)
+
+    try:
+        targets, stance_results = asyncio.run(scheduler.run(target_prompts, entries))
+    finally:
+        backend.close()
+
+    pairs = sum(len(targets[str(con_id)]) * len(entry['Kommentare']) for con_id, entry in entries.items())
+    assert all(len(statements) == server.fake.targets_per_contribution for statements in targets.values())
+    assert len(stance_results) == pairs
+    assert all(sd.parseStance(result)[0] in sd.STANCE_LABELS for result in stance_results.values())
+    # Jeder Prompt wurde zweimal abgelehnt und beim dritten Versuch beantwortet
+    assert set(server.attempts.values()) == {3}
+
+
+def test_scheduler_gives_up_after_max_retries(stub_server):
+    server = stub_server(failures=10, status=503)
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub')
+    target_prompts, entries = schedulerInputs(num_contributions=1)
+    scheduler = sd.AsyncScheduler(backend, max_in_flight=1, max_retries=2, retry_delay=0.001)
+
+    with pytest.raises(sd.BackendError):
+        asyncio.run(scheduler.run(target_prompts, entries))
+    backend.close()
+
+    assert server.requests == 3
+
+
+def test_scheduler_does_not_retry_permanent_errors(stub_server):
+    server = stub_server(failures=10, status=400)
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub')
+    target_prompts, entries = schedulerInputs(num_contributions=1)
+    scheduler = sd.AsyncScheduler(backend, max_in_flight=1, max_retries=3, retry_delay=0.001)
+
+    with pytest.raises(sd.BackendError):
+        asyncio.run(scheduler.run(target_prompts, entries))
+    backend.close()
+
+    assert server.requests == 1
+
+
+def test_scheduler_bounds_requests_in_flight_with_small_queues(stub_server):
+    # Mit Warteschlangen der Größe 1 müssen beide Stufen ohne Verklemmung abwechselnd fortschreiten
+    server = stub_server(delay=lambda prompt: 0.001 * (zlib.crc32(prompt.encode('utf-8')) % 5))
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub', max_concurrency=8)
+    target_prompts, entries = schedulerInputs(num_contributions=6, num_comments=4)
+    scheduler = sd.AsyncScheduler(backend, max_in_flight=3, queue_size=1, retry_delay=0.001)
+
+    try:
+        targets, stance_results = asyncio.run(asyncio.wait_for(scheduler.run(target_prompts, entries), timeout=30))
+    finally:
+        backend.close()
+
+    assert len(targets) == 6
+    assert len(stance_results) == 6 * server.fake.targets_per_contribution * 4
+    assert server.max_active <= 3
+
+
+def test_scheduler_shares_cache_with_sequential_path_and_keeps_io_off_event_loop(stub_server, tmp_path, monkeypatch):
+    server = stub_server()
+    backend = sd.OpenAICompatibleBackend(server.url, 'stub', max_concurrency=4)
+    target_prompts, entries = schedulerInputs()
+    result_cache = sd.ResultCache(str(tmp_path / "cache.sqlite"), 'stub')
+    checkpoint = sd.RunCheckpoint(str(tmp_path / "run"))
+
+    # Erfassen der Threads, in denen auf Cache und Fortschrittsprotokoll zugegriffen wird
+    io_threads = set()
+    for target, name in [(result_cache, 'get'), (result_cache, 'put'), (checkpoint, 'appendTargets'), (checkpoint, 'appendStance')]:
+        def recorded(*args, function=getattr(target, name)):
+            io_threads.add(threading.current_thread())
+            return function(*args)
+        monkeypatch.setattr(target, name, recorded)
+
+    scheduler = sd.AsyncScheduler(backend, max_in_flight=4, result_cache=result_cache, checkpoint=checkpoint)
+    try:
+        targets, stance_results = asyncio.run(scheduler.run(target_prompts, entries))
+    finally:
+        backend.close()
+
+    assert io_threads and threading.main_thread() not in io_threads
+    assert checkpoint.completedStances() == stance_results
+
+    # Die sequentielle Verarbeitung findet alle Ergebnisse unter derselben Art und denselben Texten im Cache
+    def rejectCompute(prompts):
+        assert not prompts, "Alle Ergebnisse müssen aus dem Cache stammen"
+        return []
+
+    prompts = list(sd.generatePromptsForStanceDetection(targets, entries))
+    cached = list(sd.cachedStanceResults(prompts, rejectCompute, result_cache, 'generate'))
+    assert {sd.stanceKey(prompt_data): result for prompt_data, result in cached} == stance_results
+    checkpoint.close()
+    result_cache.close()
@@ -0,0 +1,27 @@
+import stancedetection_code as sd
+
+TEXT = ("Der geplante Radweg entlang der Hauptstraße ist längst überfällig, aber die Bäume am Rand sollten unbedingt erhalten bleiben. "
+        "Bitte prüfen Sie auch eine Verlegung auf die Nebenstraße, dort ist weniger Verkehr und mehr Platz für breite Wege.")
+
+
+def assertWithinBudget(counter: sd.TokenCounter, text: str, budgets) -> None:
+    for budget in budgets:
+        truncated = counter.truncate(text, budget)
+        assert counter.count(truncated, cache=False) <= budget, (budget, truncated)
+
+
+def test_truncate_estimate_stays_within_budget():
+    counter = sd.TokenCounter()
+
+    assertWithinBudget(counter, "a" * 400, range(0, 40))
+    assertWithinBudget(counter, TEXT, range(0, 80))
+    assert counter.truncate("a" * 400, 1) == "aaaa"
+    assert counter.truncate(TEXT, None) == TEXT
+
+
+def test_truncate_with_tokenizer_stays_within_budget_and_keeps_both_ends(tiny_pipe):
+    counter = sd.TokenCounter(tiny_pipe.tokenizer)
+
+    assertWithinBudget(counter, TEXT, range(0, counter.count(TEXT) + 2))
+    truncated = counter.truncate(TEXT, counter.count(TEXT) // 2)
+    assert truncated.startswith("Der geplante") and truncated.endswith("breite Wege.") and " […] " in truncated